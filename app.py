@@ -1,8 +1,8 @@
+from startup_timer import startup_timer
 import os
 import logging
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
-from flask_mail import Mail
 from sqlalchemy.orm import DeclarativeBase
 from werkzeug.middleware.proxy_fix import ProxyFix
 
@@ -14,6 +14,8 @@ except ImportError:
     # dotenv not available in production, skip
     pass
 
+startup_timer.mark('framework')
+
 # Configure logging based on environment
 env = os.environ.get('FLASK_ENV', 'production')
 if env == 'development':
@@ -25,7 +27,6 @@ class Base(DeclarativeBase):
     pass
 
 db = SQLAlchemy(model_class=Base)
-mail = Mail()
 
 # Create the app
 app = Flask(__name__)
@@ -83,20 +84,35 @@ app.config['MAIL_DEFAULT_SENDER'] = os.environ.get('MAIL_DEFAULT_SENDER', 'norep
 
 # Initialize extensions
 db.init_app(app)
-mail.init_app(app)
+_mail = None
+
+def get_mail():
+    """Flask-Mail, imported and initialised when the first email is sent"""
+    global _mail
+    if _mail is None:
+        from flask_mail import Mail
+        _mail = Mail(app)
+    return _mail
+
+startup_timer.mark('config')
 
 # Import models and routes
 import models
+startup_timer.mark('models')
 import routes
 import health_check
+startup_timer.mark('routes')
 
 # Initialize database tables only if not on Vercel
 # Vercel serverless functions shouldn't create tables on every request
 if not os.environ.get('VERCEL_ENV'):
     with app.app_context():
         try:
-            db.create_all()
-            app.logger.info("Database tables created successfully")
+            from schema_stamp import ensure_schema
+            if ensure_schema():
+                app.logger.info("Database tables created successfully")
+            else:
+                app.logger.info("Database schema is up to date")
         except Exception as e:
             app.logger.error(f"Database initialization failed: {e}")
             if env == 'development':
@@ -104,3 +120,7 @@ if not os.environ.get('VERCEL_ENV'):
             else:
                 # In production, continue without crashing but log the error
                 app.logger.error("Continuing without database initialization")
+    startup_timer.mark('schema')
+
+startup_timer.finish()
+app.logger.info(f"App started in {startup_timer.stats()['total_ms']:.0f}ms ({startup_timer.summary()})")
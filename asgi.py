@@ -0,0 +1,290 @@
+"""
+ASGI redirect service
+Serves the hot public endpoints (redirects, safe pages, the challenge page and
+challenge verification) on an event loop with async database access, so a
+slow database or network no longer ties up a worker for every redirect in
+flight. It shares the detection engine, link cache, page cache, rate limiter
+and click queue with the Flask app, and routes with the Flask URL map; every
+other path (dashboard, API, unknown links) is handed to the Flask app, which
+runs in a thread pool behind a WSGI adapter.
+
+    uvicorn asgi:application --host 0.0.0.0 --port $PORT --workers 4
+    gunicorn -k uvicorn.workers.UvicornWorker asgi:application
+
+Needs the packages in requirements-asgi.txt.
+"""
+
+import os
+import json
+import asyncio
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from a2wsgi import WSGIMiddleware
+from flask import redirect
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from werkzeug.exceptions import BadRequest, HTTPException
+from werkzeug.http import parse_options_header
+from werkzeug.wrappers import Response as WerkzeugResponse
+
+from app import app, env
+from click_log import click_log
+from click_queue import click_queue
+from link_cache import link_cache
+from page_cache import HTML_CONTENT_TYPE, page_cache
+from routes import rate_limited_response, record_click, route_click, unknown_code_response
+from short_code_filter import short_code_filter
+
+logger = logging.getLogger(__name__)
+
+PAGE_TEMPLATES = {
+    'safe_page': 'safe_page.html',
+    'safe_page_tiktok': 'safe_page_tiktok.html',
+    'safe_page_instagram': 'safe_page_instagram.html',
+    'js_challenge': 'js_challenge.html',
+}
+
+flask_application = WSGIMiddleware(app, workers=int(os.environ.get('ASGI_FLASK_THREADS', '10')))
+
+_engine = None
+_session_factory = None
+
+
+def async_database_url(url: str) -> str:
+    """The app's DATABASE_URL with an asyncio driver"""
+    if url.startswith('postgresql://'):
+        url = 'postgresql+asyncpg://' + url[len('postgresql://'):]
+        # asyncpg takes ssl=, not libpq's sslmode=
+        url = url.replace('sslmode=', 'ssl=')
+    elif url.startswith('sqlite://'):
+        url = 'sqlite+aiosqlite://' + url[len('sqlite://'):]
+    return url
+
+
+def session_factory():
+    """AsyncSession factory, created on first use inside the worker's event loop"""
+    global _engine, _session_factory
+    if _session_factory is None:
+        url = async_database_url(app.config['SQLALCHEMY_DATABASE_URI'])
+        options = {'pool_pre_ping': True}
+        if not url.startswith('sqlite'):
+            options.update(pool_recycle=300,
+                           pool_size=int(os.environ.get('ASGI_DB_POOL_SIZE', '20')),
+                           max_overflow=int(os.environ.get('ASGI_DB_MAX_OVERFLOW', '20')))
+        _engine = create_async_engine(url, **options)
+        _session_factory = async_sessionmaker(_engine, expire_on_commit=False)
+    return _session_factory
+
+
+class ASGIRequest:
+    """The parts of an HTTP scope the hot endpoints read"""
+
+    def __init__(self, scope: Dict):
+        self.scope = scope
+        self.method = scope['method']
+        # Same names and order as dict(flask.request.headers), which the
+        # header fingerprint depends on
+        headers: Dict[str, str] = {}
+        for raw_name, raw_value in scope['headers']:
+            name = raw_name.decode('latin-1').title()
+            value = raw_value.decode('latin-1')
+            headers[name] = f"{headers[name]},{value}" if name in headers else value
+        self.headers = headers
+
+        client = scope.get('client')
+        # Never None: detection falls back to flask.request for a missing IP, which isn't there
+        self.remote_addr = client[0] if client else ''
+        self.scheme = scope.get('scheme', 'http')
+        self.host = headers.get('Host', '')
+        if env == 'production':
+            # Trust one proxy hop, like the ProxyFix the Flask app runs behind
+            self.remote_addr = _last_forwarded(headers.get('X-Forwarded-For')) or self.remote_addr
+            self.scheme = _last_forwarded(headers.get('X-Forwarded-Proto')) or self.scheme
+            self.host = _last_forwarded(headers.get('X-Forwarded-Host')) or self.host
+        self.root_path = scope.get('root_path', '')
+        self.root_url = f"{self.scheme}://{self.host}{self.root_path}/"
+
+
+def _last_forwarded(value: Optional[str]) -> Optional[str]:
+    if not value:
+        return None
+    return value.rsplit(',', 1)[-1].strip() or None
+
+
+async def application(scope, receive, send):
+    """Entry point: hot endpoints here, everything else in the Flask app"""
+    if scope['type'] == 'lifespan':
+        await _lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        await flask_application(scope, receive, send)
+        return
+
+    request = ASGIRequest(scope)
+    adapter = app.url_map.bind(request.host, script_name=request.root_path or None,
+                               url_scheme=request.scheme)
+    try:
+        endpoint, arguments = adapter.match(scope['path'], request.method)
+    except HTTPException:
+        # Not found, wrong method or a canonical-URL redirect: Flask answers those
+        endpoint, arguments = None, None
+
+    handled = None
+    if endpoint == 'smart_redirect':
+        handled = await _redirect(request, adapter, **arguments)
+    elif endpoint in PAGE_TEMPLATES:
+        handled = await _page(request, PAGE_TEMPLATES[endpoint], **arguments)
+    elif endpoint == 'verify_js_challenge':
+        handled = await _verify(request, adapter, receive, **arguments)
+
+    if handled is None:
+        await flask_application(scope, receive, send)
+        return
+    status, headers, body = handled
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                            for name, value in headers]})
+    await send({'type': 'http.response.body', 'body': b'' if request.method == 'HEAD' else body})
+
+
+Handled = Optional[Tuple[int, List[Tuple[str, str]], bytes]]
+
+
+def _flask_response(rv) -> Tuple[int, List[Tuple[str, str]], bytes]:
+    # make_response would need a request context to coerce a plain werkzeug response
+    response = rv if isinstance(rv, WerkzeugResponse) else app.make_response(rv)
+    return response.status_code, response.headers.to_wsgi_list(), response.get_data()
+
+
+def _url_builder(adapter):
+    def build_url(endpoint: str, short_code: str) -> str:
+        return adapter.build(endpoint, {'short_code': short_code}, force_external=True)
+    return build_url
+
+
+async def _redirect(request: ASGIRequest, adapter, short_code: str) -> Handled:
+    """smart_redirect on the event loop"""
+    if not short_code_filter.may_exist(short_code):
+        return _flask_response(unknown_code_response())
+
+    build_url = _url_builder(adapter)
+    with app.app_context():
+        limited = rate_limited_response('redirect', short_code, client_ip=request.remote_addr,
+                                        safe_url=build_url('safe_page', short_code))
+        if limited:
+            return _flask_response(limited)
+
+        smart_link = await link_cache.resolve_async(short_code, session_factory())
+        if not smart_link:
+            return None
+
+        if smart_link.custom_domain and smart_link.custom_domain != request.host and smart_link.canonical_url:
+            return _flask_response(redirect(smart_link.canonical_url, code=301))
+
+        headers = request.headers
+        redirect_url, click = route_click(smart_link, short_code, headers.get('User-Agent', ''),
+                                          headers.get('Referer', ''), request.remote_addr, headers,
+                                          request.root_url, build_url)
+        await _record_click(click)
+        return _flask_response(redirect(redirect_url))
+
+
+async def _record_click(click: Dict):
+    if click_log.enabled or click_queue.enabled:
+        # Never wait on a full queue here: that would stall every request on the loop
+        record_click(click, enqueue_timeout=0)
+        return
+    # Inline writes (CLICK_QUEUE=0) block, so they go to a thread
+    await asyncio.get_running_loop().run_in_executor(None, _record_click_inline, click)
+
+
+def _record_click_inline(click: Dict):
+    with app.app_context():
+        record_click(click)
+
+
+async def _page(request: ASGIRequest, template: str, short_code: str) -> Handled:
+    """Safe and challenge pages from the page cache"""
+    if not short_code_filter.may_exist(short_code):
+        return _flask_response(unknown_code_response())
+    smart_link = await link_cache.resolve_async(short_code, session_factory())
+    if not smart_link:
+        return None
+    page = page_cache.cached(template, smart_link)
+    if page is None:
+        # The templates build URLs with url_for, which needs a request context
+        with app.test_request_context(request.scope.get('path', '/'), base_url=request.root_url):
+            page = page_cache.page(template, smart_link)
+    headers = request.headers
+    status, body, page_headers = page_cache.select(page, headers.get('Accept-Encoding', ''),
+                                                   headers.get('If-None-Match'),
+                                                   headers.get('If-Modified-Since'))
+    response_headers = list(page_headers)
+    if status != 304:
+        response_headers += [('Content-Type', HTML_CONTENT_TYPE), ('Content-Length', str(len(body)))]
+    return status, response_headers, body
+
+
+async def _verify(request: ASGIRequest, adapter, receive, short_code: str) -> Handled:
+    """verify_js_challenge on the event loop"""
+    mimetype = parse_options_header(request.headers.get('Content-Type', ''))[0]
+    if not (mimetype == 'application/json' or
+            (mimetype.startswith('application/') and mimetype.endswith('+json'))):
+        # Flask rejects these (415); the body hasn't been read, so it can still answer
+        return None
+
+    if not short_code_filter.may_exist(short_code):
+        return _flask_response(unknown_code_response())
+
+    build_url = _url_builder(adapter)
+    with app.app_context():
+        limited = rate_limited_response('verify', short_code, client_ip=request.remote_addr,
+                                        safe_url=build_url('safe_page', short_code))
+        if limited:
+            return _flask_response(limited)
+
+        smart_link = await link_cache.resolve_async(short_code, session_factory())
+        if not smart_link:
+            return None
+
+        try:
+            payload = json.loads(await _read_body(receive))
+        except ValueError:
+            payload = None
+        if not isinstance(payload, dict):
+            return _flask_response(BadRequest().get_response())
+
+        if payload.get('challenge_response') == payload.get('expected_response'):
+            # Challenge passed - redirect to target
+            result = {'success': True, 'redirect_url': smart_link.target_url}
+        else:
+            # Challenge failed - send to safe page
+            result = {'success': False, 'redirect_url': build_url('safe_page', short_code)}
+        return _flask_response(result)
+
+
+async def _read_body(receive) -> bytes:
+    chunks = []
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            break
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body'):
+            break
+    return b''.join(chunks)
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            if _engine is not None:
+                await _engine.dispose()
+            # Blocking, but nothing else runs on the loop any more
+            click_queue.shutdown()
+            click_log.close()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
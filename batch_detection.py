@@ -0,0 +1,253 @@
+"""
+Batched detection for bulk classification
+Runs each detection method once per distinct input value and combines the
+scores with NumPy array operations, so millions of historical Click rows (or a
+candidate signature set) can be evaluated offline without a request context.
+"""
+
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Sequence
+
+try:
+    import numpy as np
+except ImportError:  # numpy is only needed for offline batch work
+    np = None
+
+from detection_engine import (
+    AdvancedDetectionEngine, DetectionResult, EXPECTED_BROWSER_HEADERS, AUTOMATION_HEADERS,
+    FALLBACK_TIKTOK_KEYWORDS, FALLBACK_INSTAGRAM_KEYWORDS, PLATFORM_PRIORITY, detection_engine
+)
+from header_fingerprint import header_fingerprint
+
+RISK_LEVELS = ['low', 'medium', 'high', 'critical']
+
+# Which request columns each method reads. Methods mapped to None depend on
+# live per-client state and are skipped; unlisted methods get every column.
+BATCH_METHOD_INPUTS = {
+    'user_agent': ('user_agent',),
+    'ip_analysis': ('ip_address',),
+    'header_fingerprint': ('headers',),
+    'header_order': ('user_agent', 'headers'),
+    'timing_analysis': None,
+    'behavioral_patterns': ('referrer',),
+    'platform_specific': ('user_agent', 'ip_address', 'referrer'),
+}
+
+
+@dataclass
+class BatchDetectionResult:
+    """Column-oriented detection results, one entry per input row"""
+    is_bot: 'np.ndarray'          # bool
+    confidence: 'np.ndarray'      # float64, 0.0 to 1.0
+    platform: 'np.ndarray'        # object (str)
+    risk_level: 'np.ndarray'      # object (str)
+    method_mask: 'np.ndarray'     # uint32, bit i = method_names[i] fired
+    method_names: List[str]
+    scores: 'np.ndarray' = None   # float64 (rows x method_names), NaN where a method didn't fire
+
+    def __len__(self) -> int:
+        return len(self.confidence)
+
+    def decode_methods(self, mask: int) -> List[str]:
+        """Method names set in a bitmask"""
+        return [name for bit, name in enumerate(self.method_names) if mask & (1 << bit)]
+
+    def row(self, index: int) -> DetectionResult:
+        """Single row as a DetectionResult"""
+        methods = self.decode_methods(int(self.method_mask[index]))
+        method_scores = {}
+        if self.scores is not None:
+            method_scores = {name: float(self.scores[index, self.method_names.index(name)]) for name in methods}
+        return DetectionResult(
+            is_bot=bool(self.is_bot[index]),
+            confidence_score=float(self.confidence[index]),
+            platform=self.platform[index],
+            detection_methods=methods,
+            risk_level=self.risk_level[index],
+            method_scores=method_scores
+        )
+
+
+def _require_numpy():
+    if np is None:
+        raise RuntimeError("Batch detection needs numpy - install it with 'pip install numpy'")
+
+
+def _encode(values: Sequence) -> tuple:
+    """Dictionary-encode a column: (unique values, per-row codes)"""
+    codes: Dict = {}
+    inverse = np.fromiter((codes.setdefault(value, len(codes)) for value in values),
+                          dtype=np.int64, count=len(values))
+    return list(codes), inverse
+
+
+def _header_key(headers: Dict) -> tuple:
+    """Hashable stand-in for a header dict (only the fields the engine reads)"""
+    if not headers:
+        return ()
+    return (
+        tuple(name in headers for name in EXPECTED_BROWSER_HEADERS + AUTOMATION_HEADERS),
+        headers.get('Accept', ''),
+        headers.get('Connection', ''),
+        header_fingerprint(headers),
+    )
+
+
+def _column(values: Optional[Iterable], size: int, default) -> list:
+    if values is None:
+        return [default] * size
+    column = [default if value is None else value for value in values]
+    if len(column) != size:
+        raise ValueError(f"Column length {len(column)} does not match {size} user agents")
+    return column
+
+
+def analyze_batch(user_agents: Iterable[str], ip_addresses: Iterable[str] = None,
+                  referrers: Iterable[str] = None, headers: Iterable[Dict] = None,
+                  engine: AdvancedDetectionEngine = None,
+                  skip_methods: Iterable[str] = ()) -> BatchDetectionResult:
+    """Classify many requests at once
+
+    Produces the same verdicts as ``engine.analyze_request`` row by row,
+    except that live-state methods (timing analysis) are skipped. Every other
+    method is always evaluated, so confidence and method lists are those of a
+    full evaluation, without the engine's short-circuiting. Methods in
+    ``skip_methods`` are treated as not firing, e.g. header fingerprinting
+    for stored rows whose headers were never recorded.
+    """
+    _require_numpy()
+    engine = engine or detection_engine
+
+    ua_column = [ua or '' for ua in user_agents]
+    size = len(ua_column)
+    columns = {
+        'user_agent': ua_column,
+        'ip_address': _column(ip_addresses, size, ''),
+        'referrer': _column(referrers, size, ''),
+        'headers': _column(headers, size, {}),
+    }
+
+    # Dictionary-encode every column once
+    encoded = {}
+    for name in ('user_agent', 'ip_address', 'referrer'):
+        encoded[name] = _encode(columns[name])
+    header_keys, header_inverse = _encode([_header_key(h) for h in columns['headers']])
+    header_samples: List[Dict] = [None] * len(header_keys)
+    for row, code in enumerate(header_inverse):
+        if header_samples[code] is None:
+            header_samples[code] = columns['headers'][row]
+    encoded['headers'] = (header_samples, header_inverse)
+
+    method_names = list(engine.detection_methods)
+    scores = np.full((size, len(method_names)), np.nan)
+    platform_names: List[str] = []
+    platform_codes = np.full((size, len(method_names)), -1, dtype=np.int64)
+
+    for column_index, (method_name, method_func) in enumerate(engine.detection_methods.items()):
+        inputs = BATCH_METHOD_INPUTS.get(method_name, ('user_agent', 'ip_address', 'referrer', 'headers'))
+        if inputs is None or method_name in skip_methods:
+            continue
+
+        # Rows that share every input this method reads share its result
+        if len(inputs) == 1:
+            samples, inverse = encoded[inputs[0]]
+            combos = [{inputs[0]: value} for value in samples]
+        else:
+            stacked = np.stack([encoded[name][1] for name in inputs], axis=1)
+            unique_rows, inverse = np.unique(stacked, axis=0, return_inverse=True)
+            inverse = inverse.reshape(-1)
+            combos = [
+                {name: encoded[name][0][code] for name, code in zip(inputs, unique_row)}
+                for unique_row in unique_rows
+            ]
+
+        unique_scores = np.full(len(combos), np.nan)
+        unique_platforms = np.full(len(combos), -1, dtype=np.int64)
+        for index, combo in enumerate(combos):
+            try:
+                result = method_func(combo.get('user_agent', ''), combo.get('ip_address', ''),
+                                     combo.get('referrer', ''), combo.get('headers', {}))
+            except Exception:
+                # Same as the engine: a failing method counts as no detection
+                continue
+            if not result:
+                continue
+            unique_scores[index] = result.get('confidence', 0.5)
+            if 'platform' in result:
+                platform = result['platform']
+                if platform not in platform_names:
+                    platform_names.append(platform)
+                unique_platforms[index] = platform_names.index(platform)
+
+        scores[:, column_index] = unique_scores[inverse]
+        platform_codes[:, column_index] = unique_platforms[inverse]
+
+    # Score combination - mirrors AdvancedDetectionEngine._combine
+    hits = ~np.isnan(scores)
+    hit_count = hits.sum(axis=1)
+    high = scores > 0.7
+    has_high = high.any(axis=1)
+    max_high = np.where(high, scores, -np.inf).max(axis=1, initial=-np.inf)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.nansum(scores, axis=1) / hit_count
+    confidence = np.where(has_high, max_high, np.where(hit_count > 0, mean, 0.0))
+
+    high_detections = (scores > 0.8).sum(axis=1)
+    is_bot = (confidence > 0.8) | ((confidence > 0.6) & (high_detections >= 1)) | (hit_count >= 4)
+
+    risk_codes = np.select(
+        [(confidence >= 0.9) | (hit_count >= 4),
+         (confidence >= 0.7) | (hit_count >= 3),
+         (confidence >= 0.5) | (hit_count >= 2)],
+        [3, 2, 1], default=0
+    )
+    risk_level = np.array(RISK_LEVELS, dtype=object)[risk_codes]
+
+    bits = (np.uint32(1) << np.arange(len(method_names), dtype=np.uint32))
+    method_mask = (hits.astype(np.uint32) * bits).sum(axis=1, dtype=np.uint32)
+
+    platform = _primary_platforms(platform_codes, platform_names, encoded)
+
+    return BatchDetectionResult(
+        is_bot=is_bot,
+        confidence=confidence,
+        platform=platform,
+        risk_level=risk_level,
+        method_mask=method_mask,
+        method_names=method_names,
+        scores=scores
+    )
+
+
+def _primary_platforms(platform_codes: 'np.ndarray', platform_names: List[str], encoded: Dict) -> 'np.ndarray':
+    """Vectorised AdvancedDetectionEngine._determine_primary_platform"""
+    size = platform_codes.shape[0]
+    platform = np.full(size, None, dtype=object)
+    decided = np.zeros(size, dtype=bool)
+
+    ordered = [name for name in PLATFORM_PRIORITY if name in platform_names]
+    ordered += [name for name in platform_names if name not in PLATFORM_PRIORITY]
+    for name in ordered:
+        present = (platform_codes == platform_names.index(name)).any(axis=1) & ~decided
+        platform[present] = name
+        decided |= present
+
+    # Fallback keyword detection for rows where no method reported a platform
+    if not decided.all():
+        user_agents, ua_inverse = encoded['user_agent']
+        referrers, ref_inverse = encoded['referrer']
+        pending = np.flatnonzero(~decided)
+        pairs = np.stack([ua_inverse[pending], ref_inverse[pending]], axis=1)
+        unique_pairs, inverse = np.unique(pairs, axis=0, return_inverse=True)
+        fallback = np.empty(len(unique_pairs), dtype=object)
+        for index, (ua_code, ref_code) in enumerate(unique_pairs):
+            text = (user_agents[ua_code] or '').lower() + (referrers[ref_code] or '').lower()
+            if any(keyword in text for keyword in FALLBACK_TIKTOK_KEYWORDS):
+                fallback[index] = 'tiktok'
+            elif any(keyword in text for keyword in FALLBACK_INSTAGRAM_KEYWORDS):
+                fallback[index] = 'instagram'
+            else:
+                fallback[index] = 'unknown'
+        platform[pending] = fallback[inverse.reshape(-1)]
+
+    return platform
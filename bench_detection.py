@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+"""
+Offline detection benchmark
+Runs the detection engine and the utils detectors over the labeled corpus in
+detection_corpus.json and reports ns/op, allocations, throughput, accuracy and
+confusion matrices. A run can be saved as a baseline; comparing against it
+shows the speed change and fails if any verdict changed.
+
+Usage:
+    python bench_detection.py
+    python bench_detection.py --save bench_baseline.json
+    python bench_detection.py --compare bench_baseline.json
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tracemalloc
+from collections import Counter
+
+# The detectors never touch the database, keep the app off the real one
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+import app  # noqa: F401 - utils needs the app initialised first
+import utils
+from detection_engine import AdvancedDetectionEngine
+from ttl_cache import TTLCache
+
+DEFAULT_CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "detection_corpus.json")
+
+
+def load_corpus(path):
+    """Load the corpus and resolve header profiles into header dicts"""
+    with open(path, "r", encoding="utf-8") as handle:
+        corpus = json.load(handle)
+
+    profiles = corpus.get("header_profiles", {})
+    for case in corpus["cases"]:
+        headers = case.get("headers") or {}
+        if isinstance(headers, str):
+            headers = profiles[headers]
+        headers = dict(headers)
+        if case["user_agent"]:
+            headers["User-Agent"] = case["user_agent"]
+        if case.get("referrer"):
+            headers["Referer"] = case["referrer"]
+        case["request_headers"] = headers
+        case["ip_address"] = case.get("ip_address") or ""
+        case["referrer"] = case.get("referrer") or ""
+    return corpus
+
+
+def build_detectors():
+    """Detector name -> (predict(case) -> bool, truth(case) -> bool)"""
+    uncached_engine = AdvancedDetectionEngine()
+    uncached_engine.verdict_cache = TTLCache(maxsize=0, name="disabled")
+    cached_engine = AdvancedDetectionEngine()
+
+    def engine_call(engine):
+        return lambda case: engine.analyze_request(
+            case["user_agent"], case["ip_address"], case["referrer"], case["request_headers"]
+        ).is_bot
+
+    is_bot = lambda case: case["expected"] == "bot"
+    is_tiktok = lambda case: case["expected"] == "bot" and case.get("platform") == "tiktok"
+
+    return {
+        "engine.analyze_request": (engine_call(uncached_engine), is_bot),
+        "engine.analyze_request[cached]": (engine_call(cached_engine), is_bot),
+        "utils.analyze_redirect_request": (
+            lambda case: utils.analyze_redirect_request(
+                case["user_agent"], case["ip_address"], case["referrer"], case["request_headers"]
+            ).is_bot,
+            is_bot),
+        "utils.is_bot_user_agent": (lambda case: utils.is_bot_user_agent(case["user_agent"]), is_bot),
+        "utils.is_social_media_bot": (lambda case: utils.is_social_media_bot(case["user_agent"]), is_bot),
+        "utils.is_tiktok_bot": (
+            lambda case: utils.is_tiktok_bot(case["user_agent"], case["ip_address"]), is_tiktok),
+        "utils.has_suspicious_user_agent": (
+            lambda case: utils.has_suspicious_user_agent(case["user_agent"]), is_bot),
+        "utils.is_suspicious_request": (
+            lambda case: utils.is_suspicious_request(case["request_headers"]), is_bot),
+    }
+
+
+def measure(predict, cases, min_time):
+    """Time one detector over the corpus, returns (ns/op, ops)"""
+    # Warm caches and lazily compiled state before timing
+    for case in cases:
+        predict(case)
+
+    ops = 0
+    elapsed = 0
+    rounds = 1
+    while elapsed < min_time * 1e9:
+        start = time.perf_counter_ns()
+        for _ in range(rounds):
+            for case in cases:
+                predict(case)
+        elapsed += time.perf_counter_ns() - start
+        ops += rounds * len(cases)
+        rounds *= 2
+    return elapsed / ops, ops
+
+
+def measure_allocations(predict, cases):
+    """Average traced allocation per call (peak bytes and blocks still held)
+
+    Includes a small constant from the measurement itself; ``run`` subtracts
+    the figures of a no-op detector.
+    """
+    tracemalloc.start()
+    try:
+        peak_total = 0
+        for case in cases:
+            before = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            predict(case)
+            peak_total += tracemalloc.get_traced_memory()[1] - before
+        snapshot_before = tracemalloc.take_snapshot()
+        for case in cases:
+            predict(case)
+        snapshot_after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+
+    retained = sum(stat.count_diff for stat in snapshot_after.compare_to(snapshot_before, "filename"))
+    return peak_total / len(cases), retained / len(cases)
+
+
+def evaluate(predict, truth, cases):
+    """Per-case verdicts plus the confusion matrix against the labels"""
+    verdicts = {}
+    confusion = Counter()
+    for case in cases:
+        predicted = bool(predict(case))
+        actual = bool(truth(case))
+        verdicts[case["id"]] = predicted
+        confusion[("t" if predicted == actual else "f") + ("p" if predicted else "n")] += 1
+
+    total = len(cases)
+    tp, tn, fp, fn = (confusion[key] for key in ("tp", "tn", "fp", "fn"))
+    return {
+        "verdicts": verdicts,
+        "confusion": {"tp": tp, "fp": fp, "tn": tn, "fn": fn},
+        "accuracy": round((tp + tn) / total, 4) if total else 0.0,
+        "precision": round(tp / (tp + fp), 4) if tp + fp else 0.0,
+        "recall": round(tp / (tp + fn), 4) if tp + fn else 0.0,
+    }
+
+
+def run(corpus, min_time, only=None):
+    cases = corpus["cases"]
+    results = {}
+    overhead_bytes, overhead_blocks = measure_allocations(lambda case: None, cases)
+    for name, (predict, truth) in build_detectors().items():
+        if only and only not in name:
+            continue
+        ns_per_op, ops = measure(predict, cases, min_time)
+        peak_bytes, retained_blocks = measure_allocations(predict, cases)
+        peak_bytes = max(0.0, peak_bytes - overhead_bytes)
+        retained_blocks = max(0.0, retained_blocks - overhead_blocks)
+        result = evaluate(predict, truth, cases)
+        result.update({
+            "ns_per_op": round(ns_per_op, 1),
+            "ops_per_sec": round(1e9 / ns_per_op, 1),
+            "peak_bytes_per_op": round(peak_bytes, 1),
+            "retained_blocks_per_op": round(retained_blocks, 3),
+            "ops": ops,
+        })
+        results[name] = result
+
+    return {
+        "corpus_version": corpus.get("version"),
+        "cases": len(cases),
+        "python": platform.python_version(),
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "detectors": results,
+    }
+
+
+def print_report(report, cases):
+    print(f"📊 Detection benchmark - corpus v{report['corpus_version']}, {report['cases']} cases, "
+          f"Python {report['python']}")
+    print("=" * 100)
+    print(f"{'detector':<34}{'ns/op':>12}{'ops/s':>12}{'peak B/op':>11}{'held/op':>9}"
+          f"{'acc':>7}{'prec':>7}{'recall':>7}")
+    for name, result in report["detectors"].items():
+        print(f"{name:<34}{result['ns_per_op']:>12,.0f}{result['ops_per_sec']:>12,.0f}"
+              f"{result['peak_bytes_per_op']:>11,.0f}{result['retained_blocks_per_op']:>9.2f}"
+              f"{result['accuracy']:>7.2f}{result['precision']:>7.2f}{result['recall']:>7.2f}")
+
+    print("\nConfusion matrices (rows: expected bot / human, columns: predicted bot / human)")
+    for name, result in report["detectors"].items():
+        matrix = result["confusion"]
+        print(f"  {name:<34} bot [{matrix['tp']:>3} {matrix['fn']:>3}]   human [{matrix['fp']:>3} {matrix['tn']:>3}]")
+
+    categories = sorted({case["category"] for case in cases})
+    print("\nAccuracy by category")
+    print(f"  {'detector':<34}" + "".join(f"{category[:12]:>13}" for category in categories))
+    labels = {case["id"]: case for case in cases}
+    for name, result in report["detectors"].items():
+        row = []
+        for category in categories:
+            ids = [case_id for case_id, case in labels.items() if case["category"] == category]
+            correct = sum(1 for case_id in ids
+                          if result["verdicts"][case_id] == (labels[case_id]["expected"] == "bot"))
+            row.append(f"{correct:>4}/{len(ids):<3}")
+        print(f"  {name:<34}" + "".join(f"{cell:>13}" for cell in row))
+
+
+def compare(report, baseline):
+    """Print speed changes against a baseline, returns the number of changed verdicts"""
+    print(f"\n🔁 Comparing against baseline from {baseline.get('created_at', 'unknown')}")
+    if baseline.get("corpus_version") != report["corpus_version"]:
+        print(f"⚠️  Corpus version changed: {baseline.get('corpus_version')} -> {report['corpus_version']}")
+
+    changed = 0
+    for name, result in report["detectors"].items():
+        previous = baseline.get("detectors", {}).get(name)
+        if not previous:
+            print(f"  {name:<34} (not in baseline)")
+            continue
+
+        speedup = previous["ns_per_op"] / result["ns_per_op"] if result["ns_per_op"] else 0.0
+        diffs = [case_id for case_id, verdict in result["verdicts"].items()
+                 if case_id in previous["verdicts"] and previous["verdicts"][case_id] != verdict]
+        changed += len(diffs)
+        status = "✅ verdicts preserved" if not diffs else f"❌ {len(diffs)} verdicts changed"
+        print(f"  {name:<34}{previous['ns_per_op']:>12,.0f} -> {result['ns_per_op']:>10,.0f} ns/op"
+              f"  x{speedup:.2f}  {status}")
+        for case_id in diffs:
+            print(f"      {case_id}: {previous['verdicts'][case_id]} -> {result['verdicts'][case_id]}")
+    return changed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline bot detection benchmark")
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS, help="labeled corpus JSON")
+    parser.add_argument("--min-time", type=float, default=0.5,
+                        help="seconds to spend timing each detector (default 0.5)")
+    parser.add_argument("--only", help="only run detectors whose name contains this text")
+    parser.add_argument("--save", metavar="PATH", help="write the results as a baseline")
+    parser.add_argument("--compare", metavar="PATH", help="compare against a saved baseline")
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus)
+    report = run(corpus, args.min_time, args.only)
+    print_report(report, corpus["cases"])
+
+    exit_code = 0
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as handle:
+            baseline = json.load(handle)
+        if compare(report, baseline):
+            exit_code = 1
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as handle:
+            json.dump(report, handle, indent=2, sort_keys=True)
+        print(f"\n💾 Baseline saved to {args.save}")
+
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Build the cold-start link snapshot
+Writes every active link to the snapshot file that processes memory-map via
+LINK_SNAPSHOT_FILE (see link_snapshot.py). Snapshots older than
+LINK_SNAPSHOT_MAX_AGE (15 minutes by default) are ignored, so keep it running
+with --interval (or from cron) well inside that, writing where the processes
+read it. A snapshot built only in the deploy step covers the first minutes
+after each deploy. The output is replaced atomically.
+
+Usage:
+    python build_link_snapshot.py --output link_snapshot.bin
+    python build_link_snapshot.py --output /var/lib/smartticker/links.bin --interval 60
+"""
+import os
+import sys
+import time
+import argparse
+
+from sqlalchemy.orm import joinedload
+
+from app import app
+from models import SmartLink
+from link_cache import RECORD_FIELDS, LinkRecord
+from link_snapshot import LinkSnapshot, write_snapshot
+
+
+def snapshot_records(batch_size):
+    """{short code: LinkRecord field values} for every active link"""
+    records = {}
+    query = (SmartLink.query
+             .options(joinedload(SmartLink.custom_domain))
+             .filter_by(is_active=True)
+             .order_by(SmartLink.id))
+    for smart_link in query.yield_per(batch_size):
+        record = LinkRecord.from_model(smart_link)
+        records[record.short_code] = [getattr(record, name) for name in RECORD_FIELDS]
+    return records
+
+
+def build_once(args):
+    started = time.monotonic()
+    with app.app_context():
+        records = snapshot_records(args.batch_size)
+    size = write_snapshot(records, RECORD_FIELDS, args.output)
+    # Load it back the way a worker would, so a broken file is caught here
+    snapshot = LinkSnapshot(args.output)
+    print(f"📸 Snapshot of {len(snapshot)} active links written to {args.output} "
+          f"({size:,} bytes, {time.monotonic() - started:.2f}s)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write the active-link snapshot used on cold starts")
+    parser.add_argument('--output', default=os.environ.get('LINK_SNAPSHOT_FILE'),
+                        help="snapshot file to write (default: LINK_SNAPSHOT_FILE)")
+    parser.add_argument('--batch-size', type=int, default=1000, help="links fetched per round trip")
+    parser.add_argument('--interval', type=float, default=0,
+                        help="keep running, rebuilding every N seconds (default: build once and exit)")
+    args = parser.parse_args()
+
+    if not args.output:
+        parser.error("--output or LINK_SNAPSHOT_FILE is required")
+
+    while True:
+        try:
+            build_once(args)
+        except Exception as e:
+            print(f"❌ Failed to build link snapshot: {e}")
+            if not args.interval:
+                return 1
+        if not args.interval:
+            return 0
+        try:
+            time.sleep(args.interval)
+        except KeyboardInterrupt:
+            return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""
+Build a compiled signature pack
+Compiles the signature source (signature_pack.json by default) into the binary
+pack that workers memory-map via SIGNATURE_PACK_FILE. The output is replaced
+atomically, so running workers pick it up on their next check or on the
+reload signal.
+
+Usage:
+    python build_signature_pack.py --output /var/lib/smartticker/signatures.pack
+    python build_signature_pack.py --source my_signatures.json --ranges-file crawlers.txt --output signatures.pack
+    kill -USR2 <worker pids>   # with SIGNATURE_PACK_SIGNAL=SIGUSR2, reload immediately
+"""
+import os
+import sys
+import argparse
+
+from signature_pack import DEFAULT_SOURCE_PATH, SignaturePack, load_source, write_pack
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compile bot signatures and IP ranges into a pack")
+    parser.add_argument('--source', default=DEFAULT_SOURCE_PATH, help="signature source JSON")
+    parser.add_argument('--ranges-file', default=os.environ.get('PLATFORM_IP_RANGES_FILE'),
+                        help="extra platform IP ranges to bake in (default: PLATFORM_IP_RANGES_FILE)")
+    parser.add_argument('--output', required=True, help="pack file to write")
+    args = parser.parse_args()
+
+    try:
+        source = load_source(args.source)
+        size = write_pack(source, args.output, args.ranges_file)
+        # Load it back the way a worker would, so a broken pack is caught here
+        pack = SignaturePack.from_file(args.output)
+    except (OSError, ValueError, KeyError) as e:
+        print(f"❌ Failed to build signature pack: {e}")
+        return 1
+
+    print(f"📦 Signature pack version {pack.version} written to {args.output} ({size:,} bytes)")
+    for name, signature_set in pack.sets.items():
+        print(f"   {name:<20} {len(signature_set):>5} signatures")
+    print(f"   {'header fingerprints':<20} {len(pack.header_fingerprints):>5} fingerprints")
+    print(f"   {'ip ranges':<20} {len(pack.ip_index):>5} ranges")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
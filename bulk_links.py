@@ -0,0 +1,193 @@
+"""
+Bulk link creation, update and deactivation
+Applies a list of link operations for one user in batched transactions. Short
+codes for a batch's new links are allocated up front, the existing links it
+touches are loaded with one query, and the batch commits once. An invalid
+operation is reported and skipped; a batch that fails to commit is reported
+as a whole and the following batches still run.
+
+Operations (JSON objects, or CSV rows in import_links.py):
+    {"action": "create", "title": ..., "target_url": ..., "safe_url": ...,
+     "description": ..., "domain": "links.example.com",
+     "use_js_challenge": true, "direct_from_tiktok": true}
+    {"action": "update", "short_code": ..., <any of the fields above>}
+    {"action": "deactivate", "short_code": ...}
+
+Used by POST /api/links/bulk and import_links.py.
+"""
+
+import os
+from typing import Dict, List, Optional
+from urllib.parse import urlparse
+
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import joinedload
+
+from app import db
+from models import CustomDomain, SmartLink
+from short_codes import short_code_allocator
+
+ACTIONS = ('create', 'update', 'deactivate')
+TEXT_LIMITS = {'title': 100, 'description': 500}
+URL_FIELDS = ('target_url', 'safe_url')
+FLAG_FIELDS = ('use_js_challenge', 'direct_from_tiktok')
+LINK_FIELDS = ('title', 'description') + URL_FIELDS + FLAG_FIELDS + ('domain',)
+
+BULK_BATCH_SIZE = int(os.environ.get('BULK_LINKS_BATCH', '500'))
+BULK_MAX_OPERATIONS = int(os.environ.get('BULK_LINKS_MAX', '5000'))
+
+_TRUE = ('1', 'true', 'yes', 'on', 'y')
+_FALSE = ('0', 'false', 'no', 'off', 'n')
+
+
+class BulkLinkError(ValueError):
+    """An operation that can't be applied"""
+
+
+def _flag(name: str, value) -> bool:
+    if isinstance(value, bool):
+        return value
+    text = str(value).strip().lower()
+    if text in _TRUE:
+        return True
+    if text in _FALSE:
+        return False
+    raise BulkLinkError(f"{name} must be true or false")
+
+
+def _url(name: str, value) -> Optional[str]:
+    text = str(value).strip() if value is not None else ''
+    if not text:
+        return None
+    parsed = urlparse(text)
+    if parsed.scheme not in ('http', 'https') or not parsed.netloc:
+        raise BulkLinkError(f"{name} must be an http(s) URL")
+    if len(text) > 500:
+        raise BulkLinkError(f"{name} is longer than 500 characters")
+    return text
+
+
+def clean_operation(operation) -> Dict:
+    """Validated {'action', 'short_code', 'fields'} for one operation"""
+    if not isinstance(operation, dict):
+        raise BulkLinkError("operation must be an object")
+    action = str(operation.get('action') or 'create').strip().lower()
+    if action not in ACTIONS:
+        raise BulkLinkError(f"unknown action {action!r}")
+
+    short_code = str(operation.get('short_code') or '').strip() or None
+    if action == 'create' and short_code:
+        raise BulkLinkError("short codes are allocated, don't pass one to create")
+    if action != 'create' and not short_code:
+        raise BulkLinkError(f"{action} needs a short_code")
+
+    fields = {}
+    if action != 'deactivate':
+        for name in LINK_FIELDS:
+            if name not in operation:
+                continue
+            value = operation[name]
+            if name in TEXT_LIMITS:
+                value = str(value).strip() if value is not None else ''
+                if len(value) > TEXT_LIMITS[name]:
+                    raise BulkLinkError(f"{name} is longer than {TEXT_LIMITS[name]} characters")
+                value = value or None
+            elif name in URL_FIELDS:
+                value = _url(name, value)
+            elif name in FLAG_FIELDS:
+                value = _flag(name, value)
+            else:
+                value = str(value).strip().lower() if value else None
+            fields[name] = value
+
+        for required in ('title', 'target_url'):
+            if (action == 'create' or required in fields) and not fields.get(required):
+                raise BulkLinkError(f"{required} is required")
+        if action == 'update' and not fields:
+            raise BulkLinkError("update has no fields to change")
+
+    return {'action': action, 'short_code': short_code, 'fields': fields}
+
+
+def apply_operations(user_id: int, operations: List, batch_size: int = BULK_BATCH_SIZE,
+                     host: str = None) -> Dict:
+    """Apply operations for a user, returns per-operation results and totals
+
+    Needs an app context. ``host`` is used for the URLs of links without a
+    custom domain.
+    """
+    results: List[Optional[Dict]] = [None] * len(operations)
+    cleaned = []
+    for index, operation in enumerate(operations):
+        try:
+            cleaned.append((index, clean_operation(operation)))
+        except BulkLinkError as e:
+            results[index] = {'index': index, 'status': 'error', 'error': str(e)}
+
+    domains = {domain.domain: domain for domain in
+               CustomDomain.query.filter_by(user_id=user_id, is_verified=True, is_active=True)}
+
+    for start in range(0, len(cleaned), max(1, batch_size)):
+        _apply_batch(user_id, cleaned[start:start + batch_size], domains, host, results)
+
+    totals = {status: 0 for status in ('created', 'updated', 'deactivated', 'error')}
+    for result in results:
+        totals[result['status']] += 1
+    return {**totals, 'results': results}
+
+
+def _apply_batch(user_id: int, batch: List, domains: Dict[str, CustomDomain], host: Optional[str],
+                 results: List):
+    creates = sum(1 for _, operation in batch if operation['action'] == 'create')
+    new_codes = iter(short_code_allocator.allocate_many(creates) if creates else [])
+
+    existing_codes = {operation['short_code'] for _, operation in batch if operation['short_code']}
+    links = {}
+    if existing_codes:
+        links = {link.short_code: link for link in SmartLink.query
+                 .options(joinedload(SmartLink.custom_domain))
+                 .filter(SmartLink.user_id == user_id, SmartLink.short_code.in_(existing_codes))}
+
+    applied = {}
+    for index, operation in batch:
+        action = operation['action']
+        try:
+            fields = dict(operation['fields'])
+            if 'domain' in fields:
+                domain_name = fields.pop('domain')
+                if domain_name and domain_name not in domains:
+                    raise BulkLinkError(f"{domain_name} is not one of your verified domains")
+                fields['custom_domain'] = domains.get(domain_name) if domain_name else None
+
+            if action == 'create':
+                link = SmartLink(user_id=user_id, short_code=next(new_codes), **fields)
+                db.session.add(link)
+                status = 'created'
+            else:
+                link = links.get(operation['short_code'])
+                if link is None:
+                    raise BulkLinkError(f"no link {operation['short_code']!r}")
+                if action == 'update':
+                    for name, value in fields.items():
+                        setattr(link, name, value)
+                    status = 'updated'
+                else:
+                    link.is_active = False
+                    status = 'deactivated'
+        except BulkLinkError as e:
+            results[index] = {'index': index, 'status': 'error', 'error': str(e)}
+            continue
+        # Read before the commit expires the objects
+        applied[index] = {'index': index, 'status': status, 'short_code': link.short_code,
+                          'url': link.get_full_url(host)}
+
+    try:
+        db.session.commit()
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        for index in applied:
+            results[index] = {'index': index, 'status': 'error',
+                              'error': f"batch not saved: {e.__class__.__name__}"}
+        return
+    for index, result in applied.items():
+        results[index] = result
@@ -0,0 +1,140 @@
+"""
+Per-link click counters
+Totals per link, by click_type, platform and target_reached, kept in the
+click_counter table so the dashboard and /api/stats read a few small rows per
+link instead of counting the click table. Every path that writes clicks (the
+click queue, the click log loader, reclassify_clicks.py) updates the counters
+in the same transaction, with upserts that add to the stored value.
+
+repair_click_counters.py recomputes them from the raw clicks: run it once
+after deploying (clicks written before then aren't counted) and whenever the
+counters are suspected to have drifted.
+"""
+
+from collections import Counter
+from typing import Dict, Iterable, Tuple
+
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+
+from app import db
+from models import Click, ClickCounter, SmartLink
+
+TOTAL = 'total'
+DIMENSIONS = ('click_type', 'platform', 'target_reached')
+
+COUNTER_TABLE = ClickCounter.__table__
+CLICK_TABLE = Click.__table__
+
+CounterKey = Tuple[int, str, str]  # link id, dimension, value
+
+_UPSERT_DIALECTS = {'postgresql': postgresql.insert, 'sqlite': sqlite.insert}
+
+
+def click_deltas(rows: Iterable[Dict]) -> Counter:
+    """Counter increments for new click rows"""
+    deltas: Counter = Counter()
+    for row in rows:
+        link_id = row['smart_link_id']
+        deltas[(link_id, TOTAL, '')] += 1
+        for dimension in DIMENSIONS:
+            deltas[(link_id, dimension, row.get(dimension) or '')] += 1
+    return deltas
+
+
+def add_counts(connection, table, key_columns: Tuple[str, ...], deltas: Dict[tuple, int]):
+    """Add ``deltas`` ({key: clicks}) to the ``clicks`` column of a counter table, in the caller's transaction"""
+    # Sorted, so concurrent writers lock shared rows in the same order
+    rows = [dict(zip(key_columns, key), clicks=clicks) for key, clicks in sorted(deltas.items()) if clicks]
+    if not rows:
+        return
+
+    upsert = _UPSERT_DIALECTS.get(connection.dialect.name)
+    if upsert is not None:
+        statement = upsert(table)
+        statement = statement.on_conflict_do_update(
+            index_elements=list(key_columns),
+            set_={'clicks': table.c.clicks + statement.excluded.clicks})
+        connection.execute(statement, rows)
+        return
+
+    for row in rows:
+        updated = connection.execute(
+            update(table)
+            .where(*(table.c[column] == row[column] for column in key_columns))
+            .values(clicks=table.c.clicks + row['clicks'])).rowcount
+        if not updated:
+            connection.execute(table.insert().values(**row))
+
+
+def apply_deltas(connection, deltas: Dict[CounterKey, int]):
+    """Add to the counters, inside the caller's transaction"""
+    add_counts(connection, COUNTER_TABLE, ('smart_link_id', 'dimension', 'value'), deltas)
+
+
+def empty_counts() -> Dict:
+    return {TOTAL: 0, **{dimension: {} for dimension in DIMENSIONS}}
+
+
+def _add_count(counts: Dict, dimension: str, value: str, clicks: int):
+    if dimension == TOTAL:
+        counts[TOTAL] += clicks
+    elif dimension in counts:
+        counts[dimension][value or None] = counts[dimension].get(value or None, 0) + clicks
+
+
+def user_link_counts(user_id: int) -> Dict[int, Dict]:
+    """{link id: counts} for a user's links that have clicks, in one query
+
+    counts is {'total': n, 'click_type': {value: n}, 'platform': {...},
+    'target_reached': {...}}, with None for clicks without a value.
+    """
+    rows = db.session.execute(
+        select(ClickCounter.smart_link_id, ClickCounter.dimension, ClickCounter.value, ClickCounter.clicks)
+        .join(SmartLink, SmartLink.id == ClickCounter.smart_link_id)
+        .where(SmartLink.user_id == user_id))
+    counts: Dict[int, Dict] = {}
+    for link_id, dimension, value, clicks in rows:
+        _add_count(counts.setdefault(link_id, empty_counts()), dimension, value, clicks)
+    return counts
+
+
+def user_counts(user_id: int) -> Dict:
+    """Counts over all of a user's links, in one query"""
+    rows = db.session.execute(
+        select(ClickCounter.dimension, ClickCounter.value, func.sum(ClickCounter.clicks))
+        .join(SmartLink, SmartLink.id == ClickCounter.smart_link_id)
+        .where(SmartLink.user_id == user_id)
+        .group_by(ClickCounter.dimension, ClickCounter.value))
+    counts = empty_counts()
+    for dimension, value, clicks in rows:
+        _add_count(counts, dimension, value, int(clicks or 0))
+    return counts
+
+
+def recompute(connection, first_link_id: int, last_link_id: int) -> int:
+    """Rebuild the counters of links first..last from the click table, returns the clicks counted
+
+    Run in its own transaction. Locking the links first holds back clicks
+    being written for them (inserting a click takes a key-share lock on its
+    link), so none is counted twice or missed.
+    """
+    connection.execute(select(SmartLink.id).where(SmartLink.id.between(first_link_id, last_link_id))
+                       .with_for_update())
+    connection.execute(delete(COUNTER_TABLE).where(
+        COUNTER_TABLE.c.smart_link_id.between(first_link_id, last_link_id)))
+    grouped = connection.execute(
+        select(CLICK_TABLE.c.smart_link_id, *(CLICK_TABLE.c[dimension] for dimension in DIMENSIONS),
+               func.count())
+        .where(CLICK_TABLE.c.smart_link_id.between(first_link_id, last_link_id))
+        .group_by(CLICK_TABLE.c.smart_link_id, *(CLICK_TABLE.c[dimension] for dimension in DIMENSIONS)))
+
+    deltas: Counter = Counter()
+    clicks = 0
+    for link_id, *values, count in grouped:
+        clicks += count
+        deltas[(link_id, TOTAL, '')] += count
+        for dimension, value in zip(DIMENSIONS, values):
+            deltas[(link_id, dimension, value or '')] += count
+    apply_deltas(connection, deltas)
+    return clicks
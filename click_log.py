@@ -0,0 +1,252 @@
+"""
+Durable append-only local click log
+With CLICK_LOG_DIR set, redirects append clicks to a local segment file
+instead of touching the database, so redirect latency doesn't depend on
+database health. Each worker writes its own segments; a segment is sealed
+(renamed to .seg) when it reaches a size or age limit and load_click_log.py
+bulk-loads sealed segments into the Click table.
+
+Records are length-prefixed JSON rows with a CRC32, so a record torn by a
+crash is detected and everything before it is kept. Appends go to the OS
+immediately and are fsynced in batches every CLICK_LOG_FSYNC_INTERVAL seconds.
+"""
+
+import os
+import json
+import time
+import zlib
+import atexit
+import struct
+import logging
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+RECORD_HEADER = struct.Struct('<II')  # payload length, CRC32 of the payload
+OPEN_SUFFIX = '.open'
+SEALED_SUFFIX = '.seg'
+QUARANTINE_SUFFIX = '.bad'  # segments the loader couldn't load, kept for inspection
+
+
+def encode_record(row: Dict) -> bytes:
+    payload = json.dumps(row, separators=(',', ':'), default=_json_default).encode('utf-8')
+    return RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Can't log {type(value).__name__} in a click record")
+
+
+def read_segment(path: str) -> Tuple[List[Dict], bool]:
+    """Every intact record of a segment, and whether it ended cleanly
+
+    Reading stops at the first torn or corrupt record (a crash mid-append).
+    """
+    with open(path, 'rb') as handle:
+        data = handle.read()
+
+    rows = []
+    offset = 0
+    while offset < len(data):
+        if offset + RECORD_HEADER.size > len(data):
+            return rows, False
+        length, checksum = RECORD_HEADER.unpack_from(data, offset)
+        start = offset + RECORD_HEADER.size
+        payload = data[start:start + length]
+        if len(payload) < length or zlib.crc32(payload) != checksum:
+            return rows, False
+        rows.append(json.loads(payload))
+        offset = start + length
+    return rows, True
+
+
+def segment_pid(path: str) -> Optional[int]:
+    """Writer pid from a segment name (clicks-<pid>-<sequence>-<timestamp>.open)"""
+    try:
+        return int(os.path.basename(path).split('-')[1])
+    except (IndexError, ValueError):
+        return None
+
+
+def _segment_opened_ms(name: str) -> int:
+    try:
+        return int(name.split('-')[3].split('.')[0])
+    except (IndexError, ValueError):
+        return 0
+
+
+def list_segments(directory: str, suffix: str = SEALED_SUFFIX) -> List[str]:
+    """Segment paths with the given suffix, oldest first"""
+    names = sorted((name for name in os.listdir(directory) if name.endswith(suffix)),
+                   key=lambda name: (_segment_opened_ms(name), name))
+    return [os.path.join(directory, name) for name in names]
+
+
+class ClickLog:
+    """Per-worker segment writer"""
+
+    def __init__(self, directory: str = None, max_segment_bytes: int = 16 * 1024 * 1024,
+                 max_segment_age: float = 60.0, fsync_interval: float = 0.2):
+        self.directory = directory
+        self.max_segment_bytes = max_segment_bytes
+        self.max_segment_age = max_segment_age
+        self.fsync_interval = fsync_interval
+
+        self.appended = 0
+        self.failed = 0
+        self.sealed = 0
+        self.fsyncs = 0
+
+        self._lock = threading.Lock()
+        self._pid = None
+        self._sequence = 0
+        self._fd = None
+        self._path = None
+        self._size = 0
+        self._opened_at = 0.0
+        self._dirty = False
+        self._pending: List[Tuple[int, str]] = []  # detached segments to seal
+        self._stop = threading.Event()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.directory)
+
+    def append(self, row: Dict) -> bool:
+        """Append one click, returns False if it couldn't be written"""
+        record = encode_record(row)
+        try:
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._start()
+                if self._fd is None:
+                    self._open_segment()
+                try:
+                    os.write(self._fd, record)
+                except OSError:
+                    # A partial record would hide every later one from the loader,
+                    # so the next append starts a fresh segment
+                    self._pending.append(self._detach())
+                    raise
+                self._size += len(record)
+                self._dirty = True
+                if self._size >= self.max_segment_bytes:
+                    # Sealed by the sync thread, the request doesn't wait for the fsync
+                    self._pending.append(self._detach())
+        except OSError as e:
+            self.failed += 1
+            if self.failed & (self.failed - 1) == 0:
+                logger.error(f"Click log append failed ({self.failed} failures so far): {e}")
+            return False
+        self.appended += 1
+        return True
+
+    def _start(self):
+        """Begin writing from this process (again after a fork)"""
+        os.makedirs(self.directory, exist_ok=True)
+        # A forked child must not write to (or seal) its parent's segments
+        self._fd = None
+        self._path = None
+        self._pending = []
+        self._pid = os.getpid()
+        self._sequence = 0
+        self._stop = threading.Event()
+        threading.Thread(target=self._run, name='click-log-sync', daemon=True).start()
+
+    def _open_segment(self):
+        self._sequence += 1
+        name = f"clicks-{self._pid}-{self._sequence:08d}-{int(time.time() * 1000)}{OPEN_SUFFIX}"
+        self._path = os.path.join(self.directory, name)
+        self._fd = os.open(self._path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        self._size = 0
+        self._opened_at = time.monotonic()
+
+    def _detach(self) -> Tuple[int, str]:
+        """Take the current segment out of use (under the lock); appends open a new one"""
+        segment = (self._fd, self._path)
+        self._fd = None
+        self._path = None
+        self._dirty = False
+        return segment
+
+    def _seal(self, fd: int, path: str):
+        """Fsync, close and rename a detached segment so the loader may take it"""
+        try:
+            os.fsync(fd)
+            self.fsyncs += 1
+        finally:
+            os.close(fd)
+        os.replace(path, path[:-len(OPEN_SUFFIX)] + SEALED_SUFFIX)
+        self.sealed += 1
+
+    def _seal_all(self, segments: List[Tuple[int, str]]):
+        for fd, path in segments:
+            try:
+                self._seal(fd, path)
+            except OSError as e:
+                logger.error(f"Sealing click log segment {path} failed: {e}")
+
+    def _run(self):
+        """Batch fsyncs and seal segments, without holding up appends
+
+        Only swapping segments happens under the lock; the fsyncs run on a
+        duplicate of the descriptor while appends carry on.
+        """
+        stop = self._stop
+        while not stop.wait(self.fsync_interval):
+            sync_fd = None
+            try:
+                with self._lock:
+                    pending, self._pending = self._pending, []
+                    if self._fd is not None:
+                        if time.monotonic() - self._opened_at >= self.max_segment_age:
+                            pending.append(self._detach())
+                        elif self._dirty:
+                            sync_fd = os.dup(self._fd)
+                            self._dirty = False
+            except OSError as e:
+                logger.error(f"Click log sync failed: {e}")
+            self._seal_all(pending)
+            if sync_fd is not None:
+                try:
+                    os.fsync(sync_fd)
+                    self.fsyncs += 1
+                except OSError as e:
+                    self._dirty = True
+                    logger.error(f"Click log sync failed: {e}")
+                finally:
+                    os.close(sync_fd)
+
+    def close(self):
+        """Seal the current segment (called at worker exit)"""
+        if self._pid != os.getpid():
+            return
+        self._stop.set()
+        with self._lock:
+            pending, self._pending = self._pending, []
+            if self._fd is not None:
+                pending.append(self._detach())
+            self._seal_all(pending)
+
+    def stats(self) -> Dict:
+        return {
+            'enabled': self.enabled,
+            'directory': self.directory,
+            'appended': self.appended,
+            'failed': self.failed,
+            'sealed_segments': self.sealed,
+            'fsyncs': self.fsyncs,
+        }
+
+
+click_log = ClickLog(
+    directory=os.environ.get('CLICK_LOG_DIR') or None,
+    max_segment_bytes=int(os.environ.get('CLICK_LOG_SEGMENT_BYTES', str(16 * 1024 * 1024))),
+    max_segment_age=float(os.environ.get('CLICK_LOG_SEGMENT_SECONDS', '60')),
+    fsync_interval=float(os.environ.get('CLICK_LOG_FSYNC_INTERVAL', '0.2')),
+)
+atexit.register(click_log.close)
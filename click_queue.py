@@ -0,0 +1,193 @@
+"""
+Write-behind click ingestion
+Redirects enqueue a plain dict per click and return immediately; a background
+thread per worker writes them in batches with one multi-row INSERT when a
+batch fills up or the flush interval passes. The queue is bounded: when it is
+full, producers wait briefly and the click is dropped (and counted) if it is
+still full. Remaining clicks are flushed when the worker exits.
+
+Disabled on Vercel, where functions are frozen between requests and a
+background thread can't be relied on; clicks are then written inline.
+"""
+
+import os
+import time
+import queue
+import atexit
+import logging
+import threading
+from typing import Dict, List
+
+from app import app, db
+from models import Click
+from click_counters import apply_deltas, click_deltas
+
+logger = logging.getLogger(__name__)
+
+CLICK_TABLE = Click.__table__
+
+
+class ClickQueue:
+    """Bounded write-behind queue of click rows with a background flusher"""
+
+    def __init__(self, max_batch: int = 500, flush_interval: float = 1.0, max_pending: int = 10000,
+                 enqueue_timeout: float = 0.05, drain_timeout: float = 10.0, enabled: bool = True):
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.enqueue_timeout = enqueue_timeout
+        self.drain_timeout = drain_timeout
+        self.enabled = enabled
+
+        self.enqueued = 0
+        self.flushed = 0
+        self.dropped = 0
+        self.batches = 0
+        self.failed_batches = 0
+        self.inline_writes = 0
+
+        self._lock = threading.Lock()
+        self._pid = None
+        self._queue: 'queue.Queue[Dict]' = None
+        self._stop = None
+        self._idle = None
+        self._thread = None
+
+    def _ensure_started(self):
+        """Start the flusher in this process (again after a fork, e.g. gunicorn --preload)"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue(maxsize=self.max_pending)
+            self._stop = threading.Event()
+            self._idle = threading.Event()
+            self._idle.set()
+            self._thread = threading.Thread(target=self._run, name='click-flusher', daemon=True)
+            self._thread.start()
+            self._pid = os.getpid()
+
+    def enqueue(self, row: Dict, timeout: float = None) -> bool:
+        """Queue one click row, returns False if it had to be dropped
+
+        ``timeout`` overrides how long to wait when the queue is full (0 never
+        blocks, for callers on an event loop).
+        """
+        if not self.enabled:
+            self._write([row])
+            self.inline_writes += 1
+            return True
+
+        self._ensure_started()
+        self._idle.clear()
+        try:
+            # Waiting here when the flusher falls behind slows producers down
+            self._queue.put(row, timeout=self.enqueue_timeout if timeout is None else timeout)
+        except queue.Full:
+            self.dropped += 1
+            if self.dropped & (self.dropped - 1) == 0:
+                logger.warning(f"Click queue full ({self.max_pending} pending), "
+                               f"{self.dropped} clicks dropped so far")
+            return False
+        self.enqueued += 1
+        return True
+
+    def _run(self):
+        while True:
+            try:
+                if self._stop.is_set():
+                    first = self._queue.get_nowait()
+                else:
+                    first = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                self._idle.set()
+                if self._stop.is_set():
+                    return
+                continue
+
+            batch = [first]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if self._stop.is_set() or remaining <= 0:
+                    # Take whatever is already queued without waiting
+                    try:
+                        batch.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+                    continue
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._flush_batch(batch)
+            if self._queue.empty():
+                self._idle.set()
+
+    def _flush_batch(self, batch: List[Dict], attempts: int = 3):
+        for attempt in range(attempts):
+            try:
+                with app.app_context():
+                    self._write(batch)
+            except Exception:
+                logger.warning(f"Writing {len(batch)} clicks failed (attempt {attempt + 1}/{attempts})",
+                               exc_info=True)
+                time.sleep(0.5 * 2 ** attempt)
+                continue
+            self.batches += 1
+            self.flushed += len(batch)
+            return
+        self.failed_batches += 1
+        self.dropped += len(batch)
+        logger.error(f"Dropped {len(batch)} clicks after {attempts} failed writes")
+
+    @staticmethod
+    def _write(rows: List[Dict]):
+        """One multi-row INSERT (plus the counter upserts) in its own transaction"""
+        with db.engine.begin() as conn:
+            conn.execute(CLICK_TABLE.insert().values(rows))
+            apply_deltas(conn, click_deltas(rows))
+
+    def flush(self, timeout: float = None) -> bool:
+        """Wait until everything queued so far is written, returns False on timeout"""
+        if not self.enabled or self._pid != os.getpid():
+            return True
+        return self._idle.wait(self.drain_timeout if timeout is None else timeout)
+
+    def shutdown(self):
+        """Stop the flusher after it wrote the remaining clicks (bounded by drain_timeout)"""
+        if self._pid != os.getpid() or not self._thread.is_alive():
+            return
+        pending = self._queue.qsize()
+        self._stop.set()
+        self._thread.join(self.drain_timeout)
+        if self._thread.is_alive():
+            logger.error(f"Click queue drain timed out with {self._queue.qsize()} clicks unwritten")
+        elif pending:
+            logger.info(f"Click queue drained {pending} clicks on shutdown")
+
+    def stats(self) -> Dict:
+        return {
+            'enabled': self.enabled,
+            'pending': self._queue.qsize() if self._queue is not None and self._pid == os.getpid() else 0,
+            'max_pending': self.max_pending,
+            'enqueued': self.enqueued,
+            'flushed': self.flushed,
+            'dropped': self.dropped,
+            'batches': self.batches,
+            'failed_batches': self.failed_batches,
+            'inline_writes': self.inline_writes,
+        }
+
+
+click_queue = ClickQueue(
+    max_batch=int(os.environ.get('CLICK_QUEUE_BATCH', '500')),
+    flush_interval=float(os.environ.get('CLICK_QUEUE_FLUSH_INTERVAL', '1.0')),
+    max_pending=int(os.environ.get('CLICK_QUEUE_MAX_PENDING', '10000')),
+    enqueue_timeout=float(os.environ.get('CLICK_QUEUE_ENQUEUE_TIMEOUT', '0.05')),
+    drain_timeout=float(os.environ.get('CLICK_QUEUE_DRAIN_TIMEOUT', '10')),
+    enabled=not os.environ.get('VERCEL_ENV') and
+    os.environ.get('CLICK_QUEUE', '1').lower() not in ('0', 'false', 'no'),
+)
+atexit.register(click_queue.shutdown)
@@ -0,0 +1,235 @@
+"""
+Hourly and daily click rollups
+Clicks per link per hour and per day, by click_type, platform, risk_level and
+country, in the click_rollup table. rollup_clicks.py adds new clicks to them
+incrementally: a watermark holds the highest click id rolled up, and each run
+only reads the clicks above it. Click ids are handed out before the inserts
+commit, so ids below the newest one seen that weren't there yet are kept as
+holes and looked for again on the next runs, for HOLE_TTL seconds.
+
+The analytics page reads the rollups for any date range and adds the few raw
+clicks the job hasn't reached yet (normally the current minute or so), so its
+numbers are always complete. Clicks with a new verdict from
+reclassify_clicks.py are only reflected after ``rollup_clicks.py --rebuild``
+over the days they are in.
+"""
+
+import os
+import json
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Tuple
+
+from sqlalchemy import delete, or_, select
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from models import Click, ClickRollup, ClickRollupState
+from click_counters import TOTAL, add_counts
+
+PERIODS = ('hour', 'day')
+PERIOD_STEPS = {'hour': timedelta(hours=1), 'day': timedelta(days=1)}
+DIMENSIONS = ('click_type', 'platform', 'risk_level', 'country')
+
+ROLLUP_TABLE = ClickRollup.__table__
+STATE_TABLE = ClickRollupState.__table__
+CLICK_TABLE = Click.__table__
+ROLLUP_KEY = ('smart_link_id', 'period', 'bucket', 'dimension', 'value')
+STATE_NAME = 'click'
+
+# Ids missing this far below the newest click are taken to be rolled back inserts
+HOLE_WINDOW = 2048
+HOLE_TTL = 600.0
+
+ROLLUP_CHUNK_SIZE = int(os.environ.get('ROLLUP_CHUNK_SIZE', '5000'))
+MAX_HOURLY_DAYS = int(os.environ.get('ROLLUP_MAX_HOURLY_DAYS', '14'))
+MAX_RANGE_DAYS = int(os.environ.get('ROLLUP_MAX_RANGE_DAYS', '366'))
+
+_CLICK_COLUMNS = (CLICK_TABLE.c.id, CLICK_TABLE.c.smart_link_id, CLICK_TABLE.c.created_at,
+                  *(CLICK_TABLE.c[dimension] for dimension in DIMENSIONS))
+
+
+def bucket_start(moment: datetime, period: str) -> datetime:
+    if period == 'hour':
+        return moment.replace(minute=0, second=0, microsecond=0)
+    return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def rollup_deltas(rows: Iterable) -> Counter:
+    """Rollup increments for click rows (with the _CLICK_COLUMNS columns)"""
+    deltas: Counter = Counter()
+    for row in rows:
+        if row.created_at is None:
+            continue
+        for period in PERIODS:
+            bucket = bucket_start(row.created_at, period)
+            deltas[(row.smart_link_id, period, bucket, TOTAL, '')] += 1
+            for dimension in DIMENSIONS:
+                deltas[(row.smart_link_id, period, bucket, dimension, getattr(row, dimension) or '')] += 1
+    return deltas
+
+
+def _read_state(connection, lock: bool = False) -> Tuple[int, Dict[int, float], int]:
+    """(last click id, holes, generation); zeros before the first run"""
+    query = select(STATE_TABLE.c.last_click_id, STATE_TABLE.c.holes, STATE_TABLE.c.generation) \
+        .where(STATE_TABLE.c.name == STATE_NAME)
+    if lock:
+        query = query.with_for_update()
+    row = connection.execute(query).first()
+    if row is None:
+        return 0, {}, 0
+    holes = {int(click_id): missed_at for click_id, missed_at in json.loads(row.holes or '{}').items()}
+    return row.last_click_id, holes, row.generation
+
+
+def _write_state(connection, last_click_id: int, holes: Dict[int, float], generation: int):
+    connection.execute(STATE_TABLE.update().where(STATE_TABLE.c.name == STATE_NAME).values(
+        last_click_id=last_click_id, holes=json.dumps(holes), generation=generation + 1,
+        updated_at=datetime.utcnow()))
+
+
+def _ensure_state():
+    try:
+        with db.engine.begin() as connection:
+            if connection.execute(select(STATE_TABLE.c.name).where(STATE_TABLE.c.name == STATE_NAME)).first():
+                return
+            connection.execute(STATE_TABLE.insert().values(
+                name=STATE_NAME, last_click_id=0, holes='{}', generation=0, updated_at=datetime.utcnow()))
+    except IntegrityError:
+        pass  # created by a concurrent run
+
+
+def roll_up(chunk_size: int = ROLLUP_CHUNK_SIZE) -> int:
+    """Add the clicks written since the last run to the rollups, returns how many
+
+    Needs an app context. Each chunk of clicks commits together with the
+    watermark, so an interrupted run loses nothing and counts nothing twice.
+    """
+    _ensure_state()
+    rolled_up = 0
+    first_chunk = True
+    while True:
+        with db.engine.begin() as connection:
+            last_id, holes, generation = _read_state(connection, lock=True)
+            now = time.time()
+
+            found = []
+            if first_chunk and holes:
+                found = connection.execute(select(*_CLICK_COLUMNS).where(CLICK_TABLE.c.id.in_(list(holes)))).all()
+                for row in found:
+                    holes.pop(row.id, None)
+            rows = connection.execute(select(*_CLICK_COLUMNS).where(CLICK_TABLE.c.id > last_id)
+                                      .order_by(CLICK_TABLE.c.id).limit(chunk_size)).all()
+            if rows:
+                seen = {row.id for row in rows}
+                newest = rows[-1].id
+                for click_id in range(max(last_id + 1, newest - HOLE_WINDOW + 1), newest):
+                    if click_id not in seen:
+                        holes[click_id] = now
+                last_id = newest
+            expired = [click_id for click_id, missed_at in holes.items()
+                       if now - missed_at > HOLE_TTL or click_id <= last_id - HOLE_WINDOW]
+            for click_id in expired:
+                del holes[click_id]
+
+            if found or rows or expired:
+                add_counts(connection, ROLLUP_TABLE, ROLLUP_KEY, rollup_deltas(found + rows))
+                _write_state(connection, last_id, holes, generation)
+        rolled_up += len(found) + len(rows)
+        first_chunk = False
+        if len(rows) < chunk_size:
+            return rolled_up
+
+
+def rebuild_day(day: datetime) -> int:
+    """Recompute one day's rollups from the raw clicks, returns the clicks counted
+
+    Only clicks the incremental job has already passed are counted, the
+    others are still to be added by it.
+    """
+    start = bucket_start(day, 'day')
+    end = start + PERIOD_STEPS['day']
+    _ensure_state()
+    with db.engine.begin() as connection:
+        last_id, holes, generation = _read_state(connection, lock=True)
+        connection.execute(delete(ROLLUP_TABLE).where(ROLLUP_TABLE.c.bucket >= start, ROLLUP_TABLE.c.bucket < end))
+        rows = [row for row in connection.execute(
+            select(*_CLICK_COLUMNS).where(CLICK_TABLE.c.created_at >= start, CLICK_TABLE.c.created_at < end,
+                                          CLICK_TABLE.c.id <= last_id))
+            if row.id not in holes]
+        add_counts(connection, ROLLUP_TABLE, ROLLUP_KEY, rollup_deltas(rows))
+        _write_state(connection, last_id, holes, generation)
+    return len(rows)
+
+
+def _empty_bucket() -> Dict:
+    return {TOTAL: 0, **{dimension: {} for dimension in DIMENSIONS}}
+
+
+def _add(counts: Dict, dimension: str, value, clicks: int):
+    if dimension == TOTAL:
+        counts[TOTAL] += clicks
+    elif dimension in counts:
+        counts[dimension][value or None] = counts[dimension].get(value or None, 0) + clicks
+
+
+def link_activity(link_id: int, start: datetime, end: datetime, period: str = 'day') -> Dict:
+    """A link's clicks from start up to end, per hour or day bucket and in total
+
+    start and end should fall on bucket boundaries. Returns {'buckets':
+    [(bucket start, counts), ...] for every bucket in the range, 'totals':
+    counts}, counts being {'total': n, 'click_type': {value: n}, ...} with
+    None for clicks without a value.
+    """
+    if period not in PERIODS:
+        raise ValueError(f"unknown period {period!r}")
+    if end - start > timedelta(days=MAX_RANGE_DAYS):
+        raise ValueError(f"ranges are limited to {MAX_RANGE_DAYS} days")
+
+    connection = db.session.connection()
+    # The job commits rollups and watermark together; if it committed while we
+    # were reading, read again so no click is counted twice or missed.
+    for _ in range(3):
+        last_id, holes, generation = _read_state(connection)
+        rolled_up = connection.execute(
+            select(ROLLUP_TABLE.c.bucket, ROLLUP_TABLE.c.dimension, ROLLUP_TABLE.c.value, ROLLUP_TABLE.c.clicks)
+            .where(ROLLUP_TABLE.c.smart_link_id == link_id, ROLLUP_TABLE.c.period == period,
+                   ROLLUP_TABLE.c.bucket >= start, ROLLUP_TABLE.c.bucket < end)).all()
+        pending = CLICK_TABLE.c.id > last_id
+        if holes:
+            pending = or_(pending, CLICK_TABLE.c.id.in_(list(holes)))
+        raw = connection.execute(
+            select(*_CLICK_COLUMNS).where(CLICK_TABLE.c.smart_link_id == link_id, pending,
+                                          CLICK_TABLE.c.created_at >= start, CLICK_TABLE.c.created_at < end)).all()
+        if _read_state(connection)[2] == generation:
+            break
+
+    buckets: Dict[datetime, Dict] = {}
+    moment = start
+    while moment < end:
+        buckets[moment] = _empty_bucket()
+        moment += PERIOD_STEPS[period]
+    for bucket, dimension, value, clicks in rolled_up:
+        _add(buckets.setdefault(bucket, _empty_bucket()), dimension, value, clicks)
+    for (_, row_period, bucket, dimension, value), clicks in rollup_deltas(raw).items():
+        if row_period == period:
+            _add(buckets.setdefault(bucket, _empty_bucket()), dimension, value, clicks)
+
+    totals = _empty_bucket()
+    for counts in buckets.values():
+        totals[TOTAL] += counts[TOTAL]
+        for dimension in DIMENSIONS:
+            for value, clicks in counts[dimension].items():
+                _add(totals, dimension, value, clicks)
+    return {'buckets': sorted(buckets.items()), 'totals': totals}
+
+
+def days_between(first: datetime, last: datetime) -> List[datetime]:
+    """Start of every day from first to last, inclusive"""
+    day, last = bucket_start(first, 'day'), bucket_start(last, 'day')
+    days = []
+    while day <= last:
+        days.append(day)
+        day += PERIOD_STEPS['day']
+    return days
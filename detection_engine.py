@@ -3,42 +3,97 @@ Advanced Bot Detection Engine for SmartTicker
 Sophisticated detection methods for TikTok, Instagram, and other platform bots
 """
 
+import os
 import re
+import json
 import time
 import hashlib
-import ipaddress
+import logging
+from functools import lru_cache
 from typing import Dict, List, Tuple, Optional
-from dataclasses import dataclass
+from dataclasses import dataclass, field, replace
+from urllib.parse import urlsplit
 from flask import request
-# Platform IP ranges (avoiding circular import from utils)
-PLATFORM_IP_RANGES = {
-    'tiktok': [
-        '103.216.0.0/16',       # TikTok Singapore
-        '161.117.0.0/16',       # ByteDance US
-        '49.51.0.0/16',         # TikTok Asia Pacific
-    ],
-    'facebook': [
-        '31.13.0.0/16',         # Facebook main
-        '66.220.0.0/16',        # Facebook crawlers
-        '69.63.0.0/16',         # Facebook infrastructure
-    ],
-    'google': [
-        '66.249.0.0/16',        # Googlebot
-        '64.233.0.0/16',        # Google services
-    ]
-}
+from ip_ranges import IPRangeIndex
+from signatures import Signature, SignatureSet
+from ttl_cache import TTLCache
+from request_timing import RequestTimingTracker
+from detection_metrics import DetectionMetrics
+from header_fingerprint import FingerprintTable, fingerprint_id, header_fingerprint
+from signature_pack import default_ip_ranges, default_patterns, signature_registry
+
+logger = logging.getLogger(__name__)
+
+# Built-in platform IP ranges and TikTok patterns, from signature_pack.json.
+# Detection reads the live pack from signature_registry, which can be a
+# compiled pack (SIGNATURE_PACK_FILE) and is swapped on reload.
+PLATFORM_IP_RANGES = default_ip_ranges()
+TIKTOK_SPECIFIC_PATTERNS = default_patterns('tiktok_specific')
+
+# Headers whose presence or value the header fingerprint stage reads
+EXPECTED_BROWSER_HEADERS = ['Accept', 'Accept-Language', 'Accept-Encoding', 'Connection']
+AUTOMATION_HEADERS = ['X-Requested-With', 'X-Automation', 'Selenium-Remote-Control']
+CACHE_KEY_HEADERS = EXPECTED_BROWSER_HEADERS + AUTOMATION_HEADERS
+
+# Methods that depend on per-client history rather than the request alone;
+# they run on every request and are never served from the verdict cache
+STATEFUL_METHODS = {'timing_analysis'}
+
+# Timing analysis thresholds
+TIMING_REGULAR_MAX_CV = 0.1          # near-constant gaps between requests
+TIMING_REGULAR_MAX_INTERVAL = 120.0  # only fast-ish loops count as regular
+TIMING_LINK_BURST = 8                # hits on one link from one prefix within the burst window
+TIMING_CLIENT_BURST = 16             # hits on any link from one prefix within the burst window
 
-# TikTok-specific patterns (avoiding circular import)
-TIKTOK_SPECIFIC_PATTERNS = [
-    r'bytespider',
-    r'tiktok',
-    r'musically',
-    r'bytedance',
-    r'douyin',
-    r'aweme',                   # TikTok internal name
-    r'com\.zhiliaoapp\.musically',  # TikTok mobile app identifier
-    r'musical_ly',
+# Priority order when several platforms were detected
+PLATFORM_PRIORITY = ['tiktok', 'instagram', 'facebook', 'twitter', 'google']
+
+# Keywords used by the fallback platform detection
+FALLBACK_TIKTOK_KEYWORDS = ['tiktok', 'bytespider', 'douyin']
+FALLBACK_INSTAGRAM_KEYWORDS = ['instagram', 'facebook']
+
+# Generic automation and crawler patterns
+GENERIC_BOT_PATTERNS = default_patterns('generic_bot')
+
+# Facebook in-app markers - patterns containing these map to 'facebook', the rest to 'instagram'
+FACEBOOK_PATTERN_MARKERS = ['fban', 'fbav', 'fbios', 'fbdv', r'\[fb']
+
+# Browser family a user agent claims, for the header-order check. Most specific
+# first: Chromium-based browsers and webviews also carry Chrome and Safari tokens.
+BROWSER_FAMILIES = [
+    ('webview', r'; wv\)|FBAN/|FBAV/|Instagram \d|musical_ly|BytedanceWebview|\bLine/'),
+    ('samsung', r'SamsungBrowser/'),
+    ('opera', r'\bOPR/|\bOPT/|\bOpera\b'),
+    ('edge', r'\bEdg(?:e|A|iOS)?/'),
+    ('firefox', r'\bFirefox/|\bFxiOS/'),
+    ('chrome', r'\bChrome/|\bCriOS/'),
+    ('safari', r'\bSafari/'),
 ]
+BROWSER_FAMILY_SIGNATURES = SignatureSet('browser_family', [
+    Signature(id=f'browser_family:{index}', pattern=pattern, platform=family)
+    for index, (family, pattern) in enumerate(BROWSER_FAMILIES)
+], re.IGNORECASE)
+
+@dataclass(frozen=True)
+class MethodProfile:
+    """What a detection method costs and the most it can contribute"""
+    cost: int                          # typical ns per call (see bench_detection.py)
+    max_confidence: float              # highest confidence it can report
+    platforms: Optional[frozenset]     # platforms it can report, None if any
+
+# Methods run cheapest first; once the remaining ones can't change the
+# verdict, they are skipped
+METHOD_PROFILES = {
+    'user_agent': MethodProfile(cost=20000, max_confidence=0.95,
+                                platforms=frozenset(['tiktok', 'instagram', 'facebook'])),
+    'ip_analysis': MethodProfile(cost=500, max_confidence=0.9, platforms=None),
+    'header_fingerprint': MethodProfile(cost=1800, max_confidence=1.0, platforms=frozenset()),
+    'header_order': MethodProfile(cost=300, max_confidence=0.85, platforms=frozenset()),
+    'timing_analysis': MethodProfile(cost=300, max_confidence=0.85, platforms=frozenset()),
+    'behavioral_patterns': MethodProfile(cost=300, max_confidence=0.3, platforms=frozenset()),
+    'platform_specific': MethodProfile(cost=4500, max_confidence=0.9,
+                                       platforms=frozenset(['tiktok', 'instagram'])),
+}
 
 @dataclass
 class DetectionResult:
@@ -48,6 +103,25 @@ class DetectionResult:
     platform: str
     detection_methods: List[str]
     risk_level: str  # 'low', 'medium', 'high', 'critical'
+    skipped_methods: List[str] = field(default_factory=list)  # not run, couldn't change the verdict
+    method_scores: Dict[str, float] = field(default_factory=dict)  # confidence of each method that fired
+    
+    def stored_methods(self) -> str:
+        """Click.detection_methods value: {method: confidence}, None for skipped methods
+        
+        With short-circuiting confidence_score only combines the methods that
+        ran, so it can be lower than a full evaluation would give (is_bot,
+        risk_level and platform are the same). Skipped methods are stored so
+        readers know their result is unknown rather than a miss.
+        """
+        stored = {name: round(self.method_scores.get(name, 0.5), 4) for name in self.detection_methods}
+        stored.update((name, None) for name in self.skipped_methods if name not in stored)
+        return json.dumps(stored)
+    
+    @property
+    def is_sophisticated_tiktok(self) -> bool:
+        """High-confidence TikTok verdict"""
+        return self.platform == 'tiktok' and self.confidence_score >= 0.8
     
 class AdvancedDetectionEngine:
     """Advanced bot detection with multiple analysis methods"""
@@ -57,21 +131,15 @@ class AdvancedDetectionEngine:
             'user_agent': self._analyze_user_agent,
             'ip_analysis': self._analyze_ip_address,
             'header_fingerprint': self._analyze_headers,
+            'header_order': self._analyze_header_order,
             'timing_analysis': self._analyze_timing,
             'behavioral_patterns': self._analyze_behavior,
             'platform_specific': self._platform_specific_detection
         }
         
-        # Enhanced TikTok bot signatures
+        # Enhanced TikTok bot signatures (user agents come from the signature pack)
         self.tiktok_bot_signatures = {
-            'user_agents': [
-                r'bytespider',
-                r'tiktok.*crawler',
-                r'bytedance.*bot',
-                r'douyin.*spider',
-                r'musicallybot',
-                r'aweme.*crawler'
-            ],
+            'user_agents': [],
             'headers': {
                 'required': ['Host'],
                 'suspicious_absent': ['Accept-Language', 'Accept-Encoding', 'Connection'],
@@ -83,34 +151,103 @@ class AdvancedDetectionEngine:
             }
         }
         
-        # Instagram/Facebook bot signatures - INCLUDING IN-APP BROWSERS
+        # Instagram/Facebook bot signatures - INCLUDING IN-APP BROWSERS (from the signature pack)
         self.instagram_bot_signatures = {
-            'user_agents': [
-                r'facebookexternalhit',
-                r'facebookcatalog',
-                r'instagrambot',
-                r'meta.*external.*hit',
-                r'whatsapp.*preview',
-                # Instagram in-app browser patterns
-                r'instagram\s+[\d\.]+',  # e.g., Instagram 303.0.0.11.109
-                # Facebook in-app browser patterns
-                r'\[FBAN/',               # Facebook App Network
-                r'FBAV/',                  # Facebook App Version
-                r'FBIOS',                  # Facebook iOS
-                r'FBDV/',                  # Facebook Device
-                r'\[FB',                  # Generic Facebook in-app pattern
-            ],
-            'referrer_patterns': [
-                r'facebook\.com',
-                r'instagram\.com',
-                r'fb\.com',
-                r'm\.facebook\.com'
-            ]
+            'user_agents': [],
+            'referrer_patterns': []
         }
+        
+        # Verdict cache - crawler bursts repeat the same UA/header shape many times
+        self.verdict_cache = TTLCache(
+            maxsize=int(os.environ.get('DETECTION_CACHE_SIZE', '10000')),
+            ttl=float(os.environ.get('DETECTION_CACHE_TTL', '300')),
+            name='detection_verdicts'
+        )
+        self.signature_version = 0
+        
+        # Per-client arrival history for timing analysis (fixed memory)
+        self.timing_tracker = RequestTimingTracker(
+            slots=int(os.environ.get('TIMING_TRACKER_SLOTS', '16384')),
+            window=int(os.environ.get('TIMING_TRACKER_WINDOW', '8')),
+            burst_window=float(os.environ.get('TIMING_BURST_WINDOW', '2.0'))
+        )
+        self._method_order = {name: index for index, name in enumerate(self.detection_methods)}
+        
+        # Decayed sighting counts per header-order fingerprint, for spotting new clients
+        self.fingerprint_table = FingerprintTable(
+            maxsize=int(os.environ.get('HEADER_FINGERPRINT_TABLE_SIZE', '4096')),
+            half_life=float(os.environ.get('HEADER_FINGERPRINT_HALF_LIFE', '3600'))
+        )
+        
+        # Cost-ordered evaluation with short-circuiting (DETECTION_SHORT_CIRCUIT=0 runs everything)
+        self.method_profiles = dict(METHOD_PROFILES)
+        self.short_circuit = os.environ.get('DETECTION_SHORT_CIRCUIT', '1').lower() not in ('0', 'false', 'no')
+        self.short_circuits = 0
+        self.method_skips = {name: 0 for name in self.detection_methods}
+        
+        # Per-method call/hit/failure counters and latency histograms (DETECTION_METRICS=0 disables timing)
+        self.metrics = DetectionMetrics(self.detection_methods)
+        
+        self._apply_pack(signature_registry.current)
+    
+    def reload_signatures(self):
+        """Recompile signatures after the dictionaries were changed"""
+        self._compile_signatures()
+    
+    def _apply_pack(self, pack):
+        """Take signatures and IP ranges from a signature pack generation"""
+        self._pack = pack
+        self._ip_index = pack.ip_index
+        self._known_fingerprints = pack.header_fingerprints
+        self._generic_bot_signatures = pack.sets['generic_bot']
+        self._tiktok_specific_signatures = pack.sets['tiktok_specific']
+        self.tiktok_bot_signatures['user_agents'] = pack.patterns('tiktok_bot_ua')
+        self.instagram_bot_signatures['user_agents'] = pack.patterns('instagram_bot_ua')
+        self.instagram_bot_signatures['referrer_patterns'] = pack.patterns('instagram_referrer')
+        self._compile_signatures()
+    
+    def _compile_signatures(self):
+        """Compile the signature dictionaries into single-scan matchers"""
+        # Cached verdicts were computed with the old signatures
+        self.signature_version += 1
+        self.verdict_cache.clear()
+        
+        self._tiktok_ua_signatures = SignatureSet.from_patterns(
+            'tiktok_bot_ua', self.tiktok_bot_signatures['user_agents'], platform='tiktok', weight=0.95
+        )
+        
+        instagram_signatures = []
+        for index, pattern in enumerate(self.instagram_bot_signatures['user_agents']):
+            is_facebook = any(fb in pattern.lower() for fb in FACEBOOK_PATTERN_MARKERS)
+            instagram_signatures.append(Signature(
+                id=f'instagram_bot_ua:{index}',
+                pattern=pattern,
+                platform='facebook' if is_facebook else 'instagram',
+                weight=0.95
+            ))
+        # Some patterns need case-sensitive matching (e.g., [FBAN/), so keep both variants
+        self._instagram_ua_signatures = SignatureSet('instagram_bot_ua', instagram_signatures, re.IGNORECASE)
+        self._instagram_ua_signatures_exact = SignatureSet('instagram_bot_ua', instagram_signatures)
+        self._instagram_referrer_signatures = SignatureSet.from_patterns(
+            'instagram_referrer', self.instagram_bot_signatures['referrer_patterns'], platform='instagram'
+        )
+        # The user agent stage can report any platform its signatures map to
+        self.method_profiles['user_agent'] = replace(
+            self.method_profiles['user_agent'],
+            platforms=frozenset(['tiktok'] + [signature.platform for signature in instagram_signatures])
+        )
+        self._plan_evaluation()
+        # Referrers repeat heavily, so their cache-key traits are memoised per signature version
+        self._referrer_traits = lru_cache(maxsize=4096)(self._referrer_traits_uncached)
     
     def analyze_request(self, user_agent: str = None, ip_address: str = None, 
-                       referrer: str = None, headers: Dict = None) -> DetectionResult:
-        """Comprehensive request analysis"""
+                       referrer: str = None, headers: Dict = None,
+                       short_code: str = None) -> DetectionResult:
+        """Comprehensive request analysis
+        
+        ``short_code`` identifies the link being hit; it enables timing
+        analysis, which records the arrival for this client.
+        """
         
         # Get request data if not provided (handle cases outside request context)
         try:
@@ -129,23 +266,176 @@ class AdvancedDetectionEngine:
             referrer = referrer or ''
             headers = headers or {}
         
+        # Pick up a reloaded signature pack (the file check is throttled)
+        pack = signature_registry.refresh()
+        if pack is not self._pack:
+            self._apply_pack(pack)
+        
+        # Header-order fingerprint, computed once and shared by the cache key and header_order
+        fingerprint = None
+        if headers:
+            canonical = header_fingerprint(headers)
+            fingerprint = fingerprint_id(canonical)
+            self.fingerprint_table.observe(fingerprint, canonical)
+        
+        # Stateful methods see every request, cached or not
+        stateful_hits = []
+        timing = self._call_method('timing_analysis', self._analyze_timing,
+                                   user_agent, ip_address, referrer, headers, short_code)
+        if timing:
+            stateful_hits.append(('timing_analysis', timing))
+        
+        if not self.verdict_cache.enabled:
+            hits, skipped = self._run_methods(user_agent, ip_address, referrer, headers, fingerprint)
+            return self._combine(hits + stateful_hits, user_agent, referrer, skipped)
+        
+        cache_key = self._verdict_cache_key(user_agent, ip_address, referrer, headers, fingerprint)
+        cached = self.verdict_cache.get(cache_key)
+        if cached is None:
+            hits, skipped = self._run_methods(user_agent, ip_address, referrer, headers, fingerprint)
+            cached = (hits, skipped, self._combine(hits, user_agent, referrer, skipped))
+            self.verdict_cache.set(cache_key, cached)
+        
+        hits, skipped, result = cached
+        if stateful_hits:
+            return self._combine(hits + stateful_hits, user_agent, referrer, skipped)
+        return result
+    
+    def _run_methods(self, user_agent: str, ip_address: str, referrer: str, headers: Dict,
+                     fingerprint: int = None) -> Tuple[List[Tuple[str, Dict]], List[str]]:
+        """Run the stateless detection methods cheapest first
+        
+        Returns the (method_name, result) hits and the methods that were
+        skipped because they could no longer change the verdict.
+        """
+        hits = []
+        top_score = 0.0
+        order = self._evaluation_order
+        for position, method_name in enumerate(order):
+            if top_score > 0.7 and self.short_circuit and self._verdict_settled(hits, position):
+                skipped = order[position:]
+                self.short_circuits += 1
+                for name in skipped:
+                    self.method_skips[name] += 1
+                return hits, skipped
+            if method_name == 'header_order':
+                # Reuse the fingerprint analyze_request already computed
+                result = self._call_method(method_name, self.detection_methods[method_name],
+                                           user_agent, ip_address, referrer, headers, fingerprint)
+            else:
+                result = self._call_method(method_name, self.detection_methods[method_name],
+                                           user_agent, ip_address, referrer, headers)
+            if result:
+                hits.append((method_name, result))
+                top_score = max(top_score, result.get('confidence', 0.5))
+        return hits, []
+    
+    def _call_method(self, method_name: str, method_func, *args) -> Optional[Dict]:
+        """Run one detection method, recording its latency and outcome
+        
+        A failing method counts as no detection; failures are logged on the
+        1st, 2nd, 4th, 8th... occurrence so a broken method can't flood the log.
+        """
+        start = time.perf_counter_ns()
+        try:
+            result = method_func(*args)
+        except Exception:
+            failures = self.metrics.record_error(method_name, time.perf_counter_ns() - start)
+            if failures & (failures - 1) == 0:
+                logger.warning(f"Detection method {method_name} failed ({failures} failures so far)",
+                               exc_info=True)
+            return None
+        self.metrics.record(method_name, time.perf_counter_ns() - start, bool(result))
+        return result
+    
+    def _plan_evaluation(self):
+        """Order the stateless methods by cost and bound what each tail of that order can add
+        
+        Stateful methods always count as remaining, since they are combined in
+        later (possibly on top of a cached result).
+        """
+        order = sorted((name for name in self.detection_methods if name not in STATEFUL_METHODS),
+                       key=lambda name: self.method_profiles[name].cost)
+        stateful = [self.method_profiles[name] for name in sorted(STATEFUL_METHODS)]
+        
+        bounds = []
+        for position in range(len(order)):
+            candidates = [self.method_profiles[name] for name in order[position:]] + stateful
+            platform_ranks = [0 if profile.platforms is None else
+                              min([_platform_rank(platform) for platform in profile.platforms],
+                                  default=len(PLATFORM_PRIORITY) + 1)
+                              for profile in candidates]
+            bounds.append((
+                max([profile.max_confidence for profile in candidates if profile.max_confidence > 0.7],
+                    default=0.0),
+                len([profile for profile in candidates if profile.max_confidence > 0.8]),
+                len(candidates),
+                min(platform_ranks),
+                any(profile.platforms is None or profile.platforms for profile in candidates),
+            ))
+        
+        self._evaluation_order = order
+        self._remaining_bounds = bounds
+    
+    def _verdict_settled(self, hits: List[Tuple[str, Dict]], position: int) -> bool:
+        """Check if no outcome of the methods from ``position`` on can change is_bot, risk_level or platform"""
+        max_confidence, max_strong, count, best_rank, can_report_platform = self._remaining_bounds[position]
+        
+        scores = [result.get('confidence', 0.5) for _, result in hits]
+        high_scores = [score for score in scores if score > 0.7]
+        if not high_scores:
+            # Confidence is still an average that any further hit can move
+            return False
+        
+        # With a high score present, confidence can only rise and the other
+        # inputs only grow, so comparing the two extremes is enough
+        low_confidence = max(high_scores)
+        high_confidence = max(low_confidence, max_confidence)
+        strong = len([score for score in scores if score > 0.8])
+        if (_is_bot_verdict(low_confidence, strong, len(hits)) !=
+                _is_bot_verdict(high_confidence, strong + max_strong, len(hits) + count)):
+            return False
+        if (self._assess_risk_level(low_confidence, hits) !=
+                self._assess_risk_level(high_confidence, [None] * (len(hits) + count))):
+            return False
+        
+        # The primary platform must already outrank anything still to come
+        platforms = [result['platform'] for _, result in hits if 'platform' in result]
+        if not platforms:
+            return not can_report_platform
+        current_rank = min(_platform_rank(platform) for platform in platforms)
+        return current_rank < len(PLATFORM_PRIORITY) and current_rank <= best_rank
+    
+    def _combine(self, hits: List[Tuple[str, Dict]], user_agent: str, referrer: str,
+                 skipped: List[str] = None) -> DetectionResult:
+        """Combine method hits into a single verdict"""
         detection_results = []
         confidence_scores = []
         detected_platforms = set()
         
-        # Run all detection methods
-        for method_name, method_func in self.detection_methods.items():
-            try:
-                result = method_func(user_agent, ip_address, referrer, headers)
-                if result:
-                    detection_results.append(method_name)
-                    confidence_scores.append(result.get('confidence', 0.5))
-                    if 'platform' in result:
-                        detected_platforms.add(result['platform'])
-            except Exception:
-                # Continue if individual method fails
-                pass
+        for method_name, result in sorted(hits, key=lambda hit: self._method_order.get(hit[0], len(self._method_order))):
+            detection_results.append(method_name)
+            confidence_scores.append(result.get('confidence', 0.5))
+            if 'platform' in result:
+                detected_platforms.add(result['platform'])
+        
+        overall_confidence, is_bot, risk_level = self.score_verdict(confidence_scores)
         
+        # Determine primary platform
+        platform = self._determine_primary_platform(detected_platforms, user_agent, referrer)
+        
+        return DetectionResult(
+            is_bot=is_bot,
+            confidence_score=overall_confidence,
+            platform=platform,
+            detection_methods=detection_results,
+            risk_level=risk_level,
+            skipped_methods=list(skipped or []),
+            method_scores=dict(zip(detection_results, confidence_scores))
+        )
+    
+    def score_verdict(self, confidence_scores: List[float]) -> Tuple[float, bool, str]:
+        """Overall confidence, bot decision and risk level for the scores of the methods that fired"""
         # Calculate overall confidence with weighted scoring
         if confidence_scores:
             # Weight by method importance and take average of top scores
@@ -159,22 +449,78 @@ class AdvancedDetectionEngine:
         
         # Determine if bot with more nuanced logic
         high_confidence_detections = len([score for score in confidence_scores if score > 0.8])
-        is_bot = (overall_confidence > 0.8 or 
-                 (overall_confidence > 0.6 and high_confidence_detections >= 1) or 
-                 len(detection_results) >= 4)
-        
-        # Determine primary platform
-        platform = self._determine_primary_platform(detected_platforms, user_agent, referrer)
+        is_bot = _is_bot_verdict(overall_confidence, high_confidence_detections, len(confidence_scores))
         
         # Risk assessment
-        risk_level = self._assess_risk_level(overall_confidence, detection_results)
+        risk_level = self._assess_risk_level(overall_confidence, confidence_scores)
         
-        return DetectionResult(
-            is_bot=is_bot,
-            confidence_score=overall_confidence,
-            platform=platform,
-            detection_methods=detection_results,
-            risk_level=risk_level
+        return overall_confidence, is_bot, risk_level
+    
+    def metrics_snapshot(self) -> Dict:
+        """Per-method metrics plus the engine's cache, timing and short-circuit counters"""
+        snapshot = self.metrics.snapshot()
+        for name, skipped in self.method_skips.items():
+            snapshot['methods'].setdefault(name, {})['skipped'] = skipped
+        snapshot['short_circuit'] = self.short_circuit_stats()
+        snapshot['verdict_cache'] = self.verdict_cache.stats()
+        snapshot['timing_tracker'] = self.timing_tracker.stats()
+        snapshot['header_fingerprints'] = {**self.fingerprint_table.stats(),
+                                           'top': self.fingerprint_table.top()}
+        return snapshot
+    
+    def short_circuit_stats(self) -> Dict:
+        """How often evaluation stopped early and which methods were skipped"""
+        return {
+            'enabled': self.short_circuit,
+            'evaluation_order': list(self._evaluation_order),
+            'short_circuits': self.short_circuits,
+            'method_skips': dict(self.method_skips),
+        }
+    
+    def _verdict_cache_key(self, user_agent: str, ip_address: str, referrer: str, headers: Dict,
+                           fingerprint: int = None) -> Tuple:
+        """Key covering everything the detection methods read from a request
+        
+        The UA is kept whole; the IP contributes its truncated prefix and the
+        platform ranges it falls in; the referrer contributes its host and the
+        few substrings the methods test; headers contribute a presence/value-class
+        fingerprint and the header-order fingerprint. Two requests with the same key get the same verdict.
+        """
+        header_traits = (
+            tuple([name in headers for name in CACHE_KEY_HEADERS]),
+            headers.get('Accept', '') in ['*/*', 'text/html', ''],
+            str(headers.get('Connection', '')).lower() == 'close',
+        )
+        
+        return (
+            self.signature_version,
+            self._ip_index.version,
+            user_agent,
+            _ip_prefix(ip_address),
+            self._ip_index.lookup(ip_address),
+            self._ip_index.contains(ip_address, 'tiktok'),
+            self._referrer_traits(referrer),
+            header_traits,
+            fingerprint,
+        )
+    
+    def _referrer_traits_uncached(self, referrer: str) -> Tuple:
+        """Referrer host plus the substrings the detection methods test"""
+        ref_lower = referrer.lower() if referrer else ''
+        try:
+            referrer_host = urlsplit(ref_lower).hostname or ''
+        except ValueError:
+            referrer_host = ''
+        
+        return (
+            referrer_host,
+            bool(referrer),
+            'http' in referrer if referrer else False,
+            'tiktok.com' in ref_lower,
+            'musically.com' in ref_lower,
+            len(self._instagram_referrer_signatures.matches(ref_lower)),
+            tuple([keyword in ref_lower for keyword in FALLBACK_TIKTOK_KEYWORDS + FALLBACK_INSTAGRAM_KEYWORDS]),
+            ref_lower[:9],  # fallback keywords are also tested across the UA/referrer boundary
         )
     
     def _analyze_user_agent(self, user_agent: str, ip: str, referrer: str, headers: Dict) -> Dict:
@@ -186,29 +532,20 @@ class AdvancedDetectionEngine:
         confidence = 0.0
         
         # Check for known bot patterns
-        bot_patterns = [
-            r'bot', r'crawler', r'spider', r'scraper',
-            r'curl', r'wget', r'python', r'requests',
-            r'headless', r'phantom', r'selenium', r'puppeteer'
-        ]
-        
-        for pattern in bot_patterns:
-            if re.search(pattern, ua_lower):
-                confidence = max(confidence, 0.8)
+        if self._generic_bot_signatures.search(ua_lower):
+            confidence = max(confidence, 0.8)
         
         # TikTok specific checks
-        for pattern in self.tiktok_bot_signatures['user_agents']:
-            if re.search(pattern, ua_lower):
-                confidence = max(confidence, 0.95)
-                return {'confidence': confidence, 'platform': 'tiktok', 'reason': 'tiktok_bot_ua'}
+        if self._tiktok_ua_signatures.search(ua_lower):
+            confidence = max(confidence, 0.95)
+            return {'confidence': confidence, 'platform': 'tiktok', 'reason': 'tiktok_bot_ua'}
         
         # Instagram/Facebook specific checks
-        for pattern in self.instagram_bot_signatures['user_agents']:
-            # Some patterns need case-sensitive matching (e.g., [FBAN/)
-            if re.search(pattern, user_agent, re.IGNORECASE):
-                confidence = max(confidence, 0.95)
-                platform = 'facebook' if any(fb in pattern.lower() for fb in ['fban', 'fbav', 'fbios', 'fbdv', '\[fb']) else 'instagram'
-                return {'confidence': confidence, 'platform': platform, 'reason': f'{platform}_bot_ua'}
+        signature = self._instagram_ua_signatures.first(user_agent)
+        if signature:
+            confidence = max(confidence, 0.95)
+            platform = signature.platform
+            return {'confidence': confidence, 'platform': platform, 'reason': f'{platform}_bot_ua'}
         
         # Length and complexity analysis
         if len(user_agent) < 20:
@@ -236,14 +573,11 @@ class AdvancedDetectionEngine:
             return None
         
         confidence = 0.0
-        platform = None
         
         # Check against known platform IP ranges
-        for platform_name, ip_ranges in PLATFORM_IP_RANGES.items():
-            if self._ip_in_ranges(ip, ip_ranges):
-                confidence = 0.9
-                platform = platform_name
-                break
+        platform = self._ip_index.lookup(ip)
+        if platform:
+            confidence = 0.9
         
         return {'confidence': confidence, 'platform': platform} if confidence > 0.0 else None
     
@@ -253,8 +587,7 @@ class AdvancedDetectionEngine:
         reasons = []
         
         # Check for missing headers that browsers typically send
-        expected_headers = ['Accept', 'Accept-Language', 'Accept-Encoding', 'Connection']
-        missing_headers = [h for h in expected_headers if h not in headers]
+        missing_headers = [h for h in EXPECTED_BROWSER_HEADERS if h not in headers]
         
         if missing_headers:
             confidence += len(missing_headers) * 0.15
@@ -273,23 +606,65 @@ class AdvancedDetectionEngine:
             reasons.append('connection_close')
         
         # Check for automation tool headers
-        automation_headers = ['X-Requested-With', 'X-Automation', 'Selenium-Remote-Control']
-        for header in automation_headers:
+        for header in AUTOMATION_HEADERS:
             if header in headers:
                 confidence += 0.3
                 reasons.append('automation_header')
         
         return {'confidence': min(confidence, 1.0), 'reasons': reasons} if confidence > 0.2 else None
     
-    def _analyze_timing(self, user_agent: str, ip: str, referrer: str, headers: Dict) -> Dict:
-        """Request timing analysis"""
-        # This would typically track request patterns over time
-        # For now, implement basic timing checks
+    def _analyze_header_order(self, user_agent: str, ip: str, referrer: str, headers: Dict,
+                              fingerprint: int = None) -> Dict:
+        """Header order and header set against known client fingerprints
+        
+        A known HTTP library fingerprint is a bot; a known browser fingerprint
+        whose user agent claims a browser family that doesn't send it is a
+        forged user agent.
+        """
+        if not headers:
+            return None
+        if fingerprint is None:
+            fingerprint = fingerprint_id(header_fingerprint(headers))
+        
+        known = self._known_fingerprints.get(fingerprint)
+        if known is None:
+            return None
+        label, client, families = known
+        if label == 'bot':
+            return {'confidence': 0.85, 'reasons': [f'client_header_order_{client}']}
+        family = BROWSER_FAMILY_SIGNATURES.first(user_agent)
+        if family is None or family.platform not in families:
+            return {'confidence': 0.75, 'reasons': [f'forged_user_agent_{client}']}
+        return None
+    
+    def _analyze_timing(self, user_agent: str, ip: str, referrer: str, headers: Dict,
+                        short_code: str = None) -> Dict:
+        """Request timing analysis
+        
+        Records the arrival per truncated IP and per (truncated IP, link) and
+        flags machine-regular intervals or bursts. Only requests for a known
+        link are tracked, so helper calls don't count as arrivals.
+        """
+        if not short_code or not ip:
+            return None
+        
+        prefix = _ip_prefix(ip)
+        client = self.timing_tracker.observe(f'ip:{prefix}')
+        link = self.timing_tracker.observe(f'link:{prefix}/{short_code}')
         
-        # Check if request seems too fast (less than 100ms after page load)
-        # This would require session tracking in a real implementation
+        # Scripted loops hit the same link with near-constant gaps
+        if (link.samples >= self.timing_tracker.window and
+                link.mean_interval <= TIMING_REGULAR_MAX_INTERVAL and
+                link.interval_cv <= TIMING_REGULAR_MAX_CV):
+            return {'confidence': 0.85, 'reason': 'machine_regular_timing'}
         
-        return None  # Placeholder for timing analysis
+        if link.recent >= TIMING_LINK_BURST:
+            return {'confidence': 0.75, 'reason': 'link_burst'}
+        
+        if client.recent >= TIMING_CLIENT_BURST:
+            return {'confidence': 0.7, 'reason': 'client_burst'}
+        
+        return None
     
     def _analyze_behavior(self, user_agent: str, ip: str, referrer: str, headers: Dict) -> Dict:
         """Behavioral pattern analysis"""
@@ -315,11 +690,11 @@ class AdvancedDetectionEngine:
         
         # TikTok specific detection
         tiktok_indicators = 0
-        if any(re.search(pattern, ua_lower) for pattern in TIKTOK_SPECIFIC_PATTERNS):
+        if self._tiktok_specific_signatures.search(ua_lower):
             tiktok_indicators += 3
         if 'tiktok.com' in ref_lower or 'musically.com' in ref_lower:
             tiktok_indicators += 2
-        if self._ip_in_ranges(ip, PLATFORM_IP_RANGES.get('tiktok', [])):
+        if self._ip_index.contains(ip, 'tiktok'):
             tiktok_indicators += 3
         
         if tiktok_indicators >= 2:
@@ -331,13 +706,8 @@ class AdvancedDetectionEngine:
         
         # Instagram specific detection
         instagram_indicators = 0
-        for pattern in self.instagram_bot_signatures['user_agents']:
-            if re.search(pattern, ua_lower):
-                instagram_indicators += 3
-        
-        for pattern in self.instagram_bot_signatures['referrer_patterns']:
-            if re.search(pattern, ref_lower):
-                instagram_indicators += 2
+        instagram_indicators += 3 * len(self._instagram_ua_signatures_exact.matches(ua_lower))
+        instagram_indicators += 2 * len(self._instagram_referrer_signatures.matches(ref_lower))
         
         if instagram_indicators >= 2:
             return {
@@ -353,16 +723,7 @@ class AdvancedDetectionEngine:
         if not ip_address or not ip_ranges:
             return False
         
-        try:
-            ip_obj = ipaddress.ip_address(ip_address)
-            for cidr in ip_ranges:
-                network = ipaddress.ip_network(cidr, strict=False)
-                if ip_obj in network:
-                    return True
-        except (ValueError, ipaddress.AddressValueError):
-            pass
-        
-        return False
+        return _range_index_for(tuple(ip_ranges)).contains(ip_address, 'match')
     
     def _determine_primary_platform(self, platforms: set, user_agent: str, referrer: str) -> str:
         """Determine the primary platform from detected platforms"""
@@ -371,16 +732,15 @@ class AdvancedDetectionEngine:
             ua_lower = user_agent.lower() if user_agent else ''
             ref_lower = referrer.lower() if referrer else ''
             
-            if any(keyword in ua_lower + ref_lower for keyword in ['tiktok', 'bytespider', 'douyin']):
+            if any(keyword in ua_lower + ref_lower for keyword in FALLBACK_TIKTOK_KEYWORDS):
                 return 'tiktok'
-            elif any(keyword in ua_lower + ref_lower for keyword in ['instagram', 'facebook']):
+            elif any(keyword in ua_lower + ref_lower for keyword in FALLBACK_INSTAGRAM_KEYWORDS):
                 return 'instagram'
             else:
                 return 'unknown'
         
         # Priority order for platform detection
-        priority_order = ['tiktok', 'instagram', 'facebook', 'twitter', 'google']
-        for platform in priority_order:
+        for platform in PLATFORM_PRIORITY:
             if platform in platforms:
                 return platform
         
@@ -397,6 +757,46 @@ class AdvancedDetectionEngine:
         else:
             return 'low'
 
+def _is_bot_verdict(confidence: float, strong_detections: int, detection_count: int) -> bool:
+    """Bot decision from the combined confidence and detection counts"""
+    return (confidence > 0.8 or 
+            (confidence > 0.6 and strong_detections >= 1) or 
+            detection_count >= 4)
+
+def parse_stored_methods(value: Optional[str]) -> Tuple[Dict[str, Optional[float]], List[str]]:
+    """Read a Click.detection_methods value (see DetectionResult.stored_methods)
+    
+    Returns ({method: confidence} for the methods that fired, skipped
+    methods). Rows written before scores were stored are a JSON list of
+    names; their confidences are None.
+    """
+    try:
+        stored = json.loads(value) if value else []
+    except ValueError:
+        return {}, []
+    if isinstance(stored, list):
+        return {name: None for name in stored if isinstance(name, str)}, []
+    if not isinstance(stored, dict):
+        return {}, []
+    fired = {name: float(score) for name, score in stored.items() if isinstance(score, (int, float))}
+    return fired, [name for name, score in stored.items() if score is None]
+
+def _platform_rank(platform: str) -> int:
+    return PLATFORM_PRIORITY.index(platform) if platform in PLATFORM_PRIORITY else len(PLATFORM_PRIORITY)
+
+def _ip_prefix(ip_address: str) -> str:
+    """Truncated address prefix (/24 for IPv4, first four groups for IPv6)"""
+    if not ip_address:
+        return ''
+    if ':' in ip_address:
+        return ':'.join(ip_address.split(':')[:4])
+    return ip_address.rsplit('.', 1)[0]
+
+@lru_cache(maxsize=32)
+def _range_index_for(ip_ranges: Tuple[str, ...]) -> IPRangeIndex:
+    """Build (once) an index for an ad-hoc list of CIDR blocks"""
+    return IPRangeIndex.from_mapping({'match': ip_ranges})
+
 # Singleton instance for use across the application
 detection_engine = AdvancedDetectionEngine()
 
@@ -406,5 +806,4 @@ def enhanced_bot_detection(user_agent: str = None, ip_address: str = None) -> De
 
 def is_sophisticated_tiktok_bot(user_agent: str = None, ip_address: str = None) -> bool:
     """Specific TikTok bot detection with high accuracy"""
-    result = detection_engine.analyze_request(user_agent, ip_address)
-    return result.platform == 'tiktok' and result.confidence_score >= 0.8
\ No newline at end of file
+    return detection_engine.analyze_request(user_agent, ip_address).is_sophisticated_tiktok
\ No newline at end of file
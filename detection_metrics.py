@@ -0,0 +1,153 @@
+"""
+Per-method instrumentation for the detection engine
+Counts calls, hits and failures and keeps a fixed log2-scale latency histogram
+per method. Counters live in plain lists per worker process, so recording is a
+few integer increments; they are unlocked, and concurrent threads may
+occasionally lose an increment.
+"""
+
+import os
+import time
+from typing import Dict, Iterable, List
+
+# Bucket i counts calls that took less than 2**(HISTOGRAM_MIN_EXPONENT + i) ns;
+# 256ns .. ~67ms, plus a final overflow bucket
+HISTOGRAM_MIN_EXPONENT = 8
+HISTOGRAM_BUCKETS = 19
+
+
+class MethodMetrics:
+    """Counters and latency histogram for one detection method"""
+
+    __slots__ = ('name', 'calls', 'hits', 'errors', 'total_ns', 'buckets')
+
+    def __init__(self, name: str):
+        self.name = name
+        self.calls = 0
+        self.hits = 0
+        self.errors = 0
+        self.total_ns = 0
+        self.buckets = [0] * (HISTOGRAM_BUCKETS + 1)
+
+    def observe(self, elapsed_ns: int):
+        self.calls += 1
+        self.total_ns += elapsed_ns
+        index = elapsed_ns.bit_length() - HISTOGRAM_MIN_EXPONENT
+        if index < 0:
+            index = 0
+        elif index > HISTOGRAM_BUCKETS:
+            index = HISTOGRAM_BUCKETS
+        self.buckets[index] += 1
+
+    def snapshot(self) -> Dict:
+        return {
+            'calls': self.calls,
+            'hits': self.hits,
+            'errors': self.errors,
+            'hit_rate': round(self.hits / self.calls, 4) if self.calls else 0.0,
+            'mean_ns': round(self.total_ns / self.calls) if self.calls else 0,
+            'total_ns': self.total_ns,
+            'histogram': {
+                'le_ns': [bucket_label(index) for index in range(len(self.buckets))],
+                'counts': list(self.buckets),
+            },
+        }
+
+
+def bucket_bound_ns(index: int) -> float:
+    """Upper bound of a histogram bucket in ns (inf for the overflow bucket)"""
+    if index >= HISTOGRAM_BUCKETS:
+        return float('inf')
+    return float(2 ** (HISTOGRAM_MIN_EXPONENT + index))
+
+
+def bucket_label(index: int):
+    bound = bucket_bound_ns(index)
+    return '+Inf' if bound == float('inf') else int(bound)
+
+
+class DetectionMetrics:
+    """Per-worker registry of MethodMetrics"""
+
+    def __init__(self, method_names: Iterable[str], enabled: bool = None):
+        if enabled is None:
+            enabled = os.environ.get('DETECTION_METRICS', '1').lower() not in ('0', 'false', 'no')
+        self.enabled = enabled
+        self.started_at = time.time()
+        self.methods: Dict[str, MethodMetrics] = {name: MethodMetrics(name) for name in method_names}
+
+    def _method(self, name: str) -> MethodMetrics:
+        metrics = self.methods.get(name)
+        if metrics is None:
+            metrics = self.methods.setdefault(name, MethodMetrics(name))
+        return metrics
+
+    def record(self, name: str, elapsed_ns: int, hit: bool):
+        """Record one completed call"""
+        if not self.enabled:
+            return
+        metrics = self._method(name)
+        metrics.observe(elapsed_ns)
+        if hit:
+            metrics.hits += 1
+
+    def record_error(self, name: str, elapsed_ns: int) -> int:
+        """Record a call that raised, returns the method's failure count
+
+        Failures are counted even when timing is disabled.
+        """
+        metrics = self._method(name)
+        if self.enabled:
+            metrics.observe(elapsed_ns)
+        metrics.errors += 1
+        return metrics.errors
+
+    def reset(self):
+        self.started_at = time.time()
+        self.methods = {name: MethodMetrics(name) for name in self.methods}
+
+    def snapshot(self) -> Dict:
+        """JSON-friendly view of every counter"""
+        return {
+            'enabled': self.enabled,
+            'pid': os.getpid(),
+            'uptime_seconds': round(time.time() - self.started_at, 1),
+            'methods': {name: metrics.snapshot() for name, metrics in self.methods.items()},
+        }
+
+    def to_prometheus(self, skips: Dict[str, int] = None) -> str:
+        """Prometheus text exposition of the counters and histograms"""
+        lines: List[str] = []
+        pid = os.getpid()
+
+        def counter(metric: str, help_text: str, attribute: str):
+            lines.append(f'# HELP {metric} {help_text}')
+            lines.append(f'# TYPE {metric} counter')
+            for name, metrics in self.methods.items():
+                lines.append(f'{metric}{{method="{name}",pid="{pid}"}} {getattr(metrics, attribute)}')
+
+        counter('detection_method_calls_total', 'Detection method invocations.', 'calls')
+        counter('detection_method_hits_total', 'Detection method invocations that reported a signal.', 'hits')
+        counter('detection_method_errors_total', 'Detection method invocations that raised.', 'errors')
+
+        if skips is not None:
+            lines.append('# HELP detection_method_skipped_total Detection methods skipped by short-circuiting.')
+            lines.append('# TYPE detection_method_skipped_total counter')
+            for name, count in skips.items():
+                lines.append(f'detection_method_skipped_total{{method="{name}",pid="{pid}"}} {count}')
+
+        metric = 'detection_method_duration_seconds'
+        lines.append(f'# HELP {metric} Detection method latency.')
+        lines.append(f'# TYPE {metric} histogram')
+        for name, metrics in self.methods.items():
+            labels = f'method="{name}",pid="{pid}"'
+            cumulative = 0
+            for index, count in enumerate(metrics.buckets):
+                cumulative += count
+                bound = bucket_bound_ns(index)
+                le = '+Inf' if bound == float('inf') else f'{bound / 1e9:.9g}'
+                lines.append(f'{metric}_bucket{{{labels},le="{le}"}} {cumulative}')
+            lines.append(f'{metric}_sum{{{labels}}} {metrics.total_ns / 1e9:.9g}')
+            lines.append(f'{metric}_count{{{labels}}} {metrics.calls}')
+
+        return '\n'.join(lines) + '\n'
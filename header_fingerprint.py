@@ -0,0 +1,169 @@
+"""
+Header-order and header-set fingerprints
+HTTP clients send their headers in a fixed order with characteristic values,
+so a scraper forging a browser user agent still looks like curl or requests.
+A fingerprint is the header names in arrival order plus a few value classes,
+hashed to a 64-bit id for the known-fingerprint lookup and frequency table.
+"""
+
+import time
+import hashlib
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+# Added or reordered by proxies and platforms, or present only on some
+# visits (cookies, revalidation), so they would split one client into many
+IGNORED_HEADERS = frozenset([
+    'cookie', 'referer', 'if-none-match', 'if-modified-since', 'cache-control', 'pragma',
+    'content-length', 'content-type', 'forwarded', 'via', 'x-forwarded-for', 'x-forwarded-proto',
+    'x-forwarded-host', 'x-forwarded-port', 'x-real-ip', 'x-request-id', 'x-amzn-trace-id',
+    'true-client-ip', 'cdn-loop',
+])
+IGNORED_HEADER_PREFIXES = ('cf-', 'x-vercel-', 'x-railway-')
+
+KNOWN_ENCODINGS = ('br', 'deflate', 'gzip', 'zstd')
+
+
+# Header names whose values are reduced to a class
+CLASSIFIED_HEADERS = ('accept', 'accept-encoding', 'accept-language', 'connection')
+
+# Clients send the same few header layouts over and over, so the name part
+# of the fingerprint is memoised per raw name tuple (bounded)
+_layouts: Dict[tuple, Tuple[str, Tuple[Optional[str], ...]]] = {}
+_MAX_LAYOUTS = 4096
+
+
+def _layout(names: tuple) -> Tuple[str, Tuple[Optional[str], ...]]:
+    """(joined kept names, raw name of each classified header or None)"""
+    kept = []
+    raw_names = dict.fromkeys(CLASSIFIED_HEADERS)
+    for name in names:
+        normalised = name.lower()
+        if normalised in IGNORED_HEADERS or normalised.startswith(IGNORED_HEADER_PREFIXES):
+            continue
+        kept.append(normalised)
+        if normalised in raw_names:
+            raw_names[normalised] = name
+    layout = (','.join(kept), tuple(raw_names.values()))
+    if len(_layouts) < _MAX_LAYOUTS:
+        _layouts[names] = layout
+    return layout
+
+
+def header_fingerprint(headers: Dict) -> str:
+    """Canonical fingerprint string of a header dict (in arrival order)
+
+    e.g. ``host,user-agent,accept|a:any;e:-;l:-;c:-`` for curl.
+    """
+    names = tuple(headers)
+    layout = _layouts.get(names)
+    if layout is None:
+        layout = _layout(names)
+    joined, raw_names = layout
+    values = tuple([None if name is None else headers[name] for name in raw_names])
+    return f"{joined}|{_value_classes(values)}"
+
+
+@lru_cache(maxsize=4096)
+def fingerprint_id(fingerprint: str) -> int:
+    """Stable 64-bit id of a fingerprint string (same in every process)"""
+    return int.from_bytes(hashlib.blake2b(fingerprint.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+@lru_cache(maxsize=4096)
+def _value_classes(values: Tuple[Optional[str], ...]) -> str:
+    accept, encoding, language, connection = values
+    return (f"a:{_accept_class(accept)};e:{_encoding_class(encoding)};"
+            f"l:{_language_class(language)};c:{_connection_class(connection)}")
+
+
+def _accept_class(value: Optional[str]) -> str:
+    if value is None:
+        return '-'
+    if value.strip() == '*/*':
+        return 'any'
+    return 'html' if 'text/html' in value else 'other'
+
+
+def _encoding_class(value: Optional[str]) -> str:
+    if value is None:
+        return '-'
+    value = value.lower()
+    tokens = [token for token in KNOWN_ENCODINGS if token in value]
+    return '+'.join(tokens) if tokens else 'other'
+
+
+def _language_class(value: Optional[str]) -> str:
+    if value is None:
+        return '-'
+    return 'q' if ';q=' in value else 'v'
+
+
+def _connection_class(value: Optional[str]) -> str:
+    if value is None:
+        return '-'
+    value = value.strip().lower()
+    return value if value in ('close', 'keep-alive') else 'other'
+
+
+class FingerprintTable:
+    """Time-decayed frequency counts of fingerprints (bounded memory)
+
+    Each count halves every ``half_life`` seconds without new sightings.
+    Decay is applied lazily when an entry is touched; once the table is
+    full the least frequent half is dropped.
+    """
+
+    def __init__(self, maxsize: int = 4096, half_life: float = 3600.0):
+        self.maxsize = maxsize
+        self.half_life = half_life
+        self.observations = 0
+        self.evictions = 0
+        self._entries: Dict[int, List] = {}  # id -> [count, updated_at, fingerprint]
+
+    def _decayed(self, entry: List, now: float) -> float:
+        return entry[0] * 0.5 ** ((now - entry[1]) / self.half_life)
+
+    def observe(self, key: int, fingerprint: str, now: float = None) -> float:
+        """Count one sighting, returns the decayed count including it"""
+        if self.maxsize <= 0:
+            return 0.0
+        now = time.time() if now is None else now
+        self.observations += 1
+        entry = self._entries.get(key)
+        if entry is None:
+            if len(self._entries) >= self.maxsize:
+                self._prune(now)
+            self._entries[key] = [1.0, now, fingerprint]
+            return 1.0
+        entry[0] = self._decayed(entry, now) + 1.0
+        entry[1] = now
+        return entry[0]
+
+    def count(self, key: int, now: float = None) -> float:
+        entry = self._entries.get(key)
+        if entry is None:
+            return 0.0
+        return self._decayed(entry, time.time() if now is None else now)
+
+    def _prune(self, now: float):
+        ranked = sorted(self._entries.items(), key=lambda item: self._decayed(item[1], now))
+        for key, _ in ranked[:max(1, len(ranked) // 2)]:
+            del self._entries[key]
+        self.evictions += len(ranked) - len(self._entries)
+
+    def top(self, limit: int = 20, now: float = None) -> List[Tuple[str, float]]:
+        """Most frequent fingerprints as (fingerprint, decayed count)"""
+        now = time.time() if now is None else now
+        ranked = sorted(((entry[2], self._decayed(entry, now)) for entry in list(self._entries.values())),
+                        key=lambda item: item[1], reverse=True)
+        return [(fingerprint, round(count, 2)) for fingerprint, count in ranked[:limit]]
+
+    def stats(self) -> Dict:
+        return {
+            'size': len(self._entries),
+            'maxsize': self.maxsize,
+            'half_life': self.half_life,
+            'observations': self.observations,
+            'evictions': self.evictions,
+        }
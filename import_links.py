@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Bulk link import
+Creates, updates or deactivates a user's links from a CSV, JSON or JSON Lines
+file, in batched transactions (see bulk_links.py for the operations). CSV
+columns: action (default create), short_code, title, target_url, safe_url,
+description, domain, use_js_challenge, direct_from_tiktok; empty cells are
+left unchanged.
+
+Usage:
+    python import_links.py --user creator@example.com links.csv
+    python import_links.py --user creator@example.com links.jsonl --results results.json
+"""
+import os
+import sys
+import csv
+import json
+import time
+import argparse
+
+from app import app
+from models import User
+from bulk_links import BULK_BATCH_SIZE, apply_operations
+
+
+def read_operations(path):
+    """Operations from a .csv, .json (list or {"links": [...]}) or .jsonl file"""
+    extension = os.path.splitext(path)[1].lower()
+    with open(path, newline='', encoding='utf-8') as handle:
+        if extension == '.csv':
+            return [{name: value for name, value in row.items() if name and value not in (None, '')}
+                    for row in csv.DictReader(handle)]
+        if extension == '.jsonl':
+            return [json.loads(line) for line in handle if line.strip()]
+        data = json.load(handle)
+    return data.get('links', []) if isinstance(data, dict) else data
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Create, update or deactivate links in bulk")
+    parser.add_argument('file', help="operations (.csv, .json or .jsonl)")
+    parser.add_argument('--user', required=True, help="email of the user who owns the links")
+    parser.add_argument('--batch-size', type=int, default=BULK_BATCH_SIZE, help="operations per transaction")
+    parser.add_argument('--host', default=None, help="host for link URLs without a custom domain")
+    parser.add_argument('--results', default=None, help="write per-operation results to this JSON file")
+    args = parser.parse_args()
+
+    try:
+        operations = read_operations(args.file)
+    except (OSError, ValueError) as e:
+        print(f"❌ Could not read {args.file}: {e}")
+        return 1
+    if not isinstance(operations, list):
+        print(f"❌ {args.file} doesn't contain a list of operations")
+        return 1
+
+    started = time.monotonic()
+    with app.app_context():
+        user = User.query.filter_by(email=args.user.lower().strip()).first()
+        if not user:
+            print(f"❌ No user with email {args.user}")
+            return 1
+        report = apply_operations(user.id, operations, batch_size=args.batch_size, host=args.host)
+
+    print(f"📦 {len(operations)} operations in {time.monotonic() - started:.1f}s: "
+          f"{report['created']} created, {report['updated']} updated, "
+          f"{report['deactivated']} deactivated, {report['error']} failed")
+    for result in report['results']:
+        if result['status'] == 'error':
+            print(f"   ❌ #{result['index'] + 1}: {result['error']}")
+
+    if args.results:
+        with open(args.results, 'w', encoding='utf-8') as handle:
+            json.dump(report['results'], handle, indent=2)
+        print(f"📝 Results written to {args.results}")
+    return 1 if report['error'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
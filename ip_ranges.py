@@ -0,0 +1,261 @@
+"""
+Preloaded IP range index for platform CIDR lookups
+CIDR blocks are flattened into sorted, non-overlapping integer intervals per
+address family, so "which platform owns this address" is a single bisect
+"""
+
+import json
+import socket
+import ipaddress
+from bisect import bisect_right
+from functools import lru_cache
+from typing import Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+_NO_MATCH = (None, frozenset())
+
+
+class IPRangeIndex:
+    """Sorted interval index mapping IPv4/IPv6 addresses to platforms
+
+    When ranges of different platforms overlap, the platform that was added
+    first owns the address; ``platforms()`` still reports every platform
+    whose ranges contain it.
+    """
+
+    def __init__(self, cache_size: int = 4096):
+        self._ranges: Dict[int, List[Tuple[int, int, int, str]]] = {4: [], 6: []}
+        self._priority: Dict[str, int] = {}
+        self._starts: Dict[int, List[int]] = {4: [], 6: []}
+        self._segments: Dict[int, List[Tuple[Optional[str], FrozenSet[str]]]] = {4: [], 6: []}
+        self._dirty = False
+        self.version = 0
+        self._resolve = lru_cache(maxsize=cache_size)(self._resolve_uncached)
+
+    @classmethod
+    def from_mapping(cls, ranges: Dict[str, Iterable[str]]) -> 'IPRangeIndex':
+        """Build an index from a {platform: [cidr, ...]} mapping"""
+        index = cls()
+        for platform, cidrs in ranges.items():
+            index.add_ranges(platform, cidrs)
+        index.build()
+        return index
+
+    def add_range(self, platform: str, cidr: str):
+        """Add a single CIDR block for a platform"""
+        network = ipaddress.ip_network(cidr.strip(), strict=False)
+        priority = self._priority.setdefault(platform, len(self._priority))
+        start = int(network.network_address)
+        end = int(network.broadcast_address)
+        self._ranges[network.version].append((start, end, priority, platform))
+        self._dirty = True
+
+    def add_ranges(self, platform: str, cidrs: Iterable[str]):
+        """Add several CIDR blocks for a platform"""
+        for cidr in cidrs:
+            self.add_range(platform, cidr)
+
+    def load_file(self, path: str, platform: str = None) -> int:
+        """Load published crawler ranges from a file, returns the number added
+
+        Accepts a JSON ``{platform: [cidr, ...]}`` mapping, Google-style JSON
+        (``{"prefixes": [{"ipv4Prefix": ...}, ...]}``, needs ``platform``), or
+        plain text with one ``cidr`` or ``platform cidr`` entry per line.
+        """
+        with open(path, 'r', encoding='utf-8') as handle:
+            content = handle.read()
+
+        added = 0
+        if content.lstrip().startswith('{'):
+            data = json.loads(content)
+            if 'prefixes' in data:
+                if not platform:
+                    raise ValueError(f"{path}: a platform is required for prefix lists")
+                for prefix in data['prefixes']:
+                    cidr = prefix.get('ipv4Prefix') or prefix.get('ipv6Prefix')
+                    if cidr:
+                        self.add_range(platform, cidr)
+                        added += 1
+            else:
+                for name, cidrs in data.items():
+                    for cidr in cidrs:
+                        self.add_range(name, cidr)
+                        added += 1
+        else:
+            for line in content.splitlines():
+                line = line.split('#', 1)[0].replace(',', ' ').strip()
+                if not line:
+                    continue
+                parts = line.split()
+                if len(parts) == 1:
+                    if not platform:
+                        raise ValueError(f"{path}: a platform is required for bare CIDR lines")
+                    self.add_range(platform, parts[0])
+                else:
+                    self.add_range(parts[0], parts[1])
+                added += 1
+
+        self.build()
+        return added
+
+    def build(self):
+        """Flatten the added ranges into disjoint sorted segments"""
+        for version, ranges in self._ranges.items():
+            boundaries = sorted({start for start, _, _, _ in ranges} |
+                                {end + 1 for _, end, _, _ in ranges})
+            pending = sorted(ranges)
+            active = []
+            position = 0
+            starts = []
+            segments = []
+
+            for boundary in boundaries:
+                while position < len(pending) and pending[position][0] <= boundary:
+                    active.append(pending[position])
+                    position += 1
+                active = [item for item in active if item[1] >= boundary]
+
+                if active:
+                    owner = min(active, key=lambda item: item[2])[3]
+                    segment = (owner, frozenset(item[3] for item in active))
+                else:
+                    segment = _NO_MATCH
+
+                # Merge with the previous segment when nothing changed
+                if segments and segments[-1] == segment:
+                    continue
+                starts.append(boundary)
+                segments.append(segment)
+
+            self._starts[version] = starts
+            self._segments[version] = segments
+
+        self._dirty = False
+        self.version += 1
+        self._resolve.cache_clear()
+
+    def _resolve_uncached(self, ip_address: str) -> Tuple[Optional[str], FrozenSet[str]]:
+        version, value = _parse_address(ip_address)
+        if version is None:
+            return _NO_MATCH
+
+        position = bisect_right(self._starts[version], value) - 1
+        if position < 0:
+            return _NO_MATCH
+        return self._segments[version][position]
+
+    def lookup(self, ip_address: str) -> Optional[str]:
+        """Platform owning the address, or None"""
+        if not ip_address:
+            return None
+        if self._dirty:
+            self.build()
+        return self._resolve(ip_address)[0]
+
+    def platforms(self, ip_address: str) -> FrozenSet[str]:
+        """Every platform whose ranges contain the address"""
+        if not ip_address:
+            return frozenset()
+        if self._dirty:
+            self.build()
+        return self._resolve(ip_address)[1]
+
+    def contains(self, ip_address: str, platform: str) -> bool:
+        """Check if the address falls in any range of the given platform"""
+        return platform in self.platforms(ip_address)
+
+    def __len__(self) -> int:
+        return sum(len(ranges) for ranges in self._ranges.values())
+
+    def segments(self, version: int) -> Tuple[List[int], List[Tuple[Optional[str], FrozenSet[str]]]]:
+        """Built (starts, segments) for one address family, for serialisation"""
+        if self._dirty:
+            self.build()
+        return self._starts[version], self._segments[version]
+
+
+class _FixedWidthKeys:
+    """Read-only sequence view of big-endian fixed-width keys in a buffer
+
+    Byte strings of equal length compare like the integers they encode, so
+    ``bisect`` works on this directly without decoding the table.
+    """
+
+    def __init__(self, buffer: memoryview, width: int):
+        self._buffer = buffer
+        self._width = width
+
+    def __len__(self) -> int:
+        return len(self._buffer) // self._width
+
+    def __getitem__(self, index: int) -> bytes:
+        start = index * self._width
+        return bytes(self._buffer[start:start + self._width])
+
+
+class MappedIPRangeIndex:
+    """IPRangeIndex lookups over tables held in a shared buffer (e.g. an mmap)
+
+    The starts and segment ids are never copied into Python lists, so
+    processes mapping the same file share a single copy of the tables.
+    """
+
+    def __init__(self, v4_starts: memoryview, v4_segment_ids: memoryview,
+                 v6_starts: memoryview, v6_segment_ids: memoryview,
+                 segments: List[Tuple[Optional[str], FrozenSet[str]]],
+                 range_count: int = 0, version: int = 1, cache_size: int = 4096):
+        self._starts = {4: v4_starts, 6: _FixedWidthKeys(v6_starts, 16)}
+        self._segment_ids = {4: v4_segment_ids, 6: v6_segment_ids}
+        self._segments = segments
+        self._range_count = range_count
+        self.version = version
+        self._resolve = lru_cache(maxsize=cache_size)(self._resolve_uncached)
+
+    def _resolve_uncached(self, ip_address: str) -> Tuple[Optional[str], FrozenSet[str]]:
+        version, value = _parse_address(ip_address)
+        if version is None:
+            return _NO_MATCH
+
+        key = value if version == 4 else value.to_bytes(16, 'big')
+        position = bisect_right(self._starts[version], key) - 1
+        if position < 0:
+            return _NO_MATCH
+        return self._segments[self._segment_ids[version][position]]
+
+    def lookup(self, ip_address: str) -> Optional[str]:
+        """Platform owning the address, or None"""
+        if not ip_address:
+            return None
+        return self._resolve(ip_address)[0]
+
+    def platforms(self, ip_address: str) -> FrozenSet[str]:
+        """Every platform whose ranges contain the address"""
+        if not ip_address:
+            return frozenset()
+        return self._resolve(ip_address)[1]
+
+    def contains(self, ip_address: str, platform: str) -> bool:
+        """Check if the address falls in any range of the given platform"""
+        return platform in self.platforms(ip_address)
+
+    def __len__(self) -> int:
+        return self._range_count
+
+
+def _parse_address(ip_address: str) -> Tuple[Optional[int], int]:
+    """Parse an address into (version, integer value)
+
+    inet_pton is much cheaper than ipaddress for the common case; anything it
+    rejects (e.g. scoped IPv6) goes through ipaddress for identical results.
+    """
+    try:
+        if ':' in ip_address:
+            return 6, int.from_bytes(socket.inet_pton(socket.AF_INET6, ip_address), 'big')
+        return 4, int.from_bytes(socket.inet_pton(socket.AF_INET, ip_address), 'big')
+    except (OSError, TypeError, ValueError):
+        pass
+
+    try:
+        ip_obj = ipaddress.ip_address(ip_address)
+    except ValueError:
+        return None, 0
+    return ip_obj.version, int(ip_obj)
@@ -0,0 +1,294 @@
+"""
+Per-worker short-code resolution cache for the redirect hot path
+Resolves a short code to an immutable LinkRecord (link fields plus its custom
+domain) with a single joined query, then serves repeats from memory. Unknown
+codes are cached briefly too. Link and domain changes committed through this
+worker invalidate their entries; other workers pick them up within the TTL.
+"""
+
+import os
+import time
+import asyncio
+from dataclasses import dataclass, field, fields
+from typing import Callable, Dict, Optional, Set
+from urllib.parse import urlsplit
+
+from flask import url_for
+from sqlalchemy import event, inspect, select
+from sqlalchemy.orm import Session, joinedload
+
+from link_snapshot import SnapshotSource, link_snapshot
+from models import SmartLink, CustomDomain
+from ttl_cache import TTLCache
+
+_MISSING = object()
+_CLEAR_ALL = object()
+
+# Request hosts whose redirect targets are kept per link (a link is normally
+# reached through its custom domain and the app's own domain)
+MAX_TARGET_HOSTS = 8
+
+# The app's own hosts. Redirect targets are only kept for these and the link's
+# custom domain: the Host header is the client's, so other hosts are built per request.
+APP_HOSTS = frozenset(os.environ[name].lower() for name in ('APP_DOMAIN', 'VERCEL_URL', 'VERCEL_APP_DOMAIN')
+                      if os.environ.get(name))
+
+# How long a code stays barred from the snapshot (it only matters while the
+# snapshot file it was served from is in use)
+SNAPSHOT_SKIP_TTL = 24 * 3600.0
+
+
+def _flask_url(endpoint: str, short_code: str) -> str:
+    return url_for(endpoint, short_code=short_code, _external=True)
+
+
+@dataclass(frozen=True)
+class RedirectTargets:
+    """Destination URL of every bot/suspect routing outcome of a link on one host"""
+    safe_tiktok: str
+    safe_instagram: str
+    safe: str          # the link's own safe URL, or the generic safe page
+    challenge: str
+
+    @classmethod
+    def build(cls, record: 'LinkRecord', build_url: Callable[[str, str], str] = None) -> 'RedirectTargets':
+        """Build through the URL map for the current request's host
+
+        ``build_url(endpoint, short_code)`` defaults to Flask's url_for.
+        """
+        build_url = build_url or _flask_url
+        short_code = record.short_code
+        return cls(
+            safe_tiktok=build_url('safe_page_tiktok', short_code),
+            safe_instagram=build_url('safe_page_instagram', short_code),
+            safe=record.safe_url or build_url('safe_page', short_code),
+            challenge=build_url('js_challenge', short_code),
+        )
+
+    def for_bot(self, platform: Optional[str]) -> str:
+        if platform == 'tiktok':
+            return self.safe_tiktok
+        if platform in ('instagram', 'facebook'):
+            return self.safe_instagram
+        return self.safe
+
+
+@dataclass(frozen=True)
+class LinkRecord:
+    """What the redirect, safe and challenge pages need from a SmartLink"""
+    id: int
+    short_code: str
+    title: str
+    description: Optional[str]
+    target_url: str
+    safe_url: Optional[str]
+    use_js_challenge: bool
+    direct_from_tiktok: bool
+    custom_domain: Optional[str]     # custom domain host, if the link has one
+    canonical_url: Optional[str]     # URL on the custom domain when it is verified and active
+    _targets: Dict[str, RedirectTargets] = field(default_factory=dict, init=False,
+                                                 repr=False, compare=False)
+
+    @classmethod
+    def from_model(cls, smart_link: SmartLink) -> 'LinkRecord':
+        domain = smart_link.custom_domain
+        canonical_url = None
+        if domain and domain.is_verified and domain.is_active:
+            protocol = 'https' if domain.ssl_enabled else 'http'
+            canonical_url = f"{protocol}://{domain.domain}/{smart_link.short_code}"
+        return cls(
+            id=smart_link.id,
+            short_code=smart_link.short_code,
+            title=smart_link.title,
+            description=smart_link.description,
+            target_url=smart_link.target_url,
+            safe_url=smart_link.safe_url,
+            use_js_challenge=bool(smart_link.use_js_challenge),
+            direct_from_tiktok=bool(smart_link.direct_from_tiktok),
+            custom_domain=domain.domain if domain else None,
+            canonical_url=canonical_url,
+        )
+
+    def redirect_targets(self, root_url: str, build_url: Callable[[str, str], str] = None) -> RedirectTargets:
+        """Redirect targets for requests under ``root_url`` (built once per trusted host)"""
+        targets = self._targets.get(root_url)
+        if targets is None:
+            targets = RedirectTargets.build(self, build_url)
+            host = urlsplit(root_url).hostname
+            if ((host in APP_HOSTS or (self.custom_domain and host == self.custom_domain.lower()))
+                    and len(self._targets) < MAX_TARGET_HOSTS):
+                self._targets[root_url] = targets
+        return targets
+
+
+# Field order of LinkRecord in link snapshots
+RECORD_FIELDS = [record_field.name for record_field in fields(LinkRecord) if record_field.init]
+
+
+class LinkCache:
+    """Short code -> LinkRecord (or None for unknown/inactive codes)
+
+    With a link snapshot configured, the first lookup of a code in this
+    process is answered from it when possible (briefly cached, so the next
+    lookups go to the database).
+    """
+
+    def __init__(self, maxsize: int = 10000, ttl: float = 60.0, negative_ttl: float = 10.0,
+                 snapshot: SnapshotSource = None, snapshot_skip_size: int = 100000):
+        self.negative_ttl = negative_ttl
+        self.snapshot = snapshot
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl, name='short_links')
+        self.loads = 0
+        self.snapshot_hits = 0
+        # Codes the snapshot may no longer answer for (served once already, or
+        # changed here), and the oldest snapshot still usable after a clear().
+        # Bounded: a code that falls out may be served from the snapshot again,
+        # for entry_ttl seconds like its first time.
+        self._snapshot_skip = TTLCache(maxsize=snapshot_skip_size, ttl=SNAPSHOT_SKIP_TTL,
+                                       name='snapshot_skip')
+        self._snapshot_not_before = 0.0
+        # Async loads in flight, so concurrent misses on one code share a query
+        self._pending_loads: Dict[str, 'asyncio.Future'] = {}
+
+    def resolve(self, short_code: str) -> Optional[LinkRecord]:
+        """Active link for a short code, from memory when possible"""
+        record = self._cached(short_code)
+        if record is not _MISSING:
+            return record
+
+        self.loads += 1
+        return self._store(short_code, SmartLink.query
+                           .options(joinedload(SmartLink.custom_domain))
+                           .filter_by(short_code=short_code, is_active=True)
+                           .first())
+
+    async def resolve_async(self, short_code: str, session_factory) -> Optional[LinkRecord]:
+        """resolve() for the ASGI service, loading misses through an AsyncSession factory"""
+        record = self._cached(short_code)
+        if record is not _MISSING:
+            return record
+
+        load = self._pending_loads.get(short_code)
+        if load is None:
+            load = asyncio.ensure_future(self._load_async(short_code, session_factory))
+            self._pending_loads[short_code] = load
+            load.add_done_callback(lambda _: self._pending_loads.pop(short_code, None))
+        # A client disconnecting mustn't cancel a load other requests are waiting on
+        return await asyncio.shield(load)
+
+    async def _load_async(self, short_code: str, session_factory) -> Optional[LinkRecord]:
+        self.loads += 1
+        async with session_factory() as session:
+            result = await session.execute(
+                select(SmartLink)
+                .options(joinedload(SmartLink.custom_domain))
+                .filter_by(short_code=short_code, is_active=True)
+                .limit(1))
+            return self._store(short_code, result.scalars().first())
+
+    def _cached(self, short_code: str):
+        """The cached record, else a first lookup from the snapshot, else _MISSING"""
+        record = self._cache.get(short_code, _MISSING)
+        if (record is not _MISSING or self.snapshot is None
+                or self._snapshot_skip.get(short_code, False)):
+            return record
+
+        snapshot = self.snapshot.current()
+        if (snapshot is None or snapshot.fields != RECORD_FIELDS
+                or snapshot.generated_at < self._snapshot_not_before):
+            return _MISSING
+        values = snapshot.get(short_code)
+        if values is None:
+            # Possibly created since the snapshot was taken
+            return _MISSING
+
+        # Served once per process: after the short TTL (or an invalidation)
+        # the database decides
+        self._snapshot_skip.set(short_code, True)
+        self.snapshot_hits += 1
+        record = LinkRecord(*values)
+        self._cache.set(short_code, record, ttl=self.snapshot.entry_ttl)
+        return record
+
+    def _store(self, short_code: str, smart_link: Optional[SmartLink]) -> Optional[LinkRecord]:
+        if smart_link is None:
+            self._cache.set(short_code, None, ttl=self.negative_ttl)
+            return None
+        record = LinkRecord.from_model(smart_link)
+        self._cache.set(short_code, record)
+        return record
+
+    def invalidate(self, short_code: str):
+        self._snapshot_skip.set(short_code, True)
+        self._cache.invalidate(short_code)
+
+    def clear(self):
+        self._snapshot_not_before = time.time()
+        self._cache.clear()
+
+    def stats(self) -> Dict:
+        stats = {**self._cache.stats(), 'loads': self.loads, 'negative_ttl': self.negative_ttl}
+        if self.snapshot is not None and self.snapshot.path:
+            stats['snapshot'] = {**self.snapshot.stats(), 'hits': self.snapshot_hits,
+                                 'skipped_codes': len(self._snapshot_skip)}
+        return stats
+
+
+link_cache = LinkCache(
+    maxsize=int(os.environ.get('LINK_CACHE_SIZE', '10000')),
+    ttl=float(os.environ.get('LINK_CACHE_TTL', '60')),
+    negative_ttl=float(os.environ.get('LINK_CACHE_NEGATIVE_TTL', '10')),
+    snapshot=link_snapshot,
+    snapshot_skip_size=int(os.environ.get('LINK_SNAPSHOT_SKIP_SIZE', '100000')),
+)
+
+
+# Invalidation: flushed changes are collected on the session and applied once
+# the transaction commits, so a concurrent request can't re-cache the old row
+# between the flush and the commit.
+
+def _pending(session: Session) -> Set:
+    return session.info.setdefault('link_cache_invalidations', set())
+
+
+def _link_changed(mapper, connection, target: SmartLink):
+    session = Session.object_session(target)
+    if session is None:
+        link_cache.invalidate(target.short_code)
+        return
+    pending = _pending(session)
+    pending.add(target.short_code)
+    # A changed short code leaves the old one cached
+    history = inspect(target).attrs.short_code.history
+    pending.update(code for code in history.deleted or () if code)
+
+
+def _domain_changed(mapper, connection, target: CustomDomain):
+    # Domain changes touch every link on the domain; they are rare, so drop everything
+    session = Session.object_session(target)
+    if session is None:
+        link_cache.clear()
+        return
+    _pending(session).add(_CLEAR_ALL)
+
+
+for _event_name in ('after_insert', 'after_update', 'after_delete'):
+    event.listen(SmartLink, _event_name, _link_changed)
+    event.listen(CustomDomain, _event_name, _domain_changed)
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_invalidations(session: Session):
+    pending = session.info.pop('link_cache_invalidations', None)
+    if not pending:
+        return
+    if _CLEAR_ALL in pending:
+        link_cache.clear()
+        return
+    for short_code in pending:
+        link_cache.invalidate(short_code)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_invalidations(session: Session):
+    session.info.pop('link_cache_invalidations', None)
@@ -0,0 +1,217 @@
+"""
+Snapshot of active links for cold starts
+A compact file of short code -> link record, built at deploy time or by a
+periodic job (build_link_snapshot.py) and memory-mapped by each process. The
+link cache consults it for the first lookup of a code, so a freshly started
+serverless function can redirect without waiting on the database. The
+database stays the source of truth: an entry served from the snapshot is
+only trusted for a few seconds and then loaded normally, and links changed in
+the process stop being served from it. Changes made elsewhere only reach the
+snapshot when it is rebuilt, so a snapshot older than its maximum age (15
+minutes by default) is ignored altogether: keep build_link_snapshot.py
+running on an interval shorter than that.
+
+Layout: header, JSON metadata, then the sorted fixed-width short code keys,
+uint32 record offsets and the records (compact JSON arrays).
+"""
+
+import os
+import sys
+import json
+import mmap
+import time
+import struct
+import logging
+import threading
+from array import array
+from bisect import bisect_left
+from typing import Dict, List, Optional, Sequence
+
+from ip_ranges import _FixedWidthKeys
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_MAGIC = b'STLINKS\0'
+SNAPSHOT_FORMAT = 1
+_HEADER = struct.Struct('<8sII')  # magic, format, metadata length
+
+
+def _aligned(offset: int) -> int:
+    return (offset + 7) & ~7
+
+
+def build_snapshot(records: Dict[str, Sequence], fields: Sequence[str], generated_at: float = None) -> bytes:
+    """Encode {short code: field values} into the snapshot format"""
+    codes = sorted(code.encode('utf-8') for code in records)
+    key_width = max((len(code) for code in codes), default=1)
+    keys = b''.join(code.ljust(key_width, b'\0') for code in codes)
+
+    offsets = array('I', [0])
+    blob = bytearray()
+    for code in codes:
+        blob += json.dumps(list(records[code.decode('utf-8')]), separators=(',', ':')).encode('utf-8')
+        offsets.append(len(blob))
+
+    metadata = {
+        'generated_at': time.time() if generated_at is None else generated_at,
+        'count': len(codes),
+        'fields': list(fields),
+        'key_width': key_width,
+        'byteorder': sys.byteorder,
+    }
+    # Offsets depend on the metadata length, so lay out with a fixed-size guess first
+    data_start = _aligned(_HEADER.size + len(json.dumps(metadata)) + 128)
+    metadata['keys'] = data_start
+    metadata['offsets'] = _aligned(data_start + len(keys))
+    metadata['records'] = metadata['offsets'] + len(offsets) * offsets.itemsize
+    encoded = json.dumps(metadata).encode('utf-8')
+    if _HEADER.size + len(encoded) > data_start:
+        raise ValueError("Snapshot metadata outgrew its reserved space")
+
+    output = bytearray(_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_FORMAT, len(encoded)))
+    output += encoded
+    output += b'\0' * (metadata['keys'] - len(output))
+    output += keys
+    output += b'\0' * (metadata['offsets'] - len(output))
+    output += offsets.tobytes()
+    output += blob
+    return bytes(output)
+
+
+def write_snapshot(records: Dict[str, Sequence], fields: Sequence[str], path: str) -> int:
+    """Build and atomically install a snapshot, returns its size in bytes"""
+    data = build_snapshot(records, fields)
+    temp_path = f"{path}.tmp{os.getpid()}"
+    with open(temp_path, 'wb') as handle:
+        handle.write(data)
+        handle.flush()
+        os.fsync(handle.fileno())
+    os.replace(temp_path, path)
+    return len(data)
+
+
+class LinkSnapshot:
+    """Read-only lookups over a memory-mapped snapshot file"""
+
+    def __init__(self, path: str):
+        with open(path, 'rb') as handle:
+            mapped = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if len(mapped) < _HEADER.size:
+            raise ValueError(f"{path}: truncated link snapshot")
+        magic, snapshot_format, metadata_length = _HEADER.unpack_from(mapped, 0)
+        if magic != SNAPSHOT_MAGIC or snapshot_format != SNAPSHOT_FORMAT:
+            raise ValueError(f"{path}: not a format {SNAPSHOT_FORMAT} link snapshot")
+        metadata = json.loads(mapped[_HEADER.size:_HEADER.size + metadata_length].decode('utf-8'))
+        if metadata['byteorder'] != sys.byteorder:
+            raise ValueError(f"{path}: snapshot was built with {metadata['byteorder']}-endian offsets")
+
+        self.path = path
+        self.generated_at: float = metadata['generated_at']
+        self.fields: List[str] = metadata['fields']
+        self.count: int = metadata['count']
+        self._key_width: int = metadata['key_width']
+        if metadata['records'] > len(mapped):
+            raise ValueError(f"{path}: truncated link snapshot")
+
+        view = memoryview(mapped)
+        self._keys = _FixedWidthKeys(
+            view[metadata['keys']:metadata['keys'] + self.count * self._key_width], self._key_width)
+        self._offsets = view[metadata['offsets']:metadata['records']].cast('I')
+        self._records_start = metadata['records']
+        self._mapped = mapped
+
+    @property
+    def age(self) -> float:
+        return time.time() - self.generated_at
+
+    def get(self, short_code: str) -> Optional[list]:
+        """Field values stored for a short code, or None"""
+        code = short_code.encode('utf-8')
+        if len(code) > self._key_width:
+            return None
+        key = code.ljust(self._key_width, b'\0')
+        position = bisect_left(self._keys, key)
+        if position >= self.count or self._keys[position] != key:
+            return None
+        start = self._records_start + self._offsets[position]
+        end = self._records_start + self._offsets[position + 1]
+        return json.loads(self._mapped[start:end])
+
+    def __len__(self) -> int:
+        return self.count
+
+
+class SnapshotSource:
+    """The snapshot file currently in force, if any
+
+    The file is re-checked at most every ``check_interval`` seconds, so a
+    refreshed snapshot is picked up without a restart. A snapshot older than
+    ``max_age`` seconds is not used (0 disables the limit, which serves
+    deactivated or deleted links from a stale snapshot until the next build).
+    """
+
+    def __init__(self, path: str = None, max_age: float = 900.0, entry_ttl: float = 10.0,
+                 check_interval: float = 30.0):
+        self.path = path
+        self.max_age = max_age
+        self.entry_ttl = entry_ttl
+        self.check_interval = check_interval
+        self.loads = 0
+        self.failed_loads = 0
+        self._snapshot: Optional[LinkSnapshot] = None
+        self._stamp = None
+        self._next_check = 0.0
+        self._lock = threading.Lock()
+
+    def current(self) -> Optional[LinkSnapshot]:
+        """The loaded snapshot while it is fresh enough to use"""
+        if not self.path:
+            return None
+        now = time.monotonic()
+        if now >= self._next_check:
+            self._next_check = now + self.check_interval
+            self._reload()
+        snapshot = self._snapshot
+        if snapshot is None or (self.max_age and snapshot.age > self.max_age):
+            return None
+        return snapshot
+
+    def _reload(self):
+        with self._lock:
+            try:
+                stat = os.stat(self.path)
+            except OSError:
+                self._snapshot, self._stamp = None, None
+                return
+            stamp = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+            if stamp == self._stamp:
+                return
+            try:
+                self._snapshot = LinkSnapshot(self.path)
+                self.loads += 1
+            except (OSError, ValueError, KeyError) as e:
+                self.failed_loads += 1
+                self._snapshot = None
+                logger.error(f"Ignoring link snapshot {self.path}: {e}")
+            self._stamp = stamp
+
+    def stats(self) -> Dict:
+        snapshot = self._snapshot
+        return {
+            'path': self.path,
+            'links': len(snapshot) if snapshot else 0,
+            'age': round(snapshot.age, 1) if snapshot else None,
+            'max_age': self.max_age,
+            'entry_ttl': self.entry_ttl,
+            'loads': self.loads,
+            'failed_loads': self.failed_loads,
+        }
+
+
+link_snapshot = SnapshotSource(
+    path=os.environ.get('LINK_SNAPSHOT_FILE') or None,
+    max_age=float(os.environ.get('LINK_SNAPSHOT_MAX_AGE', '900')),
+    entry_ttl=float(os.environ.get('LINK_SNAPSHOT_ENTRY_TTL', '10')),
+    check_interval=float(os.environ.get('LINK_SNAPSHOT_CHECK_INTERVAL', '30')),
+)
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""
+Click log loader
+Bulk-loads sealed click log segments (see click_log.py) into the Click table.
+Each segment is inserted in one transaction together with its click counter
+updates and a ClickLogSegment ledger row, and the file is deleted only after that commits; a segment that
+was committed but not yet deleted is recognised by the ledger and never
+loaded twice. Segments left open by a worker that died are sealed first. A
+segment whose contents can't be loaded is renamed to .bad and the others
+still load. Loaders take a lock on the directory, so a second loader started
+on the same host skips the round instead of racing the first.
+
+Usage:
+    python load_click_log.py                      # load what is sealed now
+    python load_click_log.py --interval 5         # keep loading every 5 seconds
+    python load_click_log.py --dir /var/spool/smartticker/clicks --batch-size 2000
+"""
+import os
+import sys
+import time
+import fcntl
+import socket
+import argparse
+from contextlib import contextmanager
+from datetime import datetime
+
+from sqlalchemy import select
+from sqlalchemy.exc import DataError, DBAPIError, IntegrityError, StatementError
+
+from app import app, db
+from models import Click, ClickLogSegment
+from click_log import OPEN_SUFFIX, QUARANTINE_SUFFIX, SEALED_SUFFIX, list_segments, read_segment, segment_pid
+from click_counters import apply_deltas, click_deltas
+
+CLICK_COLUMNS = [column.name for column in Click.__table__.columns if column.name != 'id']
+LEDGER = ClickLogSegment.__table__
+LOCK_FILE = '.loader.lock'
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def recover_orphans(directory, min_age):
+    """Seal open segments whose writer process is gone, returns how many"""
+    recovered = 0
+    for path in list_segments(directory, OPEN_SUFFIX):
+        pid = segment_pid(path)
+        if pid is None or _pid_alive(pid) or time.time() - os.path.getmtime(path) < min_age:
+            continue
+        os.replace(path, path[:-len(OPEN_SUFFIX)] + SEALED_SUFFIX)
+        recovered += 1
+    return recovered
+
+
+def _click_row(record):
+    row = {column: record.get(column) for column in CLICK_COLUMNS}
+    if isinstance(row['created_at'], str):
+        row['created_at'] = datetime.fromisoformat(row['created_at'])
+    return row
+
+
+@contextmanager
+def loader_lock(directory):
+    """Exclusive lock on a click log directory, yields whether it was acquired"""
+    fd = os.open(os.path.join(directory, LOCK_FILE), os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        yield True
+    finally:
+        os.close(fd)
+
+
+def _ledgered(name):
+    with db.engine.connect() as conn:
+        return conn.execute(select(LEDGER.c.name).where(LEDGER.c.name == name)).first() is not None
+
+
+def load_segment(path, batch_size, ledger_prefix):
+    """Insert one segment and delete it, returns the number of clicks loaded"""
+    name = f"{ledger_prefix}/{os.path.basename(path)}"
+    try:
+        records, clean = read_segment(path)
+    except FileNotFoundError:
+        return 0  # loaded and deleted by another loader meanwhile
+    if not clean:
+        print(f"⚠️  {os.path.basename(path)} ends with a torn record, loading the {len(records)} intact ones")
+
+    try:
+        with db.engine.begin() as conn:
+            if conn.execute(select(LEDGER.c.name).where(LEDGER.c.name == name)).first():
+                loaded = 0
+            else:
+                rows = [_click_row(record) for record in records]
+                # The ledger row goes first: a loader committing the same segment
+                # meanwhile makes it conflict before any click is inserted
+                conn.execute(LEDGER.insert().values(name=name, clicks=len(rows), loaded_at=datetime.utcnow()))
+                for start in range(0, len(rows), batch_size):
+                    conn.execute(Click.__table__.insert().values(rows[start:start + batch_size]))
+                apply_deltas(conn, click_deltas(rows))
+                loaded = len(rows)
+    except IntegrityError:
+        if not _ledgered(name):
+            raise
+        loaded = 0  # committed by another loader
+
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    return loaded
+
+
+def is_poison(error):
+    """Whether an error comes from a segment's contents rather than the database being unavailable
+
+    Such a segment fails the same way on every retry. A ledger conflict
+    never gets here, load_segment treats it as already loaded.
+    """
+    if isinstance(error, (DataError, IntegrityError)):
+        return True
+    if isinstance(error, DBAPIError):
+        return False
+    # Bad values rejected while binding parameters, or records that don't parse
+    return isinstance(error, (StatementError, ValueError, TypeError, KeyError))
+
+
+def quarantine(path, error):
+    """Set a segment that can't be loaded aside, so the ones after it still are"""
+    quarantined = path[:-len(SEALED_SUFFIX)] + QUARANTINE_SUFFIX
+    try:
+        os.replace(path, quarantined)
+    except FileNotFoundError:
+        return
+    print(f"☣️  Could not load {os.path.basename(path)}, moved it to {os.path.basename(quarantined)}: "
+          f"{error.__class__.__name__}: {error}")
+
+
+def load_all(args, ledger_prefix):
+    with loader_lock(args.dir) as locked:
+        if not locked:
+            print(f"⏳ Another loader is working on {args.dir}, skipping this round")
+            return 0, 0
+
+        recovered = recover_orphans(args.dir, args.orphan_age)
+        if recovered:
+            print(f"🩹 Sealed {recovered} segments left open by exited workers")
+
+        segments = clicks = 0
+        for path in list_segments(args.dir):
+            try:
+                clicks += load_segment(path, args.batch_size, ledger_prefix)
+            except Exception as e:
+                if not is_poison(e):
+                    raise
+                quarantine(path, e)
+                continue
+            segments += 1
+        return segments, clicks
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load sealed click log segments into the database")
+    parser.add_argument('--dir', default=os.environ.get('CLICK_LOG_DIR'),
+                        help="click log directory (default: CLICK_LOG_DIR)")
+    parser.add_argument('--batch-size', type=int, default=1000, help="rows per INSERT (default 1000)")
+    parser.add_argument('--interval', type=float, default=0,
+                        help="keep running, loading every N seconds (default: load once and exit)")
+    parser.add_argument('--orphan-age', type=float, default=300,
+                        help="seal open segments of dead workers idle this many seconds (default 300)")
+    args = parser.parse_args()
+
+    if not args.dir:
+        parser.error("--dir or CLICK_LOG_DIR is required")
+    if not os.path.isdir(args.dir):
+        print(f"📭 {args.dir} does not exist yet, nothing to load")
+        return 0
+
+    # Segment names are only unique per host
+    ledger_prefix = socket.gethostname()
+
+    with app.app_context():
+        while True:
+            started = time.monotonic()
+            try:
+                segments, clicks = load_all(args, ledger_prefix)
+            except Exception as e:
+                if not args.interval:
+                    raise
+                print(f"❌ Load failed, retrying in {args.interval}s: {e}")
+                segments = clicks = 0
+            if segments or not args.interval:
+                print(f"✅ Loaded {clicks} clicks from {segments} segments "
+                      f"in {time.monotonic() - started:.2f}s")
+            if not args.interval:
+                return 0
+            try:
+                time.sleep(args.interval)
+            except KeyboardInterrupt:
+                return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -59,10 +59,9 @@ class SmartLink(db.Model):
     
     @staticmethod
     def generate_short_code():
-        while True:
-            code = ''.join(secrets.choice(string.ascii_letters + string.digits) for _ in range(6))
-            if not SmartLink.query.filter_by(short_code=code).first():
-                return code
+        # Unique by construction, no lookup needed (see short_codes.py)
+        from short_codes import short_code_allocator
+        return short_code_allocator.allocate()
     
     def get_full_url(self, request_host=None):
         """Get the full URL for this smart link"""
@@ -92,7 +91,49 @@ class Click(db.Model):
     # Advanced detection analytics
     confidence_score = db.Column(db.Float)  # Bot detection confidence (0.0-1.0)
     risk_level = db.Column(db.String(10))   # 'low', 'medium', 'high', 'critical'
-    detection_methods = db.Column(db.Text)  # JSON array of detection methods used
+    detection_methods = db.Column(db.Text)  # JSON {method: confidence}, null if skipped (older rows: JSON array of names)
+
+class ClickCounter(db.Model):
+    """Click totals per link, kept up to date as clicks are written (see click_counters.py)"""
+    smart_link_id = db.Column(db.Integer, db.ForeignKey('smart_link.id'), primary_key=True)
+    dimension = db.Column(db.String(20), primary_key=True)  # 'total', 'click_type', 'platform', 'target_reached'
+    value = db.Column(db.String(20), primary_key=True)      # '' for the total and for clicks without one
+    clicks = db.Column(db.BigInteger, nullable=False, default=0)
+
+class ClickRollup(db.Model):
+    """Clicks per link per hour and per day, added up by rollup_clicks.py (see click_rollups.py)"""
+    smart_link_id = db.Column(db.Integer, db.ForeignKey('smart_link.id'), primary_key=True)
+    period = db.Column(db.String(4), primary_key=True)       # 'hour' or 'day'
+    bucket = db.Column(db.DateTime, primary_key=True)        # start of the hour or day (UTC)
+    dimension = db.Column(db.String(20), primary_key=True)   # 'total', 'click_type', 'platform', 'risk_level', 'country'
+    value = db.Column(db.String(20), primary_key=True)       # '' for the total and for clicks without one
+    clicks = db.Column(db.BigInteger, nullable=False, default=0)
+
+class ClickRollupState(db.Model):
+    """How far the click rollups have got (see click_rollups.py)"""
+    name = db.Column(db.String(32), primary_key=True)
+    last_click_id = db.Column(db.BigInteger, nullable=False, default=0)
+    holes = db.Column(db.Text, nullable=False, default='{}')  # JSON {click id: unix time first missed} below last_click_id
+    generation = db.Column(db.BigInteger, nullable=False, default=0)  # bumped on every change
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class ClickLogSegment(db.Model):
+    """Click log segments already loaded, so a segment is never loaded twice"""
+    name = db.Column(db.String(255), primary_key=True)  # host/segment file name
+    clicks = db.Column(db.Integer, nullable=False)
+    loaded_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class ShortCodeSequence(db.Model):
+    """Counter that short codes are allocated from, in blocks (see short_codes.py)"""
+    name = db.Column(db.String(32), primary_key=True)
+    next_value = db.Column(db.BigInteger, nullable=False)
+    key = db.Column(db.String(64), nullable=False)  # permutation key, fixed once created
+
+class SchemaStamp(db.Model):
+    """Fingerprint of the models the schema was last created for (see schema_stamp.py)"""
+    id = db.Column(db.Integer, primary_key=True)
+    fingerprint = db.Column(db.String(64), nullable=False)
+    stamped_at = db.Column(db.DateTime, default=datetime.utcnow)
 
 class CustomDomain(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -0,0 +1,131 @@
+"""
+Rendered safe-page and challenge-page cache
+The safe and challenge pages are what crawlers hit hardest, and they depend on
+nothing but the link, so each one is rendered once per template and link
+version and served from stored bytes (gzipped too when worth it). Responses
+carry a strong ETag, Last-Modified and Cache-Control so clients and CDNs can
+revalidate with 304s. A link change produces a new LinkRecord from the link
+cache, which no longer matches the stored page and triggers a re-render.
+"""
+
+import os
+import gzip
+import time
+import hashlib
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+from flask import Response, render_template, request
+from werkzeug.http import http_date, parse_date, parse_etags
+
+from link_cache import LinkRecord
+from ttl_cache import TTLCache
+
+HTML_CONTENT_TYPE = 'text/html; charset=utf-8'
+
+
+@dataclass(frozen=True)
+class RenderedPage:
+    """One rendered page and the response headers of each representation"""
+    record: LinkRecord        # the link version it was rendered from
+    body: bytes
+    gzipped: Optional[bytes]  # None when the page is too small to be worth compressing
+    etag: str
+    gzip_etag: str
+    last_modified: float
+    headers: Tuple[Tuple[str, str], ...]
+    gzip_headers: Tuple[Tuple[str, str], ...]
+
+
+class PageCache:
+    """(template, short code) -> RenderedPage, re-rendered when the link changes"""
+
+    def __init__(self, maxsize: int = 2000, ttl: float = 3600.0, max_age: int = 60,
+                 gzip_min_bytes: int = 1024):
+        self.max_age = max_age
+        self.gzip_min_bytes = gzip_min_bytes
+        self.cache_control = f"public, max-age={max_age}" if max_age > 0 else 'no-cache'
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl, name='rendered_pages')
+        self.renders = 0
+        self.not_modified = 0
+
+    def cached(self, template: str, smart_link: LinkRecord) -> Optional[RenderedPage]:
+        """The rendered page if it is cached and current, without rendering"""
+        page = self._cache.get((template, smart_link.short_code))
+        if page is not None and page.record == smart_link:
+            return page
+        return None
+
+    def page(self, template: str, smart_link: LinkRecord) -> RenderedPage:
+        """Needs a request context when the page has to be rendered (templates use url_for)"""
+        key = (template, smart_link.short_code)
+        page = self.cached(template, smart_link)
+        if page is not None:
+            return page
+
+        self.renders += 1
+        body = render_template(template, smart_link=smart_link).encode('utf-8')
+        gzipped = gzip.compress(body, mtime=0) if len(body) >= self.gzip_min_bytes else None
+        last_modified = float(int(time.time()))
+        etag = hashlib.blake2b(body, digest_size=12).hexdigest()
+        # Each representation needs its own strong validator
+        gzip_etag = f"{etag}-gz"
+
+        common = [('Last-Modified', http_date(last_modified)), ('Cache-Control', self.cache_control)]
+        if gzipped is not None:
+            common.append(('Vary', 'Accept-Encoding'))
+        page = RenderedPage(
+            record=smart_link,
+            body=body,
+            gzipped=gzipped,
+            etag=etag,
+            gzip_etag=gzip_etag,
+            last_modified=last_modified,
+            headers=(('ETag', f'"{etag}"'), *common),
+            gzip_headers=(('ETag', f'"{gzip_etag}"'), ('Content-Encoding', 'gzip'), *common),
+        )
+        self._cache.set(key, page)
+        return page
+
+    def response(self, template: str, smart_link: LinkRecord) -> Response:
+        """The page for the current request: full, gzipped or 304"""
+        headers = request.headers
+        status, body, response_headers = self.select(
+            self.page(template, smart_link), headers.get('Accept-Encoding', ''),
+            headers.get('If-None-Match'), headers.get('If-Modified-Since'))
+        if status == 304:
+            return Response(status=304, headers=response_headers)
+        return Response(body, content_type=HTML_CONTENT_TYPE, headers=response_headers)
+
+    def select(self, page: RenderedPage, accept_encoding: str, if_none_match: Optional[str],
+               if_modified_since: Optional[str]) -> Tuple[int, bytes, Tuple[Tuple[str, str], ...]]:
+        """(status, body, headers) answering the given request headers"""
+        use_gzip = page.gzipped is not None and 'gzip' in accept_encoding
+        headers = page.gzip_headers if use_gzip else page.headers
+
+        if if_none_match:
+            not_modified = parse_etags(if_none_match).contains_weak(page.gzip_etag if use_gzip else page.etag)
+        else:
+            since = parse_date(if_modified_since) if if_modified_since else None
+            not_modified = since is not None and since.timestamp() >= page.last_modified
+
+        if not_modified:
+            self.not_modified += 1
+            # A 304 repeats the validators but not the body's encoding
+            return 304, b'', tuple(h for h in headers if h[0] != 'Content-Encoding')
+        return 200, page.gzipped if use_gzip else page.body, headers
+
+    def clear(self):
+        self._cache.clear()
+
+    def stats(self) -> Dict:
+        return {**self._cache.stats(), 'renders': self.renders, 'not_modified': self.not_modified,
+                'max_age': self.max_age}
+
+
+page_cache = PageCache(
+    maxsize=int(os.environ.get('PAGE_CACHE_SIZE', '2000')),
+    ttl=float(os.environ.get('PAGE_CACHE_TTL', '3600')),
+    max_age=int(os.environ.get('PAGE_CACHE_MAX_AGE', '60')),
+    gzip_min_bytes=int(os.environ.get('PAGE_CACHE_GZIP_MIN_BYTES', '1024')),
+)
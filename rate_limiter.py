@@ -0,0 +1,219 @@
+"""
+Per-client rate limiting for the redirect and challenge endpoints
+Token buckets keyed by rule, truncated IP and short code. By default the
+buckets live in a memory-mapped file (in /dev/shm when available) shared by
+every gunicorn worker on the host, so the limit holds no matter which worker a
+request lands on. Checks run before any database work, so a limited client
+costs a hash and a locked slot update.
+
+RATE_LIMIT_BACKEND selects where buckets live: ``shared`` (default), ``local``
+(per process, used on Vercel), ``off``, or ``package.module:Class`` for a
+multi-host store (e.g. Redis) implementing ``consume(key, rate, burst, now)``.
+"""
+
+import os
+import mmap
+import time
+import fcntl
+import struct
+import hashlib
+import logging
+import tempfile
+import importlib
+import threading
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# tag, tokens left, last update (wall clock, shared by all workers on a host)
+SLOT = struct.Struct('<Qdd')
+# Bumped whenever SLOT changes; part of the shared file name with the slot count
+LAYOUT_VERSION = 1
+
+
+@dataclass(frozen=True)
+class RateLimitRule:
+    """Token bucket parameters for one endpoint"""
+    name: str
+    rate: float    # tokens added per second
+    burst: float   # bucket size
+    action: str = '429'  # for limited clients: '429', or 'safe' to send them to the safe page
+
+
+def bucket_key(rule: str, client: str, short_code: str) -> int:
+    """Stable 64-bit key (the same in every worker, unlike hash())"""
+    digest = hashlib.blake2b(f"{rule}|{client}|{short_code}".encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little') or 1
+
+
+def _refill(tokens: float, updated: float, rate: float, burst: float, now: float) -> float:
+    return min(burst, tokens + max(0.0, now - updated) * rate)
+
+
+class LocalBucketTable:
+    """Direct-mapped bucket table in process memory
+
+    A key hashes to one slot and a different key landing on the same slot
+    takes it over with a full bucket, so memory is fixed at ``slots`` buckets.
+    """
+
+    name = 'local'
+
+    def __init__(self, slots: int = 65536):
+        self.slots = max(1, slots)
+        self._tags = [0] * self.slots
+        self._tokens = [0.0] * self.slots
+        self._updated = [0.0] * self.slots
+        self._lock = threading.Lock()
+
+    def consume(self, key: int, rate: float, burst: float, now: float) -> bool:
+        slot = key % self.slots
+        with self._lock:
+            if self._tags[slot] != key:
+                self._tags[slot] = key
+                tokens = burst
+            else:
+                tokens = _refill(self._tokens[slot], self._updated[slot], rate, burst, now)
+            allowed = tokens >= 1.0
+            self._tokens[slot] = tokens - 1.0 if allowed else tokens
+            self._updated[slot] = now
+        return allowed
+
+
+class SharedBucketTable:
+    """Direct-mapped bucket table in a memory-mapped file shared across processes
+
+    Each slot is guarded by an fcntl byte-range lock on its own bytes (plus a
+    thread lock, since fcntl locks don't exclude threads of one process).
+    The file name carries the layout version and slot count, so workers
+    started with another configuration use their own file and never resize
+    one that others have mapped.
+    """
+
+    name = 'shared'
+
+    def __init__(self, path: str, slots: int = 65536):
+        self.slots = max(1, slots)
+        self.path = f"{path}-v{LAYOUT_VERSION}-{self.slots}"
+        size = self.slots * SLOT.size
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.lockf(self._fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(self._fd).st_size < size:
+                os.ftruncate(self._fd, size)  # a new file; extending never moves mapped bytes
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN)
+        self._map = mmap.mmap(self._fd, size)
+        self._lock = threading.Lock()
+
+    def consume(self, key: int, rate: float, burst: float, now: float) -> bool:
+        offset = (key % self.slots) * SLOT.size
+        with self._lock:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, SLOT.size, offset)
+            try:
+                tag, tokens, updated = SLOT.unpack_from(self._map, offset)
+                if tag != key:
+                    tokens = burst
+                else:
+                    tokens = _refill(tokens, updated, rate, burst, now)
+                allowed = tokens >= 1.0
+                SLOT.pack_into(self._map, offset, key, tokens - 1.0 if allowed else tokens, now)
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, SLOT.size, offset)
+        return allowed
+
+
+def default_table_path() -> str:
+    directory = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+    return os.path.join(directory, f"smartticker-ratelimit-{os.getuid()}")
+
+
+def create_backend(spec: str, slots: int, path: Optional[str] = None):
+    """Bucket table for a RATE_LIMIT_BACKEND value (None when rate limiting is off)"""
+    spec = (spec or 'shared').strip()
+    if spec.lower() in ('off', '0', 'false', 'no'):
+        return None
+    if spec == 'local':
+        return LocalBucketTable(slots)
+    if spec == 'shared':
+        try:
+            return SharedBucketTable(path or default_table_path(), slots)
+        except OSError as e:
+            logger.warning(f"Shared rate limit table unavailable ({e}), limiting per worker")
+            return LocalBucketTable(slots)
+    module_name, _, class_name = spec.partition(':')
+    backend_class = getattr(importlib.import_module(module_name), class_name)
+    return backend_class()
+
+
+class RateLimiter:
+    """Named token-bucket rules on top of a bucket table"""
+
+    def __init__(self, backend, rules: Dict[str, RateLimitRule]):
+        self.backend = backend
+        self.rules = rules
+        self.allowed = 0
+        self.limited = 0
+        self.errors = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.backend is not None
+
+    def allow(self, rule_name: str, client: str, short_code: str, now: float = None) -> bool:
+        """Take a token for this client and link, False when the bucket is empty
+
+        Fails open: a backend error never blocks traffic.
+        """
+        if self.backend is None:
+            return True
+        rule = self.rules[rule_name]
+        try:
+            allowed = self.backend.consume(bucket_key(rule.name, client or '-', short_code),
+                                           rule.rate, rule.burst, time.time() if now is None else now)
+        except Exception as e:
+            self.errors += 1
+            if self.errors & (self.errors - 1) == 0:
+                logger.error(f"Rate limit backend failed ({self.errors} errors so far): {e}")
+            return True
+        if allowed:
+            self.allowed += 1
+        else:
+            self.limited += 1
+        return allowed
+
+    def retry_after(self, rule_name: str) -> int:
+        """Seconds until a limited client has a token again"""
+        return max(1, int(1.0 / self.rules[rule_name].rate + 0.999))
+
+    def stats(self) -> Dict:
+        return {
+            'enabled': self.enabled,
+            'backend': getattr(self.backend, 'name', type(self.backend).__name__) if self.backend else None,
+            'rules': {name: {'rate': rule.rate, 'burst': rule.burst, 'action': rule.action}
+                      for name, rule in self.rules.items()},
+            'allowed': self.allowed,
+            'limited': self.limited,
+            'errors': self.errors,
+        }
+
+
+rate_limiter = RateLimiter(
+    backend=create_backend(
+        os.environ.get('RATE_LIMIT_BACKEND') or ('local' if os.environ.get('VERCEL_ENV') else 'shared'),
+        slots=int(os.environ.get('RATE_LIMIT_SLOTS', '65536')),
+        path=os.environ.get('RATE_LIMIT_FILE') or None,
+    ),
+    rules={
+        # Platform review crawlers share IPs, so limited redirects get the safe page rather than a bare 429
+        'redirect': RateLimitRule('redirect',
+                                  rate=float(os.environ.get('RATE_LIMIT_REDIRECT_RATE', '10')),
+                                  burst=float(os.environ.get('RATE_LIMIT_REDIRECT_BURST', '40')),
+                                  action=os.environ.get('RATE_LIMIT_REDIRECT_ACTION', 'safe')),
+        'verify': RateLimitRule('verify',
+                                rate=float(os.environ.get('RATE_LIMIT_VERIFY_RATE', '1')),
+                                burst=float(os.environ.get('RATE_LIMIT_VERIFY_BURST', '10')),
+                                action=os.environ.get('RATE_LIMIT_VERIFY_ACTION', '429')),
+    },
+)
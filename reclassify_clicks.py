@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+"""
+Historical click reclassification job
+Streams the Click table in keyset-paginated chunks, reruns bot detection over
+a process pool and writes changed verdicts back with bulk updates. Every chunk
+is its own short transaction and progress is checkpointed, so the job can be
+stopped, throttled and resumed on tables with tens of millions of rows.
+The analytics rollups aren't updated: rebuild them afterwards with
+``rollup_clicks.py --rebuild`` over the days the changed clicks are in.
+
+Usage:
+    python reclassify_clicks.py
+    python reclassify_clicks.py --resume --max-rate 2000
+    python reclassify_clicks.py --dry-run --end-id 100000
+"""
+import os
+import sys
+import json
+import time
+import argparse
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import replace
+
+from sqlalchemy import bindparam, text
+
+from app import app, db
+from models import Click
+from utils import is_bot_user_agent, is_tiktok_bot, has_suspicious_user_agent
+from batch_detection import analyze_batch
+from detection_engine import detection_engine, parse_stored_methods
+from click_counters import apply_deltas
+
+DEFAULT_CHECKPOINT = 'reclassify_checkpoint.json'
+
+# Request headers were never stored, so header fingerprinting can't be rerun
+SKIPPED_METHODS = ('header_fingerprint', 'header_order')
+
+SELECT_CHUNK = text(
+    "SELECT click.id, click.smart_link_id, click.user_agent, click.ip_address, click.referrer, click.click_type, "
+    "click.platform, click.confidence_score, click.risk_level, click.detection_methods, "
+    "smart_link.use_js_challenge "
+    "FROM click JOIN smart_link ON smart_link.id = click.smart_link_id "
+    "WHERE click.id > :last_id AND click.id <= :end_id "
+    "ORDER BY click.id LIMIT :limit"
+)
+
+UPDATE_CLICK = Click.__table__.update().where(Click.__table__.c.id == bindparam('click_id')).values(
+    click_type=bindparam('new_click_type'),
+    platform=bindparam('new_platform'),
+    confidence_score=bindparam('new_confidence_score'),
+    risk_level=bindparam('new_risk_level'),
+    detection_methods=bindparam('new_detection_methods'),
+)
+
+VERDICT_FIELDS = ('click_type', 'platform', 'confidence_score', 'risk_level')
+
+
+def method_names(value):
+    """(methods that fired, skipped methods) of a stored detection_methods value"""
+    fired, skipped = parse_stored_methods(value)
+    return list(fired), skipped
+
+
+def carry_forward(detection, row):
+    """Add the stored scores of the methods that can't be rerun to a rerun's result
+
+    Only those methods' own scores are carried, and the verdict is recombined
+    from them and the rerun methods as the engine would, so a click is only
+    kept a bot on their account if their scores still make it one. Rows from
+    before scores were stored credit each method with the stored confidence,
+    capped at the most that method can score. Methods skipped at request
+    time are unknown, not misses, and stay listed as skipped.
+    """
+    fired, skipped = parse_stored_methods(row['detection_methods'])
+    carried = {method: score for method, score in fired.items() if method in SKIPPED_METHODS}
+    unknown = [method for method in skipped if method in SKIPPED_METHODS]
+    if not carried and not unknown:
+        return detection
+
+    for method, score in carried.items():
+        if score is None:
+            carried[method] = min(row['confidence_score'] or 0.0,
+                                  detection_engine.method_profiles[method].max_confidence)
+    scores = {**detection.method_scores, **carried}
+    methods = [method for method in detection_engine.detection_methods if method in scores]
+    confidence_score, is_bot, risk_level = detection_engine.score_verdict([scores[method] for method in methods])
+    return replace(detection, is_bot=is_bot, confidence_score=confidence_score, risk_level=risk_level,
+                   detection_methods=methods, method_scores=scores, skipped_methods=unknown)
+
+
+def classify_chunk(rows):
+    """Rerun detection for one chunk, returns only the rows whose verdict changed
+
+    Mirrors the click_type decision in routes.smart_redirect. Without headers
+    a previous 'suspect' verdict can't be re-derived, so it is kept unless the
+    click is now a bot. The header methods' stored scores are carried
+    forward (see carry_forward). Rows are compared by verdict and method
+    names, so older rows aren't rewritten only for their scores.
+    """
+    if not rows:
+        return []
+
+    user_agents = [row['user_agent'] or '' for row in rows]
+    ip_addresses = [row['ip_address'] or '' for row in rows]
+    results = analyze_batch(user_agents, ip_addresses, [row['referrer'] or '' for row in rows],
+                            skip_methods=SKIPPED_METHODS)
+
+    legacy = {}
+    changes = []
+    for index, row in enumerate(rows):
+        user_agent = user_agents[index]
+        key = (user_agent, ip_addresses[index])
+        if key not in legacy:
+            legacy[key] = (is_bot_user_agent(user_agent),
+                           is_tiktok_bot(user_agent, ip_addresses[index]),
+                           has_suspicious_user_agent(user_agent))
+        legacy_bot, legacy_tiktok, suspicious_ua = legacy[key]
+
+        detection = carry_forward(results.row(index), row)
+        if (detection.is_bot or legacy_bot or detection.is_sophisticated_tiktok or legacy_tiktok):
+            click_type = 'bot'
+        elif row['use_js_challenge'] and (suspicious_ua or row['click_type'] == 'suspect'):
+            click_type = 'suspect'
+        else:
+            click_type = 'human'
+
+        verdict = {
+            'click_type': click_type,
+            'platform': detection.platform,
+            'confidence_score': detection.confidence_score,
+            'risk_level': detection.risk_level,
+            'detection_methods': detection.stored_methods(),
+        }
+        if (any(row[field] != verdict[field] for field in VERDICT_FIELDS)
+                or method_names(row['detection_methods']) != method_names(verdict['detection_methods'])):
+            changes.append({'id': row['id'], 'smart_link_id': row['smart_link_id'],
+                            'old_click_type': row['click_type'], 'old_platform': row['platform'], **verdict})
+
+    return changes
+
+
+def load_checkpoint(path):
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as handle:
+        return json.load(handle)
+
+
+def save_checkpoint(path, state):
+    """Write the checkpoint atomically so a crash never leaves a torn file"""
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as handle:
+        json.dump(state, handle, indent=2)
+    os.replace(temp_path, path)
+
+
+def fetch_chunk(last_id, end_id, chunk_size):
+    with db.engine.connect() as conn:
+        return [dict(row._mapping) for row in
+                conn.execute(SELECT_CHUNK, {'last_id': last_id, 'end_id': end_id, 'limit': chunk_size})]
+
+
+def counter_moves(changes):
+    """Click counter adjustments for changed verdicts (see click_counters.py)"""
+    deltas = Counter()
+    for change in changes:
+        for dimension in ('click_type', 'platform'):
+            old, new = change[f'old_{dimension}'] or '', change[dimension] or ''
+            if old != new:
+                deltas[(change['smart_link_id'], dimension, old)] -= 1
+                deltas[(change['smart_link_id'], dimension, new)] += 1
+    return deltas
+
+
+def write_changes(changes):
+    """Apply one chunk's changes in a single short transaction"""
+    if not changes:
+        return
+    params = [{
+        'click_id': change['id'],
+        'new_click_type': change['click_type'],
+        'new_platform': change['platform'],
+        'new_confidence_score': change['confidence_score'],
+        'new_risk_level': change['risk_level'],
+        'new_detection_methods': change['detection_methods'],
+    } for change in changes]
+    with db.engine.begin() as conn:
+        conn.execute(UPDATE_CLICK, params)
+        apply_deltas(conn, counter_moves(changes))
+
+
+def reclassify(args):
+    state = load_checkpoint(args.checkpoint) if args.resume else None
+    if state:
+        print(f"▶️  Resuming after click id {state['last_id']} "
+              f"({state['processed']} processed, {state['updated']} updated)")
+    else:
+        state = {'last_id': args.start_id, 'processed': 0, 'updated': 0, 'transitions': {}}
+
+    with app.app_context():
+        end_id = args.end_id
+        if end_id is None:
+            with db.engine.connect() as conn:
+                end_id = conn.execute(text("SELECT MAX(id) FROM click")).scalar() or 0
+        print(f"🔍 Reclassifying clicks {state['last_id'] + 1}..{end_id} "
+              f"in chunks of {args.chunk_size} with {args.workers or 'no'} worker processes")
+
+        executor = ProcessPoolExecutor(max_workers=args.workers) if args.workers else None
+        # Bounded number of chunks in flight keeps memory constant
+        in_flight = deque()
+        max_in_flight = max(1, args.workers * 2)
+        next_id = state['last_id']
+        started = time.monotonic()
+        processed_this_run = 0
+
+        def finish_oldest():
+            nonlocal processed_this_run
+            chunk_last_id, row_count, pending = in_flight.popleft()
+            changes = pending.result() if executor else pending
+            if not args.dry_run:
+                write_changes(changes)
+            for change in changes:
+                transition = f"{change['old_click_type']}->{change['click_type']}"
+                state['transitions'][transition] = state['transitions'].get(transition, 0) + 1
+            state['last_id'] = chunk_last_id
+            state['processed'] += row_count
+            state['updated'] += len(changes)
+            processed_this_run += row_count
+            if not args.dry_run:
+                save_checkpoint(args.checkpoint, state)
+
+            elapsed = time.monotonic() - started
+            rate = processed_this_run / elapsed if elapsed else 0.0
+            print(f"   id <= {chunk_last_id}: {state['processed']} processed, "
+                  f"{state['updated']} changed ({rate:,.0f} rows/s)")
+
+            # Throttle to the requested average rate
+            if args.max_rate:
+                ahead = processed_this_run / args.max_rate - elapsed
+                if ahead > 0:
+                    time.sleep(ahead)
+            if args.pause:
+                time.sleep(args.pause)
+
+        try:
+            while next_id < end_id:
+                rows = fetch_chunk(next_id, end_id, args.chunk_size)
+                if not rows:
+                    break
+                next_id = rows[-1]['id']
+                pending = executor.submit(classify_chunk, rows) if executor else classify_chunk(rows)
+                in_flight.append((next_id, len(rows), pending))
+                del rows
+                while len(in_flight) >= max_in_flight:
+                    finish_oldest()
+            while in_flight:
+                finish_oldest()
+        except KeyboardInterrupt:
+            print(f"\n⏸️  Interrupted - rerun with --resume to continue after click id {state['last_id']}")
+            return 1
+        finally:
+            if executor:
+                executor.shutdown(cancel_futures=True)
+
+    print(f"\n✅ Done: {state['processed']} clicks processed, {state['updated']} updated"
+          f"{' (dry run, nothing written)' if args.dry_run else ''}")
+    for transition, count in sorted(state['transitions'].items()):
+        print(f"   {transition}: {count}")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rerun bot detection over stored clicks")
+    parser.add_argument('--chunk-size', type=int, default=5000, help="rows per chunk (default 5000)")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help="detection processes, 0 runs inline (default: CPU count)")
+    parser.add_argument('--start-id', type=int, default=0, help="only clicks with a larger id")
+    parser.add_argument('--end-id', type=int, help="only clicks up to this id (default: current max)")
+    parser.add_argument('--checkpoint', default=DEFAULT_CHECKPOINT, help="checkpoint file")
+    parser.add_argument('--resume', action='store_true', help="continue from the checkpoint")
+    parser.add_argument('--max-rate', type=float, default=0, help="max rows per second, 0 for unlimited")
+    parser.add_argument('--pause', type=float, default=0, help="seconds to sleep between chunks")
+    parser.add_argument('--dry-run', action='store_true', help="report changes without writing")
+    args = parser.parse_args()
+    return reclassify(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,96 @@
+"""
+Bounded-memory request timing tracker
+Recent arrival times per client are kept in fixed-size ring buffers inside a
+hashed slot table, so each request costs O(1) work and memory never grows
+"""
+
+import time
+import threading
+from array import array
+from dataclasses import dataclass
+
+_HASH_MASK = (1 << 64) - 1
+
+
+@dataclass(frozen=True)
+class TimingStats:
+    """Arrival statistics for one key, including the current request"""
+    samples: int             # arrivals held in the ring (at most the window)
+    mean_interval: float     # seconds between consecutive arrivals
+    interval_cv: float       # coefficient of variation of the intervals
+    recent: int              # arrivals within the burst window
+
+
+class RequestTimingTracker:
+    """Hashed table of ring buffers holding the last arrivals per key
+
+    The table is direct-mapped: a key hashes to one slot and a different key
+    landing on the same slot simply takes it over. Memory is fixed at
+    ``slots * window`` timestamps regardless of traffic.
+    """
+
+    def __init__(self, slots: int = 16384, window: int = 8, burst_window: float = 2.0):
+        self.slots = max(1, slots)
+        self.window = max(2, window)
+        self.burst_window = burst_window
+        self._tags = array('Q', [0]) * self.slots
+        self._heads = array('H', [0]) * self.slots
+        self._counts = array('H', [0]) * self.slots
+        self._times = array('d', [0.0]) * (self.slots * self.window)
+        self._lock = threading.Lock()
+        self.observations = 0
+        self.collisions = 0
+
+    @property
+    def memory_bytes(self) -> int:
+        return sum(buffer.itemsize * len(buffer)
+                   for buffer in (self._tags, self._heads, self._counts, self._times))
+
+    def observe(self, key: str, now: float = None) -> TimingStats:
+        """Record an arrival for ``key`` and return its recent timing"""
+        now = time.monotonic() if now is None else now
+        hashed = hash(key) & _HASH_MASK
+        slot = hashed % self.slots
+        tag = hashed or 1
+        window = self.window
+        base = slot * window
+
+        with self._lock:
+            self.observations += 1
+            if self._tags[slot] != tag:
+                if self._tags[slot]:
+                    self.collisions += 1
+                self._tags[slot] = tag
+                self._heads[slot] = 0
+                self._counts[slot] = 0
+
+            head = self._heads[slot]
+            self._times[base + head] = now
+            self._heads[slot] = (head + 1) % window
+            count = min(self._counts[slot] + 1, window)
+            self._counts[slot] = count
+
+            oldest = (head + 1 - count) % window
+            arrivals = [self._times[base + (oldest + i) % window] for i in range(count)]
+
+        recent = sum(1 for arrival in arrivals if now - arrival <= self.burst_window)
+        if count < 3:
+            return TimingStats(samples=count, mean_interval=0.0, interval_cv=0.0, recent=recent)
+
+        intervals = [later - earlier for earlier, later in zip(arrivals, arrivals[1:])]
+        mean = sum(intervals) / len(intervals)
+        if mean <= 0:
+            return TimingStats(samples=count, mean_interval=0.0, interval_cv=0.0, recent=recent)
+        variance = sum((interval - mean) ** 2 for interval in intervals) / len(intervals)
+        return TimingStats(samples=count, mean_interval=mean,
+                           interval_cv=variance ** 0.5 / mean, recent=recent)
+
+    def stats(self):
+        """Counters for monitoring"""
+        return {
+            'slots': self.slots,
+            'window': self.window,
+            'memory_bytes': self.memory_bytes,
+            'observations': self.observations,
+            'collisions': self.collisions,
+        }
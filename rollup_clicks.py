@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Click rollup job
+Adds the clicks written since the last run to the hourly and daily rollups
+the analytics page reads (see click_rollups.py). Run it every minute or so,
+or keep it running with --interval. --rebuild recomputes a range of days from
+the raw clicks, one transaction per day: use it for the days before the first
+run (or let the first run work through all clicks), and after
+reclassify_clicks.py has changed verdicts.
+
+Usage:
+    python rollup_clicks.py                       # roll up what is new and exit
+    python rollup_clicks.py --interval 30         # keep rolling up every 30 seconds
+    python rollup_clicks.py --rebuild --since 2024-01-01 --until 2024-01-31
+"""
+import sys
+import time
+import argparse
+from datetime import datetime
+
+from app import app
+from click_rollups import ROLLUP_CHUNK_SIZE, days_between, rebuild_day, roll_up
+
+
+def parse_day(value):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d')
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"{value} is not a YYYY-MM-DD date")
+
+
+def rebuild(args):
+    if not args.since:
+        print("❌ --rebuild needs --since")
+        return 1
+    until = args.until or datetime.utcnow()
+    days = days_between(args.since, until)
+    print(f"🔧 Rebuilding rollups for {len(days)} days, {days[0]:%Y-%m-%d} to {days[-1]:%Y-%m-%d}"
+          if days else "✅ No days in that range")
+    for day in days:
+        clicks = rebuild_day(day)
+        print(f"   {day:%Y-%m-%d}: {clicks} clicks")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Roll up new clicks into the hourly and daily rollups")
+    parser.add_argument('--chunk-size', type=int, default=ROLLUP_CHUNK_SIZE,
+                        help=f"clicks per transaction (default {ROLLUP_CHUNK_SIZE})")
+    parser.add_argument('--interval', type=float, default=0,
+                        help="keep running, rolling up every N seconds (default: once and exit)")
+    parser.add_argument('--rebuild', action='store_true', help="recompute days from the raw clicks")
+    parser.add_argument('--since', type=parse_day, help="first day to rebuild (YYYY-MM-DD)")
+    parser.add_argument('--until', type=parse_day, help="last day to rebuild (default: today)")
+    args = parser.parse_args()
+
+    with app.app_context():
+        if args.rebuild:
+            return rebuild(args)
+
+        while True:
+            started = time.monotonic()
+            try:
+                clicks = roll_up(args.chunk_size)
+            except Exception as e:
+                if not args.interval:
+                    raise
+                print(f"❌ Rollup failed, retrying in {args.interval}s: {e}")
+                clicks = 0
+            if clicks or not args.interval:
+                print(f"✅ Rolled up {clicks} clicks in {time.monotonic() - started:.2f}s")
+            if not args.interval:
+                return 0
+            try:
+                time.sleep(args.interval)
+            except KeyboardInterrupt:
+                return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
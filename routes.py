@@ -1,17 +1,25 @@
-from flask import render_template, request, redirect, url_for, flash, session, jsonify, abort
-from datetime import datetime, timedelta
+import os
+import hmac
+from flask import render_template, request, redirect, url_for, flash, session, jsonify, abort, Response
+from datetime import date, datetime, timedelta
 from sqlalchemy import text
 from app import app, db
-from models import User, SmartLink, Click, LoginToken, CustomDomain
-from forms import LoginForm, SmartLinkForm, CustomDomainForm
+from models import User, SmartLink, LoginToken, CustomDomain
 from utils import (
-    is_bot_user_agent, get_platform_from_referrer, get_platform_from_user_agent,
-    is_suspicious_request, send_magic_link_email, truncate_ip,
+    get_platform_from_referrer, get_platform_from_user_agent,
+    send_magic_link_email, truncate_ip,
     verify_domain_ownership, get_domain_from_request, is_custom_domain,
-    is_tiktok_bot, detect_platform_from_request, analyze_request_fingerprint
+    detect_platform_from_request, analyze_request_fingerprint, analyze_redirect_request
 )
-from detection_engine import enhanced_bot_detection, is_sophisticated_tiktok_bot
-from vercel_api import get_vercel_manager
+from detection_engine import detection_engine
+from link_cache import link_cache
+from click_queue import click_queue
+from click_log import click_log
+from page_cache import page_cache
+from click_counters import empty_counts, user_counts, user_link_counts
+from rate_limiter import rate_limiter
+from short_code_filter import short_code_filter
+from startup_timer import startup_timer
 
 @app.route('/')
 def index():
@@ -36,6 +44,7 @@ def index():
 @app.route('/login', methods=['GET', 'POST'])
 def login():
     """Login page with magic link"""
+    from forms import LoginForm  # forms and wtforms load with the first dashboard page
     form = LoginForm()
     
     if form.validate_on_submit():
@@ -117,16 +126,18 @@ def dashboard():
     # Get user's smart links
     smart_links = SmartLink.query.filter_by(user_id=user_id).all()
     
-    # Calculate stats for each link
+    # Stats for each link, from the click counters (one query for all links)
+    counts_by_link = user_link_counts(user_id)
     links_with_stats = []
     total_human_clicks = 0
     total_bot_clicks = 0
     total_all_clicks = 0
     
     for link in smart_links:
-        total_clicks = Click.query.filter_by(smart_link_id=link.id).count()
-        human_clicks = Click.query.filter_by(smart_link_id=link.id, click_type='human').count()
-        bot_clicks = Click.query.filter_by(smart_link_id=link.id, click_type='bot').count()
+        counts = counts_by_link.get(link.id) or empty_counts()
+        total_clicks = counts['total']
+        human_clicks = counts['click_type'].get('human', 0)
+        bot_clicks = counts['click_type'].get('bot', 0)
         
         links_with_stats.append({
             'link': link,
@@ -152,6 +163,7 @@ def dashboard():
 @login_required
 def create_link():
     """Create new smart link"""
+    from forms import SmartLinkForm
     form = SmartLinkForm()
     
     # Get user's verified custom domains
@@ -203,74 +215,105 @@ def analytics(short_code):
     if not smart_link:
         abort(404)
     
-    # Get click analytics for the last 30 days
-    thirty_days_ago = datetime.utcnow() - timedelta(days=30)
-    
-    # Daily clicks
-    daily_clicks = db.session.query(
-        db.func.date(Click.created_at).label('date'),
-        db.func.count(Click.id).label('total'),
-        db.func.sum(db.case((Click.click_type == 'human', 1), else_=0)).label('human'),
-        db.func.sum(db.case((Click.click_type == 'bot', 1), else_=0)).label('bot'),
-        db.func.sum(db.case((Click.click_type == 'suspect', 1), else_=0)).label('suspect')
-    ).filter(
-        Click.smart_link_id == smart_link.id,
-        Click.created_at >= thirty_days_ago
-    ).group_by(db.func.date(Click.created_at)).order_by('date').all()
-    
-    # Platform breakdown
-    platform_clicks = db.session.query(
-        Click.platform,
-        db.func.count(Click.id).label('count')
-    ).filter(
-        Click.smart_link_id == smart_link.id,
-        Click.created_at >= thirty_days_ago
-    ).group_by(Click.platform).all()
+    from click_rollups import MAX_HOURLY_DAYS, MAX_RANGE_DAYS, link_activity
+    
+    # Date range (inclusive, UTC days), the last 30 days by default
+    today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    try:
+        last_day = datetime.strptime(request.args['to'], '%Y-%m-%d') if request.args.get('to') else today
+        first_day = (datetime.strptime(request.args['from'], '%Y-%m-%d') if request.args.get('from')
+                     else last_day - timedelta(days=29))
+    except ValueError:
+        flash('Dates must be given as YYYY-MM-DD.', 'error')
+        first_day, last_day = today - timedelta(days=29), today
+    except OverflowError:
+        abort(400)
+    # The range end is the day after last_day, which must still be a date
+    if not (date.min < first_day.date() < date.max and date.min < last_day.date() < date.max):
+        abort(400)
+    if first_day > last_day:
+        first_day, last_day = last_day, first_day
+    days = (last_day - first_day).days + 1
+    if days > MAX_RANGE_DAYS:
+        flash(f'Showing the last {MAX_RANGE_DAYS} days of that range.', 'info')
+        first_day = last_day - timedelta(days=MAX_RANGE_DAYS - 1)
+        days = MAX_RANGE_DAYS
+    interval = 'hour' if request.args.get('interval') == 'hour' and days <= MAX_HOURLY_DAYS else 'day'
+    
+    # Rollups for everything the rollup job has reached, raw clicks for the rest
+    activity = link_activity(smart_link.id, first_day, last_day + timedelta(days=1), interval)
+    label_format = '%Y-%m-%d %H:00' if interval == 'hour' else '%Y-%m-%d'
+    daily_clicks = [{
+        'date': bucket.strftime(label_format),
+        'total': counts['total'],
+        'human': counts['click_type'].get('human', 0),
+        'bot': counts['click_type'].get('bot', 0),
+        'suspect': counts['click_type'].get('suspect', 0),
+    } for bucket, counts in activity['buckets']]
+    
+    totals = activity['totals']
+    platform_clicks = [{'platform': platform, 'count': count} for platform, count in
+                       sorted(totals['platform'].items(), key=lambda item: -item[1])]
+    country_clicks = sorted(totals['country'].items(), key=lambda item: -item[1])
+    risk_clicks = sorted(totals['risk_level'].items(), key=lambda item: -item[1])
     
     return render_template('analytics.html', 
                          smart_link=smart_link, 
                          daily_clicks=daily_clicks,
-                         platform_clicks=platform_clicks)
+                         platform_clicks=platform_clicks,
+                         country_clicks=country_clicks,
+                         risk_clicks=risk_clicks,
+                         first_day=first_day,
+                         last_day=last_day,
+                         interval=interval,
+                         max_hourly_days=MAX_HOURLY_DAYS)
 
-@app.route('/<short_code>')
-def smart_redirect(short_code):
-    """Smart redirect endpoint - core functionality"""
-    # Get the current domain from the request
-    current_domain = request.host
-    
-    # Find the smart link by short code
-    smart_link = SmartLink.query.filter_by(short_code=short_code, is_active=True).first()
-    
-    if not smart_link:
-        abort(404)
-    
-    # Check if this request is coming from a custom domain
-    if smart_link.custom_domain and smart_link.custom_domain.domain != current_domain:
-        # If the link has a custom domain but request is from different domain, redirect to correct domain
-        if smart_link.custom_domain.is_verified and smart_link.custom_domain.is_active:
-            protocol = 'https' if smart_link.custom_domain.ssl_enabled else 'http'
-            correct_url = f"{protocol}://{smart_link.custom_domain.domain}/{short_code}"
-            return redirect(correct_url, code=301)
-    
-    # Get request details
-    user_agent = request.headers.get('User-Agent', '')
-    referrer = request.headers.get('Referer', '')
-    ip_address = request.remote_addr
-    
-    # Advanced detection engine analysis
-    detection_result = enhanced_bot_detection(user_agent, ip_address)
-    
-    # Legacy detection methods for fallback
-    is_bot_legacy = is_bot_user_agent(user_agent)
-    is_tiktok_legacy = is_tiktok_bot(user_agent, ip_address)
-    is_suspicious = is_suspicious_request()
+def rate_limited_response(rule_name, short_code, client_ip=None, safe_url=None):
+    """Cheap response for a client over its rate limit (None when within it)
+
+    Runs before any link lookup or detection, so a flooding client never
+    reaches the database. The ASGI service passes the client IP and safe URL.
+    """
+    if client_ip is None:
+        client_ip = request.remote_addr
+    if rate_limiter.allow(rule_name, truncate_ip(client_ip), short_code):
+        return None
+    
+    if safe_url is None:
+        safe_url = url_for('safe_page', short_code=short_code, _external=True)
+    retry_after = {'Retry-After': str(rate_limiter.retry_after(rule_name))}
+    action = rate_limiter.rules[rule_name].action
+    if rule_name == 'verify':
+        if action == 'safe':
+            return jsonify({'success': False, 'redirect_url': safe_url})
+        return jsonify({'success': False, 'error': 'rate_limited'}), 429, retry_after
+    if action == 'safe':
+        return redirect(safe_url)
+    return Response('Too Many Requests', status=429, mimetype='text/plain', headers=retry_after)
+
+def unknown_code_response():
+    """Static 404 for a short code the short code filter rules out
+
+    Kept tiny: these are mostly scanners, and the full 404 page renders the homepage.
+    """
+    return Response('Not Found', status=404, mimetype='text/plain')
+
+def route_click(smart_link, short_code, user_agent, referrer, ip_address, headers, root_url, build_url=None):
+    """Detection and routing for one redirect, shared with the ASGI service
+
+    Returns the redirect URL and the click row to record.
+    """
+    # One detection pass: advanced engine plus legacy fallbacks over the same request data
+    verdict = analyze_redirect_request(user_agent, ip_address, referrer, headers=headers, short_code=short_code)
+    detection_result = verdict.detection
     
     # Enhanced detection with confidence scoring
-    is_bot = detection_result.is_bot or is_bot_legacy
-    is_tiktok = is_sophisticated_tiktok_bot(user_agent, ip_address) or is_tiktok_legacy
-    platform = detection_result.platform
-    confidence_score = detection_result.confidence_score
-    risk_level = detection_result.risk_level
+    is_bot = verdict.is_bot
+    is_tiktok = verdict.is_tiktok
+    is_suspicious = verdict.is_suspicious
+    platform = verdict.platform
+    confidence_score = verdict.confidence_score
+    risk_level = verdict.risk_level
     
     # Platform-specific routing logic
     if is_bot or is_tiktok:
@@ -278,89 +321,142 @@ def smart_redirect(short_code):
         click_type = 'bot'
         target_reached = 'safe'
         
-        # Use platform-specific safe page if available
-        if platform == 'tiktok':
-            redirect_url = url_for('safe_page_tiktok', short_code=short_code, _external=True)
-        elif platform in ['instagram', 'facebook']:
-            redirect_url = url_for('safe_page_instagram', short_code=short_code, _external=True)
-        else:
-            # Fallback to custom safe URL or generic safe page
-            redirect_url = smart_link.safe_url or url_for('safe_page', short_code=short_code, _external=True)
-            
+        # Platform-specific safe page if available, else the custom safe URL or
+        # generic safe page (URLs are built once per link and host)
+        redirect_url = smart_link.redirect_targets(root_url, build_url).for_bot(platform)
+        
     elif is_suspicious and smart_link.use_js_challenge:
         # Suspicious request - JavaScript challenge
         click_type = 'suspect'
         target_reached = 'challenge'
-        redirect_url = url_for('js_challenge', short_code=short_code, _external=True)
+        redirect_url = smart_link.redirect_targets(root_url, build_url).challenge
     else:
         # Human user - direct to target (OnlyFans/target URL)
         click_type = 'human'
         target_reached = 'target'
         redirect_url = smart_link.target_url
     
-    # Log the click with enhanced analytics
-    import json
-    click = Click(
-        smart_link_id=smart_link.id,
-        ip_address=truncate_ip(ip_address),
-        user_agent=user_agent[:500] if user_agent else None,
-        referrer=referrer[:500] if referrer else None,
-        click_type=click_type,
-        target_reached=target_reached,
-        platform=platform,
-        confidence_score=confidence_score,
-        risk_level=risk_level,
-        detection_methods=json.dumps(detection_result.detection_methods)
-    )
-    db.session.add(click)
-    db.session.commit()
+    # Click row with enhanced analytics
+    click = {
+        'smart_link_id': smart_link.id,
+        'ip_address': truncate_ip(ip_address),
+        'user_agent': user_agent[:500] if user_agent else None,
+        'referrer': referrer[:500] if referrer else None,
+        'click_type': click_type,
+        'target_reached': target_reached,
+        'platform': platform,
+        'confidence_score': confidence_score,
+        'risk_level': risk_level,
+        'detection_methods': detection_result.stored_methods(),
+        'created_at': datetime.utcnow(),
+    }
+    return redirect_url, click
+
+def record_click(click, enqueue_timeout=None):
+    """Log a click: to the local click log when configured, otherwise (or if
+    the append fails) through the write-behind queue"""
+    if not (click_log.enabled and click_log.append(click)):
+        click_queue.enqueue(click, timeout=enqueue_timeout)
+
+@app.route('/<short_code>')
+def smart_redirect(short_code):
+    """Smart redirect endpoint - core functionality"""
+    # Get the current domain from the request
+    current_domain = request.host
+    
+    if not short_code_filter.may_exist(short_code):
+        return unknown_code_response()
+    
+    limited = rate_limited_response('redirect', short_code)
+    if limited:
+        return limited
+    
+    # Find the smart link by short code (cached per worker, hot links need no query)
+    smart_link = link_cache.resolve(short_code)
+    
+    if not smart_link:
+        abort(404)
+    
+    # Check if this request is coming from a custom domain
+    if smart_link.custom_domain and smart_link.custom_domain != current_domain:
+        # If the link has a custom domain but request is from different domain, redirect to correct domain
+        if smart_link.canonical_url:
+            return redirect(smart_link.canonical_url, code=301)
+    
+    # Get request details
+    user_agent = request.headers.get('User-Agent', '')
+    referrer = request.headers.get('Referer', '')
+    ip_address = request.remote_addr
+    
+    redirect_url, click = route_click(smart_link, short_code, user_agent, referrer, ip_address,
+                                      dict(request.headers), request.url_root)
+    record_click(click)
     
     return redirect(redirect_url)
 
 @app.route('/safe/<short_code>')
 def safe_page(short_code):
     """Generic safe landing page for bots"""
-    smart_link = SmartLink.query.filter_by(short_code=short_code, is_active=True).first()
+    if not short_code_filter.may_exist(short_code):
+        return unknown_code_response()
+    
+    smart_link = link_cache.resolve(short_code)
     
     if not smart_link:
         abort(404)
     
-    return render_template('safe_page.html', smart_link=smart_link)
+    return page_cache.response('safe_page.html', smart_link)
 
 @app.route('/safe/tiktok/<short_code>')
 def safe_page_tiktok(short_code):
     """TikTok-optimized safe landing page"""
-    smart_link = SmartLink.query.filter_by(short_code=short_code, is_active=True).first()
+    if not short_code_filter.may_exist(short_code):
+        return unknown_code_response()
+    
+    smart_link = link_cache.resolve(short_code)
     
     if not smart_link:
         abort(404)
     
-    return render_template('safe_page_tiktok.html', smart_link=smart_link)
+    return page_cache.response('safe_page_tiktok.html', smart_link)
 
 @app.route('/safe/instagram/<short_code>')
 def safe_page_instagram(short_code):
     """Instagram-optimized safe landing page"""
-    smart_link = SmartLink.query.filter_by(short_code=short_code, is_active=True).first()
+    if not short_code_filter.may_exist(short_code):
+        return unknown_code_response()
+    
+    smart_link = link_cache.resolve(short_code)
     
     if not smart_link:
         abort(404)
     
-    return render_template('safe_page_instagram.html', smart_link=smart_link)
+    return page_cache.response('safe_page_instagram.html', smart_link)
 
 @app.route('/challenge/<short_code>')
 def js_challenge(short_code):
     """JavaScript challenge page for suspicious requests"""
-    smart_link = SmartLink.query.filter_by(short_code=short_code, is_active=True).first()
+    if not short_code_filter.may_exist(short_code):
+        return unknown_code_response()
+    
+    smart_link = link_cache.resolve(short_code)
     
     if not smart_link:
         abort(404)
     
-    return render_template('js_challenge.html', smart_link=smart_link)
+    return page_cache.response('js_challenge.html', smart_link)
 
 @app.route('/challenge/<short_code>/verify', methods=['POST'])
 def verify_js_challenge(short_code):
     """Verify JavaScript challenge completion"""
-    smart_link = SmartLink.query.filter_by(short_code=short_code, is_active=True).first()
+    if not short_code_filter.may_exist(short_code):
+        return unknown_code_response()
+    
+    limited = rate_limited_response('verify', short_code)
+    if limited:
+        return limited
+    
+    smart_link = link_cache.resolve(short_code)
     
     if not smart_link:
         abort(404)
@@ -383,6 +479,20 @@ def verify_js_challenge(short_code):
             'redirect_url': url_for('safe_page', short_code=short_code, _external=True)
         })
 
+@app.route('/api/links/bulk', methods=['POST'])
+@login_required
+def api_bulk_links():
+    """Create, update or deactivate many links in one request (operations described in bulk_links.py)"""
+    from bulk_links import BULK_MAX_OPERATIONS, apply_operations
+    payload = request.get_json(silent=True)
+    operations = payload.get('links') if isinstance(payload, dict) else payload
+    if not isinstance(operations, list):
+        return jsonify({'error': 'expected a JSON list of operations or {"links": [...]}'}), 400
+    if len(operations) > BULK_MAX_OPERATIONS:
+        return jsonify({'error': f'at most {BULK_MAX_OPERATIONS} operations per request'}), 413
+    
+    return jsonify(apply_operations(session['user_id'], operations, host=request.host))
+
 @app.route('/api/stats')
 @login_required
 def api_stats():
@@ -391,10 +501,9 @@ def api_stats():
     
     # Get overall stats for user
     total_links = SmartLink.query.filter_by(user_id=user_id).count()
-    total_clicks = db.session.query(db.func.count(Click.id)).join(SmartLink).filter(SmartLink.user_id == user_id).scalar()
-    human_clicks = db.session.query(db.func.count(Click.id)).join(SmartLink).filter(
-        SmartLink.user_id == user_id, Click.click_type == 'human'
-    ).scalar()
+    counts = user_counts(user_id)
+    total_clicks = counts['total']
+    human_clicks = counts['click_type'].get('human', 0)
     
     return jsonify({
         'total_links': total_links or 0,
@@ -403,6 +512,36 @@ def api_stats():
         'bot_clicks': (total_clicks or 0) - (human_clicks or 0)
     })
 
+@app.route('/api/metrics')
+def api_metrics():
+    """Detection engine metrics for this worker (JSON, or Prometheus text with ?format=prometheus)
+    
+    Needs a logged-in session or an ``Authorization: Bearer <METRICS_TOKEN>`` header.
+    """
+    metrics_token = os.environ.get('METRICS_TOKEN', '')
+    auth_header = request.headers.get('Authorization', '')
+    token_ok = bool(metrics_token) and auth_header.startswith('Bearer ') and \
+        hmac.compare_digest(auth_header[len('Bearer '):].strip(), metrics_token)
+    if not token_ok and 'user_id' not in session:
+        return jsonify({'error': 'unauthorized'}), 401
+    
+    wants_prometheus = request.args.get('format') == 'prometheus' or (
+        'format' not in request.args and
+        request.accept_mimetypes.best_match(['application/json', 'text/plain']) == 'text/plain'
+    )
+    if wants_prometheus:
+        return Response(detection_engine.metrics.to_prometheus(detection_engine.method_skips),
+                        mimetype='text/plain; version=0.0.4')
+    snapshot = detection_engine.metrics_snapshot()
+    snapshot['link_cache'] = link_cache.stats()
+    snapshot['click_queue'] = click_queue.stats()
+    snapshot['click_log'] = click_log.stats()
+    snapshot['page_cache'] = page_cache.stats()
+    snapshot['rate_limiter'] = rate_limiter.stats()
+    snapshot['short_code_filter'] = short_code_filter.stats()
+    snapshot['startup'] = startup_timer.stats()
+    return jsonify(snapshot)
+
 @app.route('/domains')
 @login_required
 def manage_domains():
@@ -417,6 +556,7 @@ def manage_domains():
 @login_required
 def add_domain():
     """Add a new custom domain"""
+    from forms import CustomDomainForm
     form = CustomDomainForm()
     
     if form.validate_on_submit():
@@ -472,6 +612,7 @@ def check_domain_verification(domain_id):
         
         # 🚀 AUTO-ADD TO VERCEL
         try:
+            from vercel_api import get_vercel_manager
             vercel_manager = get_vercel_manager()
             vercel_result = vercel_manager.add_custom_domain(domain.domain)
             
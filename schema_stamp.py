@@ -0,0 +1,66 @@
+"""
+Schema version stamp
+db.create_all() inspects every table on each start. Instead the database keeps
+a fingerprint of the models it was last brought up to date with, and a start
+whose models match it skips create_all() after a single-row read. Changing a
+model (table, column, type, index) changes the fingerprint, so the next start
+runs create_all() again. Like create_all() itself this only adds missing
+tables; column changes on existing tables still go through migrate_database.py.
+"""
+
+import hashlib
+import logging
+from datetime import datetime
+
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+
+from app import db
+from models import SchemaStamp
+
+logger = logging.getLogger(__name__)
+
+STAMP_ID = 1
+
+
+def schema_fingerprint(metadata) -> str:
+    """Stable hash of the tables, columns and indexes the models declare"""
+    lines = []
+    for table in sorted(metadata.tables.values(), key=lambda table: table.name):
+        lines.append(f"table {table.name}")
+        for column in table.columns:
+            lines.append(f"  column {column.name} {column.type!r} nullable={column.nullable} "
+                         f"pk={column.primary_key} unique={bool(column.unique)}")
+        for index in sorted(table.indexes, key=lambda index: index.name or ''):
+            lines.append(f"  index {index.name} {[column.name for column in index.columns]} unique={index.unique}")
+        for key in sorted(table.foreign_keys, key=lambda key: key.target_fullname):
+            lines.append(f"  foreign key {key.parent.name} -> {key.target_fullname}")
+    return hashlib.sha256('\n'.join(lines).encode('utf-8')).hexdigest()
+
+
+def ensure_schema() -> bool:
+    """Create missing tables unless the stamp matches the models, True when create_all() ran
+
+    Needs an app context.
+    """
+    fingerprint = schema_fingerprint(db.metadata)
+    try:
+        stamp = db.session.get(SchemaStamp, STAMP_ID)
+    except SQLAlchemyError:
+        # No stamp table yet: a new database, or one created before stamping
+        db.session.rollback()
+        stamp = None
+    if stamp is not None and stamp.fingerprint == fingerprint:
+        return False
+
+    db.create_all()
+    if stamp is None:
+        stamp = SchemaStamp(id=STAMP_ID)
+        db.session.add(stamp)
+    stamp.fingerprint = fingerprint
+    stamp.stamped_at = datetime.utcnow()
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # Another worker stamped it first
+        db.session.rollback()
+    return True
@@ -0,0 +1,352 @@
+"""
+Negative cache for unknown short codes
+Scanners probe random /<short_code> paths, and every probe used to cost a
+SmartLink query and a rendered 404 page. Each worker keeps a counting Bloom
+filter of the short codes in the database: a code the filter has never seen
+certainly doesn't exist and gets a small static 404 without a database round
+trip. False positives just take the normal lookup.
+
+The filter is built by a background thread on first use (until it is ready
+every code is looked up as before). Links created by other workers are picked
+up by a catch-up query on new ids. A code missing from the filter is only
+rejected while the last catch-up is less than the sync interval old, so a
+link created elsewhere can be answered with a 404 for at most that long. Past
+it, the miss takes the normal lookup and starts a catch-up in the background;
+requests never wait for one. Links created or deleted here update the filter
+directly. A periodic rebuild drops codes deleted elsewhere and resizes the
+filter as the table grows.
+
+Disabled on Vercel, where functions are frozen between requests and the
+background build can't be relied on.
+"""
+
+import os
+import math
+import time
+import hashlib
+import logging
+import threading
+from functools import partial
+from typing import Dict, Optional, Set
+
+from sqlalchemy import event, func, inspect, or_, select
+from sqlalchemy.orm import Session
+
+from app import app, db
+from models import SmartLink
+
+logger = logging.getLogger(__name__)
+
+# With no configured capacity the filter is sized for twice the link count
+MIN_AUTO_CAPACITY = 10000
+# Ids below the newest one that have no row may belong to transactions still
+# in flight; the catch-up query keeps asking for them this long
+HOLE_WINDOW = 1024
+HOLE_TTL = 300.0
+# Wait before trying again after a failed build
+BUILD_RETRY = 30.0
+
+
+class CountingBloomFilter:
+    """Bloom filter with 8-bit counters, so members can be removed again"""
+
+    def __init__(self, capacity: int, error_rate: float):
+        self.capacity = max(1, capacity)
+        self.error_rate = error_rate
+        self.size = max(64, math.ceil(-self.capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / self.capacity * math.log(2)))
+        self.count = 0
+        self._counters = bytearray(self.size)
+
+    def _positions(self, item: str):
+        digest = hashlib.blake2b(item.encode('utf-8'), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        step = int.from_bytes(digest[8:], 'little') | 1
+        size = self.size
+        return [(first + i * step) % size for i in range(self.hashes)]
+
+    def add(self, item: str):
+        counters = self._counters
+        for position in self._positions(item):
+            if counters[position] < 255:
+                counters[position] += 1
+        self.count += 1
+
+    def remove(self, item: str) -> bool:
+        """Remove an item that was added (removing anything else corrupts the filter)"""
+        positions = self._positions(item)
+        counters = self._counters
+        if not all(counters[position] for position in positions):
+            return False
+        for position in positions:
+            # A saturated counter has lost count: leave it set
+            if counters[position] < 255:
+                counters[position] -= 1
+        self.count -= 1
+        return True
+
+    def __contains__(self, item: str) -> bool:
+        counters = self._counters
+        return all(counters[position] for position in self._positions(item))
+
+    def estimated_error_rate(self) -> float:
+        """False-positive rate at the current fill"""
+        filled = self.size - self._counters.count(0)
+        return (filled / self.size) ** self.hashes
+
+
+class ShortCodeFilter:
+    """Per-worker filter answering "might this short code exist?" """
+
+    def __init__(self, capacity: int = 0, error_rate: float = 0.01, sync_interval: float = 1.0,
+                 rebuild_interval: float = 3600.0, enabled: bool = True):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.sync_interval = sync_interval
+        self.rebuild_interval = rebuild_interval
+        self.enabled = enabled
+
+        self.rejected = 0
+        self.passed = 0
+        self.unchecked = 0
+        self.syncs = 0
+        self.builds = 0
+        self.failures = 0
+
+        self._filter: Optional[CountingBloomFilter] = None
+        self._watermark = 0                 # highest link id loaded
+        self._holes: Dict[int, float] = {}  # missing ids below it -> when first missed
+        self._synced_from = 0.0             # start of the newest catch-up (or build) applied
+        self._rebuild_at = 0.0
+        self._built_at = None
+        self._lock = threading.Lock()
+        self._pid = None
+        self._busy = False                  # a background build or catch-up is running
+
+    def may_exist(self, short_code: str) -> bool:
+        """False only when the short code is not in the database as of the last catch-up
+
+        Never queries: a miss while the last catch-up is older than the sync
+        interval is let through to the normal lookup and starts a catch-up.
+        """
+        if not self.enabled:
+            return True
+        bloom = self._current()
+        if bloom is None:
+            self.unchecked += 1
+            return True
+        if short_code in bloom:
+            self.passed += 1
+            return True
+        if time.monotonic() - self._synced_from >= self.sync_interval:
+            self._in_background(self.sync)
+            self.unchecked += 1
+            return True
+        self.rejected += 1
+        return False
+
+    def _current(self) -> Optional[CountingBloomFilter]:
+        """The filter in use, starting a build when there is none or a rebuild is due"""
+        if self._pid != os.getpid():
+            # New process (or forked worker): the filter is still valid, threads are not
+            self._pid = os.getpid()
+            self._busy = False
+        bloom = self._filter
+        outgrown = bloom is not None and not self.capacity and bloom.count > bloom.capacity
+        if outgrown or time.monotonic() >= self._rebuild_at:
+            self._in_background(self.rebuild)
+        return bloom
+
+    def _in_background(self, target):
+        with self._lock:
+            if self._busy:
+                return
+            self._busy = True
+        threading.Thread(target=self._run, args=(target,), name='short-code-filter', daemon=True).start()
+
+    def _run(self, target):
+        try:
+            target()
+        finally:
+            self._busy = False
+
+    def rebuild(self):
+        """Load every short code into a new filter sized for the table"""
+        started = time.monotonic()
+        try:
+            with app.app_context(), db.engine.connect() as connection:
+                links = connection.execute(select(func.count(SmartLink.id))).scalar() or 0
+                bloom = CountingBloomFilter(self.capacity or max(MIN_AUTO_CAPACITY, 2 * links),
+                                            self.error_rate)
+                watermark = 0
+                recent: Set[int] = set()
+                rows = connection.execution_options(yield_per=5000).execute(
+                    select(SmartLink.id, SmartLink.short_code).order_by(SmartLink.id))
+                for link_id, short_code in rows:
+                    bloom.add(short_code)
+                    watermark = link_id
+                    recent.add(link_id)
+                    if len(recent) > 2 * HOLE_WINDOW:
+                        recent = {i for i in recent if i > link_id - HOLE_WINDOW}
+        except Exception as e:
+            self.failures += 1
+            self._rebuild_at = time.monotonic() + BUILD_RETRY
+            logger.error(f"Short code filter build failed: {e}")
+            return
+
+        now = time.monotonic()
+        holes = {i: now for i in range(max(1, watermark - HOLE_WINDOW + 1), watermark) if i not in recent}
+        with self._lock:
+            self._filter = bloom
+            self._watermark = watermark
+            self._holes = holes
+            # Links committed while the table was being read are caught up by the next catch-up
+            self._synced_from = started
+            self._rebuild_at = now + self.rebuild_interval
+            self._built_at = now
+        self.builds += 1
+        logger.info(f"Short code filter built: {bloom.count} codes, {bloom.size:,} bytes, "
+                    f"{bloom.hashes} hashes")
+
+    def sync(self) -> bool:
+        """Add links created since the last build or catch-up, returns False if that failed"""
+        with self._lock:
+            bloom = self._filter
+            if bloom is None:
+                return False
+            watermark = self._watermark
+            holes = list(self._holes)
+
+        started = time.monotonic()
+        condition = SmartLink.id > watermark
+        if holes:
+            condition = or_(condition, SmartLink.id.in_(holes))
+        try:
+            with app.app_context(), db.engine.connect() as connection:
+                rows = connection.execute(select(SmartLink.id, SmartLink.short_code).where(condition)).all()
+        except Exception as e:
+            self.failures += 1
+            logger.error(f"Short code filter sync failed: {e}")
+            return False
+
+        now = time.monotonic()
+        with self._lock:
+            if self._filter is not bloom or self._watermark != watermark:
+                # Rebuilt or caught up meanwhile
+                return False
+            newest = watermark
+            for link_id, short_code in rows:
+                if link_id > watermark or self._holes.pop(link_id, None) is not None:
+                    bloom.add(short_code)
+                    newest = max(newest, link_id)
+            found = {link_id for link_id, _ in rows}
+            for link_id in range(max(watermark + 1, newest - HOLE_WINDOW + 1), newest):
+                if link_id not in found:
+                    self._holes[link_id] = now
+            for link_id, missed_at in list(self._holes.items()):
+                if now - missed_at > HOLE_TTL:
+                    del self._holes[link_id]
+            self._watermark = newest
+            self._synced_from = started
+        self.syncs += 1
+        return True
+
+    def forget(self, bloom: Optional[CountingBloomFilter], link_id: Optional[int], short_code: str):
+        """Drop the code of a link deleted (or renamed) here
+
+        Only when ``bloom``, the filter in use when the change was flushed, is
+        still in use and the link was loaded into it.
+        """
+        with self._lock:
+            if bloom is None or self._filter is not bloom or link_id is None:
+                return
+            if link_id > self._watermark or link_id in self._holes:
+                return
+            bloom.remove(short_code)
+
+    def learn(self, short_code: str):
+        """Add the code of a link created or renamed here
+
+        A created link is added again by the next catch-up; the extra count
+        only means deleting it later leaves a harmless false positive.
+        """
+        with self._lock:
+            if self._filter is not None:
+                self._filter.add(short_code)
+
+    def stats(self) -> Dict:
+        bloom = self._filter
+        return {
+            'enabled': self.enabled,
+            'ready': bloom is not None,
+            'codes': bloom.count if bloom else 0,
+            'capacity': bloom.capacity if bloom else self.capacity,
+            'error_rate': self.error_rate,
+            'estimated_error_rate': round(bloom.estimated_error_rate(), 6) if bloom else None,
+            'size_bytes': bloom.size if bloom else 0,
+            'hashes': bloom.hashes if bloom else 0,
+            'rejected': self.rejected,
+            'passed': self.passed,
+            'unchecked': self.unchecked,
+            'syncs': self.syncs,
+            'builds': self.builds,
+            'failures': self.failures,
+            'built_seconds_ago': round(time.monotonic() - self._built_at, 1) if self._built_at else None,
+        }
+
+
+short_code_filter = ShortCodeFilter(
+    capacity=int(os.environ.get('SHORT_CODE_FILTER_CAPACITY', '0')),
+    error_rate=float(os.environ.get('SHORT_CODE_FILTER_ERROR_RATE', '0.01')),
+    sync_interval=float(os.environ.get('SHORT_CODE_FILTER_SYNC_INTERVAL', '1')),
+    rebuild_interval=float(os.environ.get('SHORT_CODE_FILTER_REBUILD_INTERVAL', '3600')),
+    enabled=not os.environ.get('VERCEL_ENV') and
+    os.environ.get('SHORT_CODE_FILTER', '1').lower() not in ('0', 'false', 'no'),
+)
+
+
+# Changes made through this worker, applied once the transaction commits
+
+def _apply_or_defer(target: SmartLink, changes: list):
+    session = Session.object_session(target)
+    if session is None:
+        for change in changes:
+            change()
+        return
+    session.info.setdefault('short_code_filter_changes', []).extend(changes)
+
+
+def _link_inserted(mapper, connection, target: SmartLink):
+    _apply_or_defer(target, [partial(short_code_filter.learn, target.short_code)])
+
+
+def _link_updated(mapper, connection, target: SmartLink):
+    history = inspect(target).attrs.short_code.history
+    if not history.deleted:
+        return
+    changes = [partial(short_code_filter.forget, short_code_filter._filter, target.id, code)
+               for code in history.deleted if code]
+    changes.append(partial(short_code_filter.learn, target.short_code))
+    _apply_or_defer(target, changes)
+
+
+def _link_deleted(mapper, connection, target: SmartLink):
+    # The filter in use now: a rebuild after this point decides for itself
+    _apply_or_defer(target, [partial(short_code_filter.forget, short_code_filter._filter,
+                                     target.id, target.short_code)])
+
+
+event.listen(SmartLink, 'after_insert', _link_inserted)
+event.listen(SmartLink, 'after_update', _link_updated)
+event.listen(SmartLink, 'after_delete', _link_deleted)
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_changes(session: Session):
+    for change in session.info.pop('short_code_filter_changes', None) or ():
+        change()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_changes(session: Session):
+    session.info.pop('short_code_filter_changes', None)
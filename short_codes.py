@@ -0,0 +1,135 @@
+"""
+Short code allocation
+Codes come from a counter instead of random draws, so creating a link never
+needs a uniqueness lookup and concurrent creators can't pick the same code.
+Each process reserves a block of counter values with one atomic UPDATE of the
+short_code_sequence row and hands them out from memory. Every value goes
+through a keyed Feistel permutation of the code space before being written as
+7 base62 characters, so consecutive links don't get neighbouring, guessable
+codes. The permutation is a bijection, so distinct counter values always give
+distinct codes, and the fixed 7-character length keeps them apart from the
+6-character random codes issued before.
+"""
+
+import os
+import string
+import hashlib
+import secrets
+import threading
+from typing import List
+
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from models import ShortCodeSequence
+
+ALPHABET = string.ascii_letters + string.digits
+CODE_LENGTH = 7
+CODE_SPACE = len(ALPHABET) ** CODE_LENGTH
+
+SEQUENCE_NAME = 'smart_link'
+
+# Feistel network over 42 bits (the smallest even width covering CODE_SPACE)
+_HALF_BITS = 21
+_HALF_MASK = (1 << _HALF_BITS) - 1
+_ROUNDS = 4
+
+
+def _round(key: bytes, number: int, half: int) -> int:
+    digest = hashlib.blake2b(bytes([number]) + half.to_bytes(3, 'little'), key=key, digest_size=4).digest()
+    return int.from_bytes(digest, 'little') & _HALF_MASK
+
+
+def permute(value: int, key: bytes) -> int:
+    """Keyed bijection on range(CODE_SPACE)
+
+    Values the network maps outside the code space are run through it again
+    (cycle walking), which keeps the mapping one-to-one on the smaller range.
+    """
+    if not 0 <= value < CODE_SPACE:
+        raise ValueError(f"{value} is outside the short code space")
+    while True:
+        left, right = value >> _HALF_BITS, value & _HALF_MASK
+        for number in range(_ROUNDS):
+            left, right = right, left ^ _round(key, number, right)
+        value = (left << _HALF_BITS) | right
+        if value < CODE_SPACE:
+            return value
+
+
+def encode(value: int) -> str:
+    """Fixed-width base62"""
+    characters = []
+    for _ in range(CODE_LENGTH):
+        value, digit = divmod(value, len(ALPHABET))
+        characters.append(ALPHABET[digit])
+    return ''.join(reversed(characters))
+
+
+class ShortCodeAllocator:
+    """Hands out short codes from counter blocks reserved in the database"""
+
+    def __init__(self, block_size: int = 100, sequence: str = SEQUENCE_NAME):
+        self.block_size = max(1, block_size)
+        self.sequence = sequence
+        self.allocated = 0
+        self.blocks = 0
+        self._next = 0
+        self._end = 0
+        self._key = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def allocate(self) -> str:
+        return self.allocate_many(1)[0]
+
+    def allocate_many(self, count: int) -> List[str]:
+        """``count`` new short codes (needs an app context when a block runs out)"""
+        codes: List[str] = []
+        with self._lock:
+            if self._pid != os.getpid():
+                # A forked worker must not hand out the rest of its parent's block
+                self._next = self._end = 0
+                self._pid = os.getpid()
+            while len(codes) < count:
+                if self._next >= self._end:
+                    self._reserve(max(self.block_size, count - len(codes)))
+                take = min(self._end - self._next, count - len(codes))
+                codes.extend(encode(permute(value, self._key)) for value in range(self._next, self._next + take))
+                self._next += take
+            self.allocated += len(codes)
+        return codes
+
+    def _reserve(self, size: int):
+        """Claim the next ``size`` counter values, in a transaction of its own"""
+        table = ShortCodeSequence.__table__
+        for _ in range(3):
+            try:
+                with db.engine.begin() as connection:
+                    claimed = connection.execute(
+                        table.update()
+                        .where(table.c.name == self.sequence)
+                        .values(next_value=table.c.next_value + size)).rowcount
+                    if not claimed:
+                        connection.execute(table.insert().values(
+                            name=self.sequence, next_value=size, key=secrets.token_hex(16)))
+                    end, key = connection.execute(
+                        select(table.c.next_value, table.c.key).where(table.c.name == self.sequence)).one()
+                break
+            except IntegrityError:
+                # Another process created the sequence row first
+                continue
+        else:
+            raise RuntimeError(f"Could not reserve short codes from sequence {self.sequence!r}")
+
+        if end > CODE_SPACE:
+            raise RuntimeError(f"Short code sequence {self.sequence!r} is exhausted")
+        self._next, self._end = end - size, end
+        self._key = bytes.fromhex(key)
+        self.blocks += 1
+
+
+short_code_allocator = ShortCodeAllocator(
+    block_size=int(os.environ.get('SHORT_CODE_BLOCK_SIZE', '100')),
+)
@@ -0,0 +1,414 @@
+"""
+Versioned signature packs with hot reload
+signature_pack.json is the single source of bot signatures, in-app browser
+patterns, header-order fingerprints and platform IP ranges. build_signature_pack.py compiles it into a
+binary pack that every worker memory-maps read-only, so the IP tables are
+shared through the page cache instead of copied per worker. The registry swaps
+to a new pack atomically when the file changes or on an admin signal.
+"""
+
+import os
+import re
+import sys
+import json
+import mmap
+import time
+import struct
+import signal
+import logging
+import threading
+from array import array
+from functools import lru_cache
+from typing import Callable, Dict, List, Optional, Tuple
+
+from header_fingerprint import fingerprint_id
+from ip_ranges import IPRangeIndex, MappedIPRangeIndex
+from signatures import Signature, SignatureSet
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SOURCE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'signature_pack.json')
+
+PACK_MAGIC = b'STSIGPK\0'
+PACK_FORMAT = 1
+_HEADER = struct.Struct('<8sII')  # magic, format, metadata length
+_ALIGN = 16
+
+SET_FLAGS = {'IGNORECASE': re.IGNORECASE}
+
+_generations = iter(range(1, sys.maxsize))
+
+
+def load_source(path: str = DEFAULT_SOURCE_PATH) -> Dict:
+    """Read a signature source file"""
+    with open(path, 'r', encoding='utf-8') as handle:
+        source = json.load(handle)
+    if 'sets' not in source:
+        raise ValueError(f"{path}: not a signature source (no 'sets')")
+    return source
+
+
+@lru_cache(maxsize=1)
+def _default_source() -> Dict:
+    return load_source(DEFAULT_SOURCE_PATH)
+
+
+def default_patterns(name: str) -> List[str]:
+    """Patterns of one set in the built-in source, as plain strings"""
+    spec = _default_source()['sets'][name]
+    if 'literals' in spec:
+        return list(spec['literals'])
+    return [_entry(item)[0] for item in spec['patterns']]
+
+
+def default_ip_ranges() -> Dict[str, List[str]]:
+    """Platform IP ranges in the built-in source"""
+    return ip_range_mapping(_default_source())
+
+
+def _entry(item) -> tuple:
+    """(pattern, platform) for a plain string or {"pattern": ..., "platform": ...} entry"""
+    if isinstance(item, str):
+        return item, None
+    return item['pattern'], item.get('platform')
+
+
+def compile_sets(set_specs: Dict[str, Dict]) -> Dict[str, SignatureSet]:
+    """Compile every set of a source into SignatureSets"""
+    sets = {}
+    for name, spec in set_specs.items():
+        flags = 0
+        for flag in spec.get('flags', []):
+            flags |= SET_FLAGS[flag]
+        if 'literals' in spec:
+            entries = [(re.escape(literal), None) for literal in spec['literals']]
+        else:
+            entries = [_entry(item) for item in spec.get('patterns', [])]
+        signatures = [
+            Signature(id=f'{name}:{index}', pattern=pattern,
+                      platform=platform or spec.get('platform'), weight=spec.get('weight', 0.0))
+            for index, (pattern, platform) in enumerate(entries)
+        ]
+        sets[name] = SignatureSet(name, signatures, flags)
+    return sets
+
+
+def compile_header_fingerprints(spec: Dict) -> Dict[int, Tuple[str, str, Tuple[str, ...]]]:
+    """{fingerprint id: (label, client, browser families)} from a source's header_fingerprints section"""
+    known = {}
+    for label in ('bot', 'browser'):
+        for item in spec.get(label, []):
+            families = tuple(item.get('families', [item['client']]))
+            known[fingerprint_id(item['fingerprint'])] = (label, item['client'], families)
+    return known
+
+
+def ip_range_mapping(source: Dict) -> Dict[str, List[str]]:
+    """{platform: [cidr, ...]} from a source's ip_ranges section"""
+    return {
+        platform: [item if isinstance(item, str) else item['cidr'] for item in cidrs]
+        for platform, cidrs in source.get('ip_ranges', {}).items()
+    }
+
+
+class SignaturePack:
+    """One immutable generation of signature sets and IP ranges"""
+
+    def __init__(self, version: int, sets: Dict[str, SignatureSet], ip_index, origin: str,
+                 header_fingerprints: Dict[int, Tuple[str, str, Tuple[str, ...]]] = None):
+        self.version = version
+        self.sets = sets
+        self.ip_index = ip_index
+        self.header_fingerprints = header_fingerprints or {}
+        self.origin = origin
+        self.generation = next(_generations)
+        self.loaded_at = time.time()
+
+    def patterns(self, name: str) -> List[str]:
+        return [signature.pattern for signature in self.sets[name].signatures]
+
+    def __getitem__(self, name: str) -> SignatureSet:
+        return self.sets[name]
+
+    @classmethod
+    def from_source(cls, source: Dict, origin: str = DEFAULT_SOURCE_PATH,
+                    extra_ranges_file: str = None) -> 'SignaturePack':
+        """Build a pack in memory straight from a source dict"""
+        index = IPRangeIndex.from_mapping(ip_range_mapping(source))
+        if extra_ranges_file:
+            try:
+                index.load_file(extra_ranges_file)
+            except (OSError, ValueError) as e:
+                logger.error(f"Failed to load platform IP ranges: {e}")
+        return cls(source.get('version', 0), compile_sets(source['sets']), index, origin,
+                   compile_header_fingerprints(source.get('header_fingerprints', {})))
+
+    @classmethod
+    def from_file(cls, path: str) -> 'SignaturePack':
+        """Memory-map a compiled pack read-only"""
+        with open(path, 'rb') as handle:
+            mapped = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if len(mapped) < _HEADER.size:
+            raise ValueError(f"{path}: truncated signature pack")
+        magic, pack_format, metadata_length = _HEADER.unpack_from(mapped, 0)
+        if magic != PACK_MAGIC or pack_format != PACK_FORMAT:
+            raise ValueError(f"{path}: not a format {PACK_FORMAT} signature pack")
+        metadata = json.loads(mapped[_HEADER.size:_HEADER.size + metadata_length].decode('utf-8'))
+
+        ip = metadata['ip']
+        if ip['byteorder'] != sys.byteorder:
+            raise ValueError(f"{path}: pack was built with {ip['byteorder']}-endian tables, rebuild it here")
+
+        view = memoryview(mapped)
+
+        def table(section, item_size, typecode=None):
+            start = section['offset']
+            length = section['count'] * item_size
+            if start + length > len(mapped):
+                raise ValueError(f"{path}: truncated signature pack")
+            chunk = view[start:start + length]
+            return chunk.cast(typecode) if typecode else chunk
+
+        segments = [(owner, frozenset(platforms)) for owner, platforms in ip['segments']]
+        index = MappedIPRangeIndex(
+            v4_starts=table(ip['v4_starts'], 4, 'I'),
+            v4_segment_ids=table(ip['v4_segment_ids'], 2, 'H'),
+            v6_starts=table(ip['v6_starts'], 16),
+            v6_segment_ids=table(ip['v6_segment_ids'], 2, 'H'),
+            segments=segments,
+            range_count=ip['range_count'],
+        )
+        pack = cls(metadata['version'], compile_sets(metadata['sets']), index, path,
+                   compile_header_fingerprints(metadata.get('header_fingerprints', {})))
+        index.version = pack.generation
+        # The index views keep the mapping alive; it is unmapped once the pack is dropped
+        pack._mapped = mapped
+        return pack
+
+
+def build_pack(source: Dict, extra_ranges_file: str = None) -> bytes:
+    """Compile a source dict into the binary pack format
+
+    Layout: header, JSON metadata (sets and IP segment table), then the
+    aligned IPv4 starts (uint32), IPv4 segment ids (uint16), IPv6 starts
+    (16-byte big-endian) and IPv6 segment ids (uint16).
+    """
+    # Fail here rather than in every worker if a pattern doesn't compile
+    try:
+        compile_sets(source['sets'])
+    except re.error as e:
+        raise ValueError(f"Invalid signature pattern: {e}")
+    index = IPRangeIndex.from_mapping(ip_range_mapping(source))
+    if extra_ranges_file:
+        index.load_file(extra_ranges_file)
+
+    segment_ids: Dict = {}
+    tables = {}
+    for version in (4, 6):
+        starts, segments = index.segments(version)
+        # A range ending at the top of the address space leaves a final
+        # no-match boundary one past it, which no address can reach
+        limit = 1 << (32 if version == 4 else 128)
+        while starts and starts[-1] >= limit:
+            starts, segments = starts[:-1], segments[:-1]
+        ids = array('H', [segment_ids.setdefault(segment, len(segment_ids)) for segment in segments])
+        if version == 4:
+            tables['v4_starts'] = array('I', starts).tobytes()
+            tables['v4_segment_ids'] = ids.tobytes()
+        else:
+            tables['v6_starts'] = b''.join(start.to_bytes(16, 'big') for start in starts)
+            tables['v6_segment_ids'] = ids.tobytes()
+    if len(segment_ids) > 0xFFFF:
+        raise ValueError("Too many distinct IP range segments for a pack")
+
+    sets = {
+        name: {key: value for key, value in spec.items() if key != 'description'}
+        for name, spec in source['sets'].items()
+    }
+    header_fingerprints = {label: entries for label, entries in source.get('header_fingerprints', {}).items()
+                           if label != 'description'}
+    ip = {
+        'byteorder': sys.byteorder,
+        'range_count': len(index),
+        'segments': [[owner, sorted(platforms)] for owner, platforms in segment_ids],
+    }
+    item_sizes = {'v4_starts': 4, 'v4_segment_ids': 2, 'v6_starts': 16, 'v6_segment_ids': 2}
+
+    # Offsets depend on the metadata length, which depends on the offsets;
+    # reserve room by laying out twice
+    offset_guess = 0
+    for _ in range(2):
+        offset = offset_guess
+        for name, data in tables.items():
+            ip[name] = {'offset': offset, 'count': len(data) // item_sizes[name]}
+            offset = _aligned(offset + len(data))
+        metadata = json.dumps({
+            'version': source.get('version', 0),
+            'built_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'sets': sets,
+            'header_fingerprints': header_fingerprints,
+            'ip': ip,
+        }, separators=(',', ':')).encode('utf-8')
+        data_start = _aligned(_HEADER.size + len(metadata) + 64)
+        if data_start == offset_guess:
+            break
+        offset_guess = data_start
+
+    output = bytearray(_HEADER.pack(PACK_MAGIC, PACK_FORMAT, len(metadata)))
+    output += metadata
+    for name, data in tables.items():
+        output += b'\0' * (ip[name]['offset'] - len(output))
+        output += data
+    return bytes(output)
+
+
+def _aligned(offset: int) -> int:
+    return (offset + _ALIGN - 1) // _ALIGN * _ALIGN
+
+
+def write_pack(source: Dict, path: str, extra_ranges_file: str = None) -> int:
+    """Build and atomically install a pack, returns its size in bytes
+
+    The new file replaces the old one by rename, so workers still mapping
+    the previous pack keep reading consistent data until they swap.
+    """
+    data = build_pack(source, extra_ranges_file)
+    temp_path = f"{path}.tmp{os.getpid()}"
+    with open(temp_path, 'wb') as handle:
+        handle.write(data)
+        handle.flush()
+        os.fsync(handle.fileno())
+    os.replace(temp_path, path)
+    return len(data)
+
+
+class SignatureRegistry:
+    """Holds the live SignaturePack and swaps it atomically on reload
+
+    With a compiled pack file configured it is memory-mapped; otherwise the
+    JSON source is compiled in memory. Either file is re-checked at most
+    every ``check_interval`` seconds from ``refresh()``.
+    """
+
+    def __init__(self, pack_path: str = None, source_path: str = DEFAULT_SOURCE_PATH,
+                 check_interval: float = 5.0, extra_ranges_file: str = None):
+        self.pack_path = pack_path
+        self.source_path = source_path
+        self.check_interval = check_interval
+        self.extra_ranges_file = extra_ranges_file
+        self.reloads = 0
+        self.failed_reloads = 0
+        self._pack: Optional[SignaturePack] = None
+        self._stamp = None
+        self._next_check = 0.0
+        self._reload_requested = False
+        self._lock = threading.Lock()
+        self._listeners: List[Callable[[SignaturePack], None]] = []
+
+    @property
+    def path(self) -> str:
+        return self.pack_path or self.source_path
+
+    @property
+    def current(self) -> SignaturePack:
+        """The live pack (loaded on first use)"""
+        pack = self._pack
+        if pack is None:
+            self.reload()
+            pack = self._pack
+        return pack
+
+    def refresh(self) -> SignaturePack:
+        """The live pack, reloading first if the file changed or a reload was requested"""
+        now = time.monotonic()
+        if self._reload_requested or now >= self._next_check:
+            self._next_check = now + self.check_interval
+            requested, self._reload_requested = self._reload_requested, False
+            self.reload(force=requested)
+        return self.current
+
+    def _file_stamp(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+    def reload(self, force: bool = False) -> bool:
+        """Load the pack again if its file changed (or always with force), returns True on swap"""
+        with self._lock:
+            stamp = self._file_stamp()
+            if self._pack is not None and not force and stamp == self._stamp:
+                return False
+
+            try:
+                if self.pack_path:
+                    pack = SignaturePack.from_file(self.pack_path)
+                else:
+                    pack = SignaturePack.from_source(load_source(self.source_path), self.source_path,
+                                                     self.extra_ranges_file)
+            except (OSError, ValueError, KeyError, re.error) as e:
+                self.failed_reloads += 1
+                if self._pack is not None:
+                    logger.error(f"Signature pack reload from {self.path} failed, keeping version "
+                                 f"{self._pack.version}: {e}")
+                    self._stamp = stamp
+                    return False
+                # Nothing loaded yet - fall back to the built-in source
+                logger.error(f"Failed to load signature pack {self.path}, using built-in signatures: {e}")
+                pack = SignaturePack.from_source(_default_source(), DEFAULT_SOURCE_PATH,
+                                                 self.extra_ranges_file)
+
+            self._pack = pack
+            self._stamp = stamp
+            if self.reloads:
+                logger.info(f"Signature pack version {pack.version} loaded from {pack.origin}")
+            self.reloads += 1
+            listeners = list(self._listeners)
+
+        for listener in listeners:
+            listener(pack)
+        return True
+
+    def add_listener(self, callback: Callable[[SignaturePack], None]):
+        """Call ``callback(pack)`` after every swap"""
+        self._listeners.append(callback)
+
+    def request_reload(self, *args):
+        """Reload on the next refresh(); safe to call from a signal handler"""
+        self._reload_requested = True
+        self._next_check = 0.0
+
+    def install_signal_handler(self, signal_name: str) -> bool:
+        """Reload when this worker receives the named signal (e.g. SIGUSR2)"""
+        try:
+            signal.signal(getattr(signal, signal_name), self.request_reload)
+        except (AttributeError, ValueError, OSError) as e:
+            # Unknown signal, or not called from the main thread
+            logger.warning(f"Could not install {signal_name} handler for signature reloads: {e}")
+            return False
+        return True
+
+    def stats(self) -> Dict:
+        pack = self._pack
+        return {
+            'path': self.path,
+            'version': pack.version if pack else None,
+            'generation': pack.generation if pack else None,
+            'ip_ranges': len(pack.ip_index) if pack else 0,
+            'signatures': sum(len(s) for s in pack.sets.values()) if pack else 0,
+            'header_fingerprints': len(pack.header_fingerprints) if pack else 0,
+            'reloads': self.reloads,
+            'failed_reloads': self.failed_reloads,
+        }
+
+
+# Shared registry for the application
+signature_registry = SignatureRegistry(
+    pack_path=os.environ.get('SIGNATURE_PACK_FILE') or None,
+    check_interval=float(os.environ.get('SIGNATURE_PACK_CHECK_INTERVAL', '5')),
+    extra_ranges_file=os.environ.get('PLATFORM_IP_RANGES_FILE') or None,
+)
+if os.environ.get('SIGNATURE_PACK_SIGNAL'):
+    signature_registry.install_signal_handler(os.environ['SIGNATURE_PACK_SIGNAL'])
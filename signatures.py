@@ -0,0 +1,82 @@
+"""
+Compiled signature matching for SmartTicker
+Pattern lists are compiled once at import into a single alternation so a
+user agent is scanned once per signature set instead of once per pattern
+"""
+
+import re
+from dataclasses import dataclass
+from typing import Iterable, List, Optional
+
+
+@dataclass(frozen=True)
+class Signature:
+    """A single detection pattern with its platform and weight"""
+    id: str
+    pattern: str
+    platform: Optional[str] = None
+    weight: float = 0.0
+
+
+class SignatureSet:
+    """Group of signatures matched with one combined regex scan"""
+
+    def __init__(self, name: str, signatures: Iterable[Signature], flags: int = 0):
+        self.name = name
+        self.flags = flags
+        self.signatures = tuple(signatures)
+        self._compiled = tuple(re.compile(sig.pattern, flags) for sig in self.signatures)
+        if self.signatures:
+            alternation = '|'.join(f'(?:{sig.pattern})' for sig in self.signatures)
+            self._combined = re.compile(alternation, flags)
+        else:
+            self._combined = None
+
+    @classmethod
+    def from_patterns(cls, name: str, patterns: Iterable[str], platform: str = None,
+                      weight: float = 0.0, flags: int = 0) -> 'SignatureSet':
+        """Build a set from a plain list of regex strings"""
+        signatures = [
+            Signature(id=f'{name}:{index}', pattern=pattern, platform=platform, weight=weight)
+            for index, pattern in enumerate(patterns)
+        ]
+        return cls(name, signatures, flags)
+
+    @classmethod
+    def from_literals(cls, name: str, literals: Iterable[str], platform: str = None,
+                      weight: float = 0.0, flags: int = 0) -> 'SignatureSet':
+        """Build a set that matches plain substrings rather than regexes"""
+        return cls.from_patterns(name, [re.escape(literal) for literal in literals],
+                                 platform, weight, flags)
+
+    def __len__(self) -> int:
+        return len(self.signatures)
+
+    def search(self, text: str) -> bool:
+        """True if any signature matches - a single scan of the text"""
+        if text is None or self._combined is None:
+            return False
+        return self._combined.search(text) is not None
+
+    def first(self, text: str) -> Optional[Signature]:
+        """First matching signature in declaration order"""
+        if not self.search(text):
+            return None
+        for signature, compiled in zip(self.signatures, self._compiled):
+            if compiled.search(text):
+                return signature
+        return None
+
+    def matches(self, text: str) -> List[Signature]:
+        """All matching signatures in declaration order
+
+        The combined scan rejects non-matching text up front, so the
+        per-pattern pass only runs for text that matched at least once.
+        """
+        if not self.search(text):
+            return []
+        return [
+            signature
+            for signature, compiled in zip(self.signatures, self._compiled)
+            if compiled.search(text)
+        ]
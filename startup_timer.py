@@ -0,0 +1,44 @@
+"""
+Cold-start timing
+Wall time spent in each phase of importing the app (framework, models, routes,
+schema check, ...), logged once at startup and reported under ``startup`` in
+/api/metrics. For a per-module breakdown of a phase run
+``python -X importtime -c "import app"``.
+"""
+
+import time
+from typing import Dict
+
+
+class StartupTimer:
+    """Consecutive named phases since the timer was created"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.finished = None
+        self.phases: Dict[str, float] = {}
+        self._last = self.started
+
+    def mark(self, phase: str):
+        """Close the current phase under this name"""
+        now = time.perf_counter()
+        self.phases[phase] = self.phases.get(phase, 0.0) + (now - self._last)
+        self._last = now
+
+    def finish(self) -> float:
+        """Stop timing, returns the total in seconds"""
+        self.finished = self._last
+        return self.finished - self.started
+
+    def stats(self) -> Dict:
+        end = self.finished if self.finished is not None else self._last
+        return {
+            'total_ms': round((end - self.started) * 1000, 1),
+            'phases_ms': {phase: round(seconds * 1000, 1) for phase, seconds in self.phases.items()},
+        }
+
+    def summary(self) -> str:
+        return ', '.join(f"{phase} {seconds * 1000:.0f}ms" for phase, seconds in self.phases.items())
+
+
+startup_timer = StartupTimer()
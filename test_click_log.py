@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Test the local click log segments
+Records written to a segment read back unchanged, and a record torn or
+corrupted by a crash is detected with everything before it kept
+"""
+import os
+import sys
+import tempfile
+from datetime import datetime
+
+from click_log import RECORD_HEADER, SEALED_SUFFIX, ClickLog, encode_record, list_segments, read_segment
+
+ROWS = [
+    {'smart_link_id': index, 'click_type': 'human', 'platform': 'tiktok', 'referrer': 'ünïcode ✓',
+     'created_at': datetime(2024, 1, 1, 12, 0, index).isoformat()}
+    for index in range(20)
+]
+
+
+def _write_segment(directory, rows):
+    path = os.path.join(directory, f"clicks-1-00000001-1700000000000{SEALED_SUFFIX}")
+    with open(path, 'wb') as handle:
+        for row in rows:
+            handle.write(encode_record(row))
+    return path
+
+
+def test_round_trip():
+    with tempfile.TemporaryDirectory() as directory:
+        rows, clean = read_segment(_write_segment(directory, ROWS))
+        assert clean, "an intact segment was reported torn"
+        assert rows == ROWS
+
+
+def test_click_log_round_trip():
+    with tempfile.TemporaryDirectory() as directory:
+        log = ClickLog(directory, fsync_interval=0.01)
+        for row in ROWS:
+            assert log.append(row), "append failed"
+        log.close()
+
+        segments = list_segments(directory)
+        assert segments, "closing the log sealed no segment"
+        rows = []
+        for path in segments:
+            segment_rows, clean = read_segment(path)
+            assert clean
+            rows += segment_rows
+        assert rows == ROWS
+
+
+def test_torn_tail():
+    with tempfile.TemporaryDirectory() as directory:
+        path = _write_segment(directory, ROWS)
+        last = len(encode_record(ROWS[-1]))
+        size = os.path.getsize(path)
+        # Cut inside the last payload, then inside the last header
+        for cut in (size - last // 2, size - last + RECORD_HEADER.size // 2):
+            with open(path, 'r+b') as handle:
+                handle.truncate(cut)
+            rows, clean = read_segment(path)
+            assert not clean, f"a segment cut at {cut} was reported intact"
+            assert rows == ROWS[:-1]
+
+
+def test_corrupt_record():
+    with tempfile.TemporaryDirectory() as directory:
+        path = _write_segment(directory, ROWS)
+        # Flip one byte in the payload of the 6th record
+        offset = sum(len(encode_record(row)) for row in ROWS[:5]) + RECORD_HEADER.size + 3
+        with open(path, 'r+b') as handle:
+            handle.seek(offset)
+            byte = handle.read(1)
+            handle.seek(offset)
+            handle.write(bytes([byte[0] ^ 0xFF]))
+        rows, clean = read_segment(path)
+        assert not clean, "a corrupt record passed its checksum"
+        assert rows == ROWS[:5]
+
+
+TESTS = [
+    test_round_trip,
+    test_click_log_round_trip,
+    test_torn_tail,
+    test_corrupt_record,
+]
+
+if __name__ == "__main__":
+    print("🧪 Testing click log segments")
+    failed = 0
+    for test in TESTS:
+        try:
+            test()
+            print(f"✅ {test.__name__}")
+        except AssertionError as e:
+            failed += 1
+            print(f"❌ {test.__name__}: {e}")
+    sys.exit(1 if failed else 0)
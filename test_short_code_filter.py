@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Test the unknown short code filter locally
+A code that exists must never be ruled out: checks the counting Bloom filter
+after adds and removes, and a filter rebuilt from the database
+"""
+import os
+import sys
+import random
+import string
+import tempfile
+
+# A throwaway SQLite database for the rebuild test
+os.environ.setdefault('DATABASE_URL', f"sqlite:///{tempfile.mkdtemp()}/test_short_code_filter.db")
+
+from app import app, db
+from models import User, SmartLink
+from short_code_filter import CountingBloomFilter, ShortCodeFilter
+
+
+def _codes(count, seed):
+    rng = random.Random(seed)
+    alphabet = string.ascii_letters + string.digits
+    return list({''.join(rng.choice(alphabet) for _ in range(7)) for _ in range(count)})
+
+
+def test_no_false_negatives_after_add():
+    bloom = CountingBloomFilter(capacity=5000, error_rate=0.01)
+    codes = _codes(5000, seed=1)
+    for code in codes:
+        bloom.add(code)
+    missing = [code for code in codes if code not in bloom]
+    assert not missing, f"{len(missing)} added codes ruled out"
+
+    # Unknown codes are mostly ruled out (the false-positive rate is the configured one)
+    unknown = [code for code in _codes(5000, seed=2) if code not in set(codes)]
+    false_positives = sum(code in bloom for code in unknown)
+    assert false_positives < len(unknown) * 0.03, f"{false_positives} false positives"
+
+
+def test_no_false_negatives_after_remove():
+    bloom = CountingBloomFilter(capacity=2000, error_rate=0.01)
+    codes = _codes(2000, seed=3)
+    for code in codes:
+        bloom.add(code)
+    removed, kept = codes[:1000], codes[1000:]
+    for code in removed:
+        assert bloom.remove(code), f"could not remove {code}"
+    missing = [code for code in kept if code not in bloom]
+    assert not missing, f"{len(missing)} codes ruled out after removing others"
+    assert bloom.count == len(kept)
+
+
+def test_no_false_negatives_after_rebuild():
+    codes = _codes(300, seed=4)
+    with app.app_context():
+        db.create_all()
+        user = User(email='filter-test@example.com')
+        db.session.add(user)
+        db.session.commit()
+        for code in codes:
+            db.session.add(SmartLink(user_id=user.id, short_code=code, target_url='https://example.com/', title='t'))
+        db.session.commit()
+
+    code_filter = ShortCodeFilter(capacity=1000)
+    code_filter.rebuild()
+    assert code_filter.builds == 1, "the rebuild failed"
+    missing = [code for code in codes if not code_filter.may_exist(code)]
+    assert not missing, f"{len(missing)} stored codes ruled out after a rebuild"
+
+
+TESTS = [
+    test_no_false_negatives_after_add,
+    test_no_false_negatives_after_remove,
+    test_no_false_negatives_after_rebuild,
+]
+
+if __name__ == "__main__":
+    print("🧪 Testing the short code filter")
+    failed = 0
+    for test in TESTS:
+        try:
+            test()
+            print(f"✅ {test.__name__}")
+        except AssertionError as e:
+            failed += 1
+            print(f"❌ {test.__name__}: {e}")
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Test short code allocation locally
+Checks that the keyed permutation is one-to-one, that codes are always 7
+characters and that forked workers never hand out the same codes
+"""
+import os
+import sys
+import json
+import random
+import tempfile
+
+# A throwaway SQLite database for the allocator's sequence row
+os.environ.setdefault('DATABASE_URL', f"sqlite:///{tempfile.mkdtemp()}/test_short_codes.db")
+
+from app import app
+from short_codes import ALPHABET, CODE_LENGTH, CODE_SPACE, ShortCodeAllocator, encode, permute
+
+KEY = bytes.fromhex('00112233445566778899aabbccddeeff')
+
+
+def test_permute_is_bijection():
+    """Distinct values map to distinct values inside the code space"""
+    samples = list(range(20000))                       # start of the counter
+    samples += list(range(CODE_SPACE - 20000, CODE_SPACE))  # end of the space
+    rng = random.Random(7)
+    samples += rng.sample(range(CODE_SPACE), 20000)   # anywhere in between
+    samples = set(samples)
+
+    images = {permute(value, KEY) for value in samples}
+    assert len(images) == len(samples), "two counter values share a code"
+    assert all(0 <= image < CODE_SPACE for image in images), "a code fell outside the code space"
+
+    # A different key gives a different mapping
+    assert [permute(value, KEY) for value in range(100)] != [permute(value, b'other key') for value in range(100)]
+
+
+def test_permute_rejects_out_of_range():
+    for value in (-1, CODE_SPACE):
+        try:
+            permute(value, KEY)
+        except ValueError:
+            continue
+        raise AssertionError(f"permute accepted {value}")
+
+
+def test_encode_is_fixed_width():
+    for value in (0, 1, len(ALPHABET), CODE_SPACE // 2, CODE_SPACE - 1):
+        code = encode(value)
+        assert len(code) == CODE_LENGTH, f"{value} encoded as {code!r}"
+        assert all(character in ALPHABET for character in code)
+    assert encode(0) == ALPHABET[0] * CODE_LENGTH
+    assert encode(CODE_SPACE - 1) == ALPHABET[-1] * CODE_LENGTH
+
+
+def _allocate_in_child(allocator, count):
+    """Allocate in a forked child and return its codes"""
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        try:
+            with app.app_context():
+                codes = allocator.allocate_many(count)
+            os.write(write_fd, json.dumps(codes).encode('utf-8'))
+        finally:
+            os._exit(0)
+    os.close(write_fd)
+    with os.fdopen(read_fd, 'rb') as pipe:
+        data = pipe.read()
+    os.waitpid(pid, 0)
+    return json.loads(data)
+
+
+def test_allocator_blocks_dont_overlap_across_forks():
+    allocator = ShortCodeAllocator(block_size=50, sequence='test_forks')
+    with app.app_context():
+        # The parent holds a partly used block when the workers fork
+        parent = allocator.allocate_many(10)
+        children = [_allocate_in_child(allocator, 75) for _ in range(3)]
+        parent += allocator.allocate_many(60)
+
+    codes = parent + [code for child in children for code in child]
+    assert all(len(child) == 75 for child in children), "a child failed to allocate"
+    assert len(codes) == len(set(codes)), "forked workers handed out the same code"
+
+
+TESTS = [
+    test_permute_is_bijection,
+    test_permute_rejects_out_of_range,
+    test_encode_is_fixed_width,
+    test_allocator_blocks_dont_overlap_across_forks,
+]
+
+if __name__ == "__main__":
+    print("🧪 Testing short code allocation")
+    failed = 0
+    for test in TESTS:
+        try:
+            test()
+            print(f"✅ {test.__name__}")
+        except AssertionError as e:
+            failed += 1
+            print(f"❌ {test.__name__}: {e}")
+    sys.exit(1 if failed else 0)
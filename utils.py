@@ -1,132 +1,33 @@
-import re
-import urllib.request
-import urllib.error
-import dns.resolver
-import ipaddress
+from dataclasses import dataclass
+from typing import Dict
 from flask import request
-from flask_mail import Message
-from app import mail
+from app import get_mail
+from signature_pack import default_patterns, signature_registry
+from detection_engine import DetectionResult, detection_engine
 
-# Enhanced bot detection patterns with platform-specific detection
-BOT_PATTERNS = [
-    # TikTok crawlers (comprehensive coverage)
-    r'bytespider',              # Main TikTok crawler
-    r'tiktok',                  # Generic TikTok pattern
-    r'musicallybot',            # Legacy Musical.ly bot
-    r'bytedance',               # Parent company crawlers
-    r'tiktok.*bot',             # TikTok variants
-    r'douyin',                  # Chinese TikTok version
-    
-    # Meta/Facebook family
-    r'facebookexternalhit',     # Facebook link preview
-    r'facebookcatalog',         # Facebook catalog
-    r'instagrambot',            # Instagram crawler
-    r'instagram\s+\d+',        # Instagram in-app browser (e.g., Instagram 303.0.0.11.109)
-    r'meta.*bot',               # Meta variants
-    r'FBAN',                    # Facebook App identifier
-    r'FBAV',                    # Facebook App version
-    r'FBIOS',                   # Facebook iOS app
-    r'FBDV',                    # Facebook device
-    r'\[FB',                    # Facebook in-app browser pattern
-    
-    # Twitter/X
-    r'twitterbot',
-    r'x.*bot',                  # New X branding
-    
-    # Other major platforms
-    r'linkedinbot',
-    r'whatsapp',
-    r'telegrambot',
-    r'snapchat.*bot',
-    r'discordbot',
-    r'slackbot',
-    r'pinterestbot',
-    r'redditbot',
-    
-    # Search engines
-    r'googlebot',
-    r'bingbot',
-    r'applebot',
-    r'baiduspider',
-    r'yandexbot',
-    
-    # Generic patterns
-    r'crawler',
-    r'spider',
-    r'scraper',
-    r'bot/',
-    r'headless',
-    r'phantom',
-    r'selenium',
-    r'puppeteer'
-]
-
-# Platform-specific in-app browser patterns
-IN_APP_BROWSER_PATTERNS = [
-    # TikTok patterns
-    r'bytespider',
-    r'tiktok',
-    r'musically',
-    r'bytedance',
-    r'douyin',
-    r'aweme',                   # TikTok internal name
-    r'com\.zhiliaoapp\.musically',  # TikTok mobile app identifier
-    r'musical_ly',
-    r'bytedancewebview',        # TikTok in-app browser WebView
-    
-    # Instagram patterns
-    r'instagram\s+[\d\.]+',   # Instagram app with version (e.g., Instagram 303.0.0.11.109)
-    
-    # Facebook patterns  
-    r'\[FBAN/',                # Facebook App Network identifier
-    r'FBAV/',                   # Facebook App Version
-    r'FBIOS',                   # Facebook iOS
-    r'FBDV/',                   # Facebook Device
-]
-
-# Legacy variable for backward compatibility
-TIKTOK_SPECIFIC_PATTERNS = IN_APP_BROWSER_PATTERNS[:9]  # First 9 are TikTok patterns
-
-# Platform IP ranges (simplified - in production, use complete CIDR blocks)
-PLATFORM_IP_RANGES = {
-    'tiktok': [
-        '103.216.0.0/16',       # TikTok Singapore
-        '161.117.0.0/16',       # ByteDance US
-        '49.51.0.0/16',         # TikTok Asia Pacific
-    ],
-    'facebook': [
-        '31.13.0.0/16',         # Facebook main
-        '66.220.0.0/16',        # Facebook crawlers
-        '69.63.0.0/16',         # Facebook infrastructure
-    ],
-    'google': [
-        '66.249.0.0/16',        # Googlebot
-        '64.233.0.0/16',        # Google services
-    ]
-}
+# Built-in pattern lists from signature_pack.json, kept for scripts that
+# inspect them. The checks below match against the live signature pack.
+BOT_PATTERNS = default_patterns('bot')
+IN_APP_BROWSER_PATTERNS = default_patterns('in_app_browser')
+TIKTOK_SPECIFIC_PATTERNS = default_patterns('tiktok')
+SUSPICIOUS_UA_PATTERNS = default_patterns('suspicious_ua')
+AUTOMATION_INDICATORS = default_patterns('automation')
 
 def is_bot_user_agent(user_agent):
     """Check if user agent matches known bot patterns"""
     if not user_agent:
         return True
     
-    user_agent_lower = user_agent.lower()
-    for pattern in BOT_PATTERNS:
-        if re.search(pattern, user_agent_lower):
-            return True
-    return False
+    return signature_registry.current.sets['bot'].search(user_agent.lower())
 
 def is_tiktok_bot(user_agent, ip_address=None):
     """Enhanced TikTok-specific bot detection"""
     if not user_agent:
         return True
     
-    user_agent_lower = user_agent.lower()
-    
     # Check TikTok-specific patterns
-    for pattern in TIKTOK_SPECIFIC_PATTERNS:
-        if re.search(pattern, user_agent_lower):
-            return True
+    if signature_registry.current.sets['tiktok'].search(user_agent.lower()):
+        return True
     
     # Check IP ranges if available
     if ip_address and is_platform_ip(ip_address, 'tiktok'):
@@ -146,9 +47,8 @@ def is_social_media_bot(user_agent, platform=None):
     user_agent_lower = user_agent.lower()
     
     # Check for any in-app browser patterns
-    for pattern in IN_APP_BROWSER_PATTERNS:
-        if re.search(pattern, user_agent_lower):
-            return True
+    if signature_registry.current.sets['in_app_browser'].search(user_agent_lower):
+        return True
     
     # Additional platform-specific checks
     if platform:
@@ -163,19 +63,10 @@ def is_social_media_bot(user_agent, platform=None):
 
 def is_platform_ip(ip_address, platform):
     """Check if IP address belongs to a specific platform"""
-    if not ip_address or platform not in PLATFORM_IP_RANGES:
+    if not ip_address:
         return False
     
-    try:
-        ip_obj = ipaddress.ip_address(ip_address)
-        for cidr in PLATFORM_IP_RANGES[platform]:
-            network = ipaddress.ip_network(cidr, strict=False)
-            if ip_obj in network:
-                return True
-    except (ValueError, ipaddress.AddressValueError):
-        pass
-    
-    return False
+    return signature_registry.current.ip_index.contains(ip_address, platform)
 
 def detect_platform_from_request(user_agent=None, referrer=None, ip_address=None):
     """Comprehensive platform detection from request data"""
@@ -190,7 +81,7 @@ def detect_platform_from_request(user_agent=None, referrer=None, ip_address=None
     referrer_lower = referrer.lower() if referrer else ''
     
     # TikTok detection
-    if (any(re.search(pattern, user_agent_lower) for pattern in TIKTOK_SPECIFIC_PATTERNS) or
+    if (signature_registry.current.sets['tiktok'].search(user_agent_lower) or
         'tiktok.com' in referrer_lower or 'musically.com' in referrer_lower or
         is_platform_ip(ip_address, 'tiktok')):
         return 'tiktok'
@@ -209,37 +100,38 @@ def detect_platform_from_request(user_agent=None, referrer=None, ip_address=None
     # Fallback to referrer-based detection
     return get_platform_from_referrer(referrer)
 
-def analyze_request_fingerprint():
+def analyze_request_fingerprint(headers=None):
     """Analyze request characteristics for bot detection"""
+    if headers is None:
+        headers = request.headers
     suspicion_score = 0
     
     # Check missing headers that real browsers typically send
     expected_headers = ['Accept', 'Accept-Language', 'Accept-Encoding', 'Connection']
-    missing_headers = [h for h in expected_headers if not request.headers.get(h)]
+    missing_headers = [h for h in expected_headers if not headers.get(h)]
     suspicion_score += len(missing_headers) * 10
     
     # Check for overly simple Accept header
-    accept_header = request.headers.get('Accept', '')
+    accept_header = headers.get('Accept', '')
     if accept_header in ['*/*', 'text/html', '']:
         suspicion_score += 15
     
     # Check for missing Accept-Language
-    if not request.headers.get('Accept-Language'):
+    if not headers.get('Accept-Language'):
         suspicion_score += 20
     
     # Check for suspicious connection patterns
-    connection = request.headers.get('Connection', '').lower()
+    connection = headers.get('Connection', '').lower()
     if connection in ['close', '']:
         suspicion_score += 10
     
     # Check User-Agent length and complexity
-    user_agent = request.headers.get('User-Agent', '')
+    user_agent = headers.get('User-Agent', '')
     if len(user_agent) < 50:  # Real browsers have longer user agents
         suspicion_score += 25
     
     # Check for common automation tool signatures
-    automation_indicators = ['headless', 'phantom', 'selenium', 'puppeteer', 'playwright']
-    if any(indicator in user_agent.lower() for indicator in automation_indicators):
+    if signature_registry.current.sets['automation'].search(user_agent.lower()):
         suspicion_score += 50
     
     return suspicion_score
@@ -276,38 +168,81 @@ def get_platform_from_user_agent(user_agent):
     else:
         return 'unknown'
 
-def is_suspicious_request():
-    """Enhanced suspicious request detection using fingerprinting"""
-    user_agent = request.headers.get('User-Agent', '')
-    
+def has_suspicious_user_agent(user_agent):
+    """Check for very short user agents and common scripting clients"""
     # Very short or missing user agent
     if len(user_agent) < 20:
         return True
     
     # Check for common spoofing patterns
-    suspicious_patterns = [
-        r'curl',
-        r'wget',
-        r'python',
-        r'requests',
-        r'httpie',
-        r'postman',
-        r'scrapy',
-        r'mechanize',
-        r'urllib'
-    ]
+    return signature_registry.current.sets['suspicious_ua'].search(user_agent.lower())
+
+def is_suspicious_request(headers=None):
+    """Enhanced suspicious request detection using fingerprinting"""
+    if headers is None:
+        headers = request.headers
+    user_agent = headers.get('User-Agent', '')
     
-    user_agent_lower = user_agent.lower()
-    for pattern in suspicious_patterns:
-        if pattern in user_agent_lower:
-            return True
+    if has_suspicious_user_agent(user_agent):
+        return True
     
     # Use advanced fingerprinting
-    suspicion_score = analyze_request_fingerprint()
+    suspicion_score = analyze_request_fingerprint(headers)
     
     # Consider suspicious if score is above threshold
     return suspicion_score >= 30
 
+@dataclass
+class RequestVerdict:
+    """Every detection signal for one request, computed in a single pass"""
+    detection: DetectionResult
+    is_bot_legacy: bool
+    is_tiktok_legacy: bool
+    is_suspicious: bool
+    suspicion_score: int
+    platform: str
+    
+    @property
+    def is_bot(self) -> bool:
+        return self.detection.is_bot or self.is_bot_legacy
+    
+    @property
+    def is_tiktok(self) -> bool:
+        return self.detection.is_sophisticated_tiktok or self.is_tiktok_legacy
+    
+    @property
+    def confidence_score(self) -> float:
+        return self.detection.confidence_score
+    
+    @property
+    def risk_level(self) -> str:
+        return self.detection.risk_level
+
+def analyze_redirect_request(user_agent=None, ip_address=None, referrer=None, headers: Dict = None,
+                             short_code=None):
+    """Run the engine and the legacy detectors once over the same request data"""
+    if headers is None:
+        headers = dict(request.headers)
+    if user_agent is None:
+        user_agent = headers.get('User-Agent', '')
+    if referrer is None:
+        referrer = headers.get('Referer', '')
+    if ip_address is None:
+        ip_address = request.remote_addr
+    
+    detection = detection_engine.analyze_request(user_agent, ip_address, referrer, headers,
+                                                short_code=short_code)
+    suspicion_score = analyze_request_fingerprint(headers)
+    
+    return RequestVerdict(
+        detection=detection,
+        is_bot_legacy=is_bot_user_agent(user_agent),
+        is_tiktok_legacy=is_tiktok_bot(user_agent, ip_address),
+        is_suspicious=has_suspicious_user_agent(user_agent) or suspicion_score >= 30,
+        suspicion_score=suspicion_score,
+        platform=detection.platform
+    )
+
 def send_magic_link_email(email, token):
     """Send magic link email for authentication"""
     subject = "Your SmartLink Login Link"
@@ -335,6 +270,10 @@ def send_magic_link_email(email, token):
     SmartLink Team
     """
     
+    # Mail, DNS and HTTP clients are imported on first use: redirect-only
+    # processes never need them
+    from flask_mail import Message
+    mail = get_mail()  # registers the extension Message() reads its sender from
     msg = Message(
         subject=subject,
         recipients=[email],
@@ -369,6 +308,7 @@ def verify_domain_ownership(domain, verification_token, method='dns'):
 
 def verify_domain_dns(domain, verification_token):
     """Verify domain ownership via DNS TXT record on _smartlink-verify subdomain"""
+    import dns.resolver
     try:
         verification_subdomain = f"_smartlink-verify.{domain}"
         txt_records = dns.resolver.resolve(verification_subdomain, 'TXT')
@@ -384,6 +324,8 @@ def verify_domain_dns(domain, verification_token):
 
 def verify_domain_file(domain, verification_token):
     """Verify domain ownership via file-based verification"""
+    import urllib.request
+    import urllib.error
     try:
         verification_url = f"http://{domain}/.well-known/smartlink-verification.txt"
         